@@ -6,11 +6,19 @@ This module provides the FastAPI app for the clusterfun web app.
 """
 
 import os
+import re
 from pathlib import Path
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# dynamic endpoints with large responses, compressed on the fly
+COMPRESSED_PATHS = re.compile(r"^/api/views/[^/]+/(filter|filter/mask|viewport|media-metadata)$")
+# responses smaller than this are not worth compressing
+COMPRESSION_MINIMUM_SIZE = 1024
 
 
 class ClusterfunApp(FastAPI):
@@ -21,13 +29,32 @@ class ClusterfunApp(FastAPI):
     media_directory: str = "/media"
 
 
+class PathGZipMiddleware(GZipMiddleware):
+    """
+    GZip middleware that only compresses the responses of the paths matching a pattern.
+    The view payload is compressed at save time, so it should not be compressed again.
+    """
+
+    def __init__(self, app: ASGIApp, paths: re.Pattern, minimum_size: int = 500, compresslevel: int = 6):
+        super().__init__(app, minimum_size=minimum_size, compresslevel=compresslevel)
+        self.paths = paths
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http" and self.paths.match(scope["path"]):
+            await super().__call__(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+
 APP = ClusterfunApp(docs_url=None, redoc_url=None)
+APP.add_middleware(PathGZipMiddleware, paths=COMPRESSED_PATHS, minimum_size=COMPRESSION_MINIMUM_SIZE)
 APP.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Set the static files directory
@@ -38,7 +38,9 @@ class Config:  # pylint: disable=too-many-instance-attributes
     y : Optional[str]
         The column name to use for the y axis.
     save_method : str
-        The method to use for saving the plot. One of "local" or "s3".
+        The method to use for saving the plot. One of "local", "parquet" or "s3".
+        "parquet" stores the data as a Parquet file instead of a SQLite database,
+        which is faster for wide dataframes.
     colors : Optional[List[str]]
         A list of colors to use for coloring the plot. This is used for setting
         the colors quickly.
@@ -57,6 +59,9 @@ class Config:  # pylint: disable=too-many-instance-attributes
         The value for a vertical line.
     hline: Optional[float] = None
         The value for a horizontal line.
+    indexed_columns: Optional[List[str]] = None
+        Additional columns to create a database index on. The color, x, y and display columns,
+        and columns with few distinct values are always indexed.
     """
 
     type: str
@@ -79,3 +84,4 @@ class Config:  # pylint: disable=too-many-instance-attributes
     labels: Optional[List[str]] = None
     vline: Optional[float] = None
     hline: Optional[float] = None
+    indexed_columns: Optional[List[str]] = None
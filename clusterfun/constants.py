@@ -22,3 +22,6 @@ COLORS = [
     "#C0C0C0",  # silver
     "#800000",  # maroon
 ]
+
+# the file with the data of views stored as Parquet, see clusterfun/storage/parquet/storer.py
+PARQUET_FILE = "data.parquet"
@@ -0,0 +1,95 @@
+"""
+executors.py
+============
+
+This module provides the executors that run the blocking work of the API, so the async routes do not block
+the event loop. The work is split over separately sized thread pools, so one kind of work cannot starve another:
+a slow image download from S3 or a large pandas job does not hold up the database queries of grid paging.
+
+- DB_EXECUTOR: database queries and reading the files of a view, e.g. streaming exports batch by batch
+- MEDIA_EXECUTOR: loading media, e.g. downloading images from S3
+- CPU_EXECUTOR: pandas work, e.g. creating a grid of labeled items
+
+The number of threads of each executor can be set with the CLUSTERFUN_DB_WORKERS, CLUSTERFUN_MEDIA_WORKERS
+and CLUSTERFUN_CPU_WORKERS environment variables.
+
+Functions
+---------
+run_in(executor: Executor, func: Callable[..., T], *args, **kwargs) -> T
+    Run a blocking function in an executor and wait for its result.
+iterate_in(executor: Executor, iterator: Iterator[T]) -> AsyncIterator[T]
+    Iterate over a blocking iterator in an executor.
+"""
+
+import asyncio
+import functools
+import os
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+CPU_COUNT = os.cpu_count() or 1
+DB_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("CLUSTERFUN_DB_WORKERS", str(min(32, CPU_COUNT + 4)))),
+    thread_name_prefix="clusterfun-db",
+)
+MEDIA_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("CLUSTERFUN_MEDIA_WORKERS", "32")), thread_name_prefix="clusterfun-media"
+)
+CPU_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("CLUSTERFUN_CPU_WORKERS", str(CPU_COUNT))), thread_name_prefix="clusterfun-cpu"
+)
+
+_DONE = object()
+
+
+async def run_in(executor: Executor, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking function in an executor and wait for its result.
+
+    Parameters
+    ----------
+    executor : Executor
+        The executor to run the function in, e.g. DB_EXECUTOR
+    func : Callable[..., T]
+        The blocking function
+    *args : Any
+        The positional arguments of the function
+    **kwargs : Any
+        The keyword arguments of the function
+
+    Returns
+    -------
+    T
+        The result of the function
+    """
+    return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+
+async def iterate_in(executor: Executor, iterator: Iterator[T]) -> AsyncIterator[T]:
+    """Iterate over a blocking iterator in an executor, e.g. an iterator that reads a file in chunks.
+    The iterator is closed when the iteration stops, also when it stops early, e.g. when the client of
+    a streaming response disconnects, so a generator can release its resources in a `finally`.
+
+    Parameters
+    ----------
+    executor : Executor
+        The executor to get the items of the iterator in
+    iterator : Iterator[T]
+        The blocking iterator
+
+    Returns
+    -------
+    AsyncIterator[T]
+        The items of the iterator
+    """
+    try:
+        while True:
+            item = await run_in(executor, next, iterator, _DONE)
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            await run_in(executor, close)
@@ -12,167 +12,333 @@ GET /
     Serve index.html as the default file.
 GET /views/{view_uuid}
     Retrieve plot data for a specific view by its UUID.
+GET /views/{view_uuid}/data.bin
+    Retrieve plot data for a specific view as typed arrays, see clusterfun/storage/local/binary.py.
+GET /views
+    List the stored plots, most recent first.
+PUT /views/{view_uuid}/pin
+    Pin a plot, so it is never removed from the cache directory.
+DELETE /views/{view_uuid}/pin
+    Unpin a plot.
+GET /cache-stats
+    Retrieve the statistics of the in-memory caches.
 GET /uuid
     Retrieve the most recent plot UUID.
+POST /views/{view_uuid}/selections
+    Register a selection of media ids, filters and/or a box or lasso region of a scatter plot,
+    returning a token to use instead of the media ids.
+DELETE /views/{view_uuid}/selections/{token}
+    Remove a registered selection.
 GET /views/{view_uuid}/config
     Retrieve the configuration for a specific plot view by its UUID.
 GET /views/{view_uuid}/media/{media_id}
     Retrieve a media item associated with a specific plot by its UUID and media ID.
 POST /views/{view_uuid}/media
     Retrieve multiple media items associated with a specific plot by their UUID and media IDs.
+    The cursor of the next page is returned in the X-Next-Cursor header.
 POST /views/{view_uuid}/filter
-    Filter plot based on a list of provided filters.
+    Filter plot based on a list of provided filters. The results of recently used filters are cached.
+POST /views/{view_uuid}/filter/mask
+    Filter plot based on a list of provided filters, returning the ids of the matching points as a binary mask.
+POST /views/{view_uuid}/viewport
+    Retrieve the points of a scatter plot inside a viewport, or their density bins if there are too many.
+POST /views/{view_uuid}/download-grid
+    Download the media selected in the grid as CSV, Parquet or Arrow, streamed in batches of rows.
+POST /views/{view_uuid}/label-download
+    Download the labeled media as CSV, Parquet or Arrow, streamed in batches of rows.
+
+The routes are async: blocking work is run in the database, media and CPU executors of clusterfun/executors.py,
+so e.g. slow media downloads do not hold up the database queries of other requests.
 
 """
 
+import asyncio
 import dataclasses
-from typing import Any, Dict, List, Union
+from typing import Any, Dict, Iterator, List, Union
 
+import orjson
 import pandas as pd
-from fastapi import Request
-from fastapi.responses import FileResponse, HTMLResponse, StreamingResponse
+import pyarrow as pa
+from fastapi import Query, Request, Response
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, StreamingResponse
 from pydantic import BaseModel
 
 from clusterfun.app import APP, FRONTEND_DIR
+from clusterfun.executors import CPU_EXECUTOR, DB_EXECUTOR, MEDIA_EXECUTOR, iterate_in, run_in
 from clusterfun.models.filter import Filter
 from clusterfun.models.media_indices import MediaIndices
 from clusterfun.models.media_item import Label, MediaItem
-from clusterfun.plot import Plot
+from clusterfun.models.selection import SelectionRequest
+from clusterfun.models.viewport import Viewport
 from clusterfun.plot_types.grid import grid
+from clusterfun.storage import get_loader
+from clusterfun.storage.local.catalog import Catalog
+from clusterfun.storage.local.column_engine import ENGINES
+from clusterfun.storage.local.column_stats import format_value_counts
+from clusterfun.storage.local.compression import get_encoding
+from clusterfun.storage.local.density import PyramidNotFoundError
+from clusterfun.storage.local.exports import EXPORT_FORMATS, ExportFormat, stream_export
+from clusterfun.storage.local.filter_cache import FILTER_RESULTS
+from clusterfun.storage.local.helpers import get_cache_dir
 from clusterfun.storage.local.label_manager import count_labels
-from clusterfun.storage.local.loader import LocalLoader
+from clusterfun.storage.local.loader import (
+    LocalLoader,
+    fetch_page,
+    filter_json,
+    filter_mask,
+    get_binary_data_path,
+    get_column_stats,
+    get_label_export_batches,
+    get_media_ids,
+    get_viewport,
+    select,
+    stream_view,
+    to_media_item,
+)
+from clusterfun.storage.local.pagination import InvalidCursorError
+from clusterfun.storage.local.selections import SELECTIONS, SelectionNotFoundError
+from clusterfun.storage.local.view_state import VIEW_STATES
+from clusterfun.validation import ColumnNotFoundException
+
+
+@APP.get("/api/views")
+async def list_views(limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
+    """List the stored plots as stored in the catalog of the cache directory, most recent first."""
+    views = await run_in(DB_EXECUTOR, Catalog(get_cache_dir()).get_views, limit=limit, offset=offset)
+    return [dataclasses.asdict(view) for view in views]
+
+
+@APP.put("/api/views/{view_uuid}/pin")
+async def pin_view(view_uuid: str) -> bool:
+    """Pin a plot, so it is never removed from the cache directory. Returns whether the plot was found."""
+    return await run_in(DB_EXECUTOR, Catalog(get_cache_dir()).set_pinned, view_uuid, True)
+
+
+@APP.delete("/api/views/{view_uuid}/pin")
+async def unpin_view(view_uuid: str) -> bool:
+    """Unpin a plot, so it can be removed from the cache directory again. Returns whether the plot was found."""
+    return await run_in(DB_EXECUTOR, Catalog(get_cache_dir()).set_pinned, view_uuid, False)
 
 
 @APP.get("/api/views/{view_uuid}")
-def read_view(view_uuid: str) -> Dict[str, Any]:
-    """Retrieve plot data for its UUID."""
-    return Plot.load(view_uuid).as_json()
+async def read_view(view_uuid: str, request: Request) -> StreamingResponse:
+    """Retrieve plot data for its UUID.
+    The stored data is streamed from disk as it is, with the uuid and config after it.
+    If the client accepts it, the data compressed at save time is sent instead."""
+    loader = await get_loader_async(view_uuid)
+    encoding = await run_in(DB_EXECUTOR, get_encoding, request.headers.get("accept-encoding", ""), loader.cache_dir)
+    headers = {"Vary": "Accept-Encoding"}
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    chunks = await run_in(DB_EXECUTOR, stream_view, loader, encoding=encoding)
+    return StreamingResponse(iterate_in(DB_EXECUTOR, chunks), media_type="application/json", headers=headers)
+
+
+@APP.get("/api/views/{view_uuid}/data.bin")
+async def read_view_binary(view_uuid: str) -> FileResponse:
+    """Retrieve plot data for its UUID, with the trace arrays as little-endian typed arrays."""
+    loader = await get_loader_async(view_uuid)
+    return FileResponse(await run_in(DB_EXECUTOR, get_binary_data_path, loader), media_type="application/octet-stream")
+
+
+@APP.get("/api/cache-stats")
+async def read_cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Retrieve the number of entries, hits and misses of the in-memory caches."""
+    return {
+        "views": VIEW_STATES.stats(),
+        "selections": SELECTIONS.stats(),
+        "filters": FILTER_RESULTS.stats(),
+        "engines": ENGINES.stats(),
+    }
 
 
 @APP.get("/api/uuid")
-def get_recent_uuid() -> str:
+async def get_recent_uuid() -> str:
     """Retrieve the most recent plot UUID as stored in the cache directory."""
-    return LocalLoader("recent").cache_dir.stem
+    return (await get_loader_async("recent")).cache_dir.stem
+
+
+@APP.post("/api/views/{view_uuid}/selections")
+async def create_selection(view_uuid: str, request: SelectionRequest) -> Dict[str, Any]:
+    """Register a selection of media by its media ids, filters and/or a box or lasso region of a scatter plot,
+    see clusterfun/storage/local/spatial.py.
+    Returns the token to pass as `selection` instead of the media ids in later requests, and the selection size."""
+    loader = await get_loader_async(view_uuid)
+    selection = await run_in(DB_EXECUTOR, select, loader, request)
+    return {"selection": selection.token, "size": len(selection)}
+
+
+@APP.delete("/api/views/{view_uuid}/selections/{token}")
+async def delete_selection(view_uuid: str, token: str) -> bool:
+    """Remove a registered selection. Returns whether the selection was registered."""
+    loader = await get_loader_async(view_uuid)
+    return SELECTIONS.remove(loader.cache_dir, token)
+
+
+@APP.exception_handler(SelectionNotFoundError)
+async def selection_not_found(request: Request, exc: SelectionNotFoundError):  # pylint: disable=unused-argument
+    """A selection that is not registered (anymore) should be registered again by the client."""
+    return JSONResponse(status_code=404, content={"detail": exc.args[0]})
+
+
+@APP.exception_handler(ColumnNotFoundException)
+async def column_not_found(request: Request, exc: ColumnNotFoundException):  # pylint: disable=unused-argument
+    """A column that is not a column of the view."""
+    return JSONResponse(status_code=404, content={"detail": exc.args[0]})
+
+
+@APP.exception_handler(InvalidCursorError)
+async def invalid_cursor(request: Request, exc: InvalidCursorError):  # pylint: disable=unused-argument
+    """Only cursors returned with a page can be used to get the next page."""
+    return JSONResponse(status_code=400, content={"detail": exc.args[0]})
+
+
+@APP.exception_handler(PyramidNotFoundError)
+async def pyramid_not_found(request: Request, exc: PyramidNotFoundError):  # pylint: disable=unused-argument
+    """Only scatter plots with numeric x and y columns have a density pyramid."""
+    return JSONResponse(status_code=404, content={"detail": exc.args[0]})
 
 
 @APP.get("/api/views/{view_uuid}/config")
-def read_config(view_uuid: str) -> Dict[str, Any]:
+async def read_config(view_uuid: str) -> Dict[str, Any]:
     """Retrieve the configuration for a specific plot by its UUID."""
-    return dataclasses.asdict(LocalLoader(view_uuid).load_config())
+    loader = await get_loader_async(view_uuid)
+    return dataclasses.asdict(await run_in(DB_EXECUTOR, loader.load_config))
 
 
 @APP.get("/api/views/{view_uuid}/media/{media_id}")
-def read_media(view_uuid: str, media_id: int, as_base64: bool = False) -> MediaItem:
+async def read_media(view_uuid: str, media_id: int, as_base64: bool = False) -> MediaItem:
     """Retrieve a media item associated with a specific plot by its UUID and media ID."""
-    return LocalLoader(view_uuid).get_row(media_id, as_base64=as_base64)
+    loader = await get_loader_async(view_uuid)
+    row, state = await run_in(DB_EXECUTOR, lambda: (loader.fetch_row(media_id), loader.state))
+    return await run_in(MEDIA_EXECUTOR, to_media_item, row, state, as_base64=as_base64)
 
 
 @APP.post("/api/views/{view_uuid}/media")
-def read_medias(view_uuid: str, media_ids: MediaIndices) -> List[MediaItem]:
-    """Retrieve multiple media items associated with a specific plot by their UUID and media IDs."""
-    return LocalLoader(view_uuid).get_rows(media_ids)
+async def read_medias(view_uuid: str, media_ids: MediaIndices, response: Response) -> List[MediaItem]:
+    """Retrieve multiple media items associated with a specific plot by their UUID and media IDs.
+    The media of the items is loaded concurrently.
+    If there is a next page, its cursor is returned in the X-Next-Cursor header."""
+    loader = await get_loader_async(view_uuid)
+    (rows, cursor), state = await run_in(DB_EXECUTOR, lambda: (fetch_page(loader, media_ids), loader.state))
+    if cursor is not None:
+        response.headers["X-Next-Cursor"] = cursor
+    return list(await asyncio.gather(*(run_in(MEDIA_EXECUTOR, to_media_item, row, state) for row in rows)))
 
 
 @APP.post("/api/views/{view_uuid}/filter")
-def filter_view(view_uuid: str, filters: List[Filter]) -> List[Dict[str, Any]]:
-    """Filter plot based on a list of provided filters."""
-    return LocalLoader(view_uuid).filter(filters)
+async def filter_view(view_uuid: str, filters: List[Filter]) -> Response:
+    """Filter plot based on a list of provided filters.
+    The serialized results of recently used filters are cached, see clusterfun/storage/local/filter_cache.py."""
+    loader = await get_loader_async(view_uuid)
+    return Response(await run_in(DB_EXECUTOR, filter_json, loader, filters), media_type="application/json")
+
+
+@APP.post("/api/views/{view_uuid}/filter/mask")
+async def filter_view_mask(view_uuid: str, filters: List[Filter]) -> Response:
+    """Filter plot based on a list of provided filters, returning just the ids of the matching points
+    as a binary mask over the ids of the view, see clusterfun/storage/local/masks.py."""
+    loader = await get_loader_async(view_uuid)
+    return Response(await run_in(DB_EXECUTOR, filter_mask, loader, filters), media_type="application/octet-stream")
+
+
+@APP.post("/api/views/{view_uuid}/viewport")
+async def read_viewport(view_uuid: str, viewport: Viewport) -> Response:
+    """Retrieve the points of a scatter plot inside a viewport, or the density bins of the viewport with
+    a representative media id per bin if there are too many points, see clusterfun/storage/local/density.py."""
+    loader = await get_loader_async(view_uuid)
+    content = await run_in(
+        DB_EXECUTOR, lambda: orjson.dumps(get_viewport(loader, viewport))  # pylint: disable=no-member
+    )
+    return Response(content, media_type="application/json")
 
 
 @APP.post("/api/views/{view_uuid}/media-metadata")
-def read_media_metadata(view_uuid: str, media_ids: MediaIndices) -> List[Dict[str, Any]]:
+async def read_media_metadata(view_uuid: str, media_ids: MediaIndices) -> List[Dict[str, Any]]:
     """Retrieve metadata for media items associated with a specific plot by their UUID and media IDs."""
-    return LocalLoader(view_uuid).get_rows_metadata(media_ids)
+    loader = await get_loader_async(view_uuid)
+    return await run_in(DB_EXECUTOR, loader.get_rows_metadata, media_ids)
 
 
 @APP.post("/api/views/{view_uuid}/download-grid")
-def download_grid(view_uuid: str, media_indices: MediaIndices) -> FileResponse:
-    """Download the data selected in the grid"""
-    loader = LocalLoader(view_uuid)
-    df = loader.get_dataframe(media_indices=media_indices)
+async def download_grid(
+    view_uuid: str, media_indices: MediaIndices, export_format: ExportFormat = Query("csv", alias="format")
+) -> StreamingResponse:
+    """Download the data selected in the grid as CSV, Parquet or Arrow, streamed in batches of rows."""
+    loader = await get_loader_async(view_uuid)
+    schema, batches = await run_in(DB_EXECUTOR, loader.get_export_batches, media_indices, export_format=export_format)
     # TODO:: include labels
-    return StreamingResponse(
-        iter([df.to_csv(index=False)]),
-        media_type="text/csv",
-        headers={"Content-Disposition": "attachment; filename=data.csv"},
-    )
+    return stream_export_response(schema, batches, export_format, "data")
 
 
 @APP.delete("/api/views/{view_uuid}/label")
-def delete_labels(
+async def delete_labels(
     view_uuid: str,
     label: Label,
     media_indices: MediaIndices,
 ) -> str:
     """Delete a label for a media item."""
-    loader = LocalLoader(view_uuid)
-    loader.label_manager.delete_label(label.title, media_indices.media_ids)
+    loader = await get_loader_async(view_uuid)
+    media_ids = await run_in(DB_EXECUTOR, get_media_ids, loader.cache_dir, media_indices)
+    await run_in(DB_EXECUTOR, loader.label_manager.delete_label, label.title, media_ids)
     return "OK"
 
 
 @APP.post("/api/views/{view_uuid}/label")
-def save_labels(
+async def save_labels(
     view_uuid: str,
     label: Label,
     media_indices: MediaIndices,
 ) -> str:
     """Save a label for a media item."""
-    loader = LocalLoader(view_uuid)
-    loader.label_manager.save_label(label.title, media_indices.media_ids)
+    loader = await get_loader_async(view_uuid)
+    media_ids = await run_in(DB_EXECUTOR, get_media_ids, loader.cache_dir, media_indices)
+    await run_in(DB_EXECUTOR, loader.label_manager.save_label, label.title, media_ids)
     return "OK"
 
 
 @APP.post("/api/views/{view_uuid}/label-download")
-def download_labels(
+async def download_labels(
     view_uuid: str,
     label: Label,
     media_indices: MediaIndices,
-):
-    """Download all labels for the given view as a csv file."""
-    loader = LocalLoader(view_uuid)
-    df = loader.label_manager.get_dataframe(label=label.title if label.title != "" else None)
-
-    # limit to selection if media_indices is provided
-    if len(media_indices.media_ids) > 0:
-        df = df[df["media_id"].isin(media_indices.media_ids)]
-
-    dff = loader.get_dataframe(MediaIndices(media_ids=df["media_id"].tolist()))
-    df = pd.merge(df, dff, left_on="media_id", right_on="id")
-
-    return StreamingResponse(
-        iter([df.to_csv(index=False)]),
-        media_type="text/csv",
-        headers={"Content-Disposition": f"attachment; filename={view_uuid}_labels.csv"},
+    export_format: ExportFormat = Query("csv", alias="format"),
+) -> StreamingResponse:
+    """Download all labels for the given view as CSV, Parquet or Arrow, streamed in batches of rows."""
+    loader = await get_loader_async(view_uuid)
+    schema, batches = await run_in(
+        DB_EXECUTOR,
+        get_label_export_batches,
+        loader,
+        label.title if label.title != "" else None,
+        media_indices,
+        export_format=export_format,
     )
+    return stream_export_response(schema, batches, export_format, f"{view_uuid}_labels")
 
 
 @APP.post("/api/views/{view_uuid}/labels-count")
-def count(view_uuid: str, media_indices: MediaIndices) -> List[Dict[str, Any]]:
+async def count(view_uuid: str, media_indices: MediaIndices) -> List[Dict[str, Any]]:
     """Count the number of labels for the given view."""
-    loader = LocalLoader(view_uuid)
-    labels = loader.label_manager.read_labels()
-    return count_labels(labels, media_indices.media_ids)
+    loader = await get_loader_async(view_uuid)
+    return await run_in(
+        DB_EXECUTOR, lambda: count_labels(loader.state.labels, get_media_ids(loader.cache_dir, media_indices))
+    )
 
 
 @APP.post("/api/views/{view_uuid}/label-to-grid")
-def to_grid(
+async def to_grid(
     view_uuid: str,
     label: Label,
     media_indices: MediaIndices,
 ) -> str:
     """Saved all labeled items for a given label as a grid."""
-    loader = LocalLoader(view_uuid)
-    df = loader.label_manager.get_dataframe(label.title if label.title != "" else None)
-
-    # limit to selection if media_indices is provided
-    if len(media_indices.media_ids) > 0:
-        df = df[df["media_id"].isin(media_indices.media_ids)]
-
-    cfg = loader.load_config()
-    dff = loader.get_dataframe(MediaIndices(media_ids=df["media_id"].tolist()))
-    df = pd.merge(df, dff, left_on="media_id", right_on="id")
-
-    url = grid(
+    loader = await get_loader_async(view_uuid)
+    df = await get_labeled_dataframe(loader, label, media_indices)
+    cfg = await run_in(DB_EXECUTOR, loader.load_config)
+    url = await run_in(
+        CPU_EXECUTOR,
+        grid,
         df.drop(columns=["id"]),
         media=cfg.media,
         show=False,
@@ -190,25 +356,56 @@ class ColumnInfo(BaseModel):
 
 
 @APP.get("/api/views/{view_uuid}/columns", response_model=List[ColumnInfo])
-def columns(view_uuid: str) -> List[ColumnInfo]:
-    """Get the columns of the view."""
-    df = LocalLoader(view_uuid).get_dataframe()
-    column_info = []
-    for col in df.columns:
-        column_info.append(ColumnInfo(name=col, dtype=str(df[col].dtype)))
-    return column_info
+async def columns(view_uuid: str) -> List[ColumnInfo]:
+    """Get the columns of the view, with their dtypes as computed when the view was stored."""
+    loader = await get_loader_async(view_uuid)
+    state = await run_in(DB_EXECUTOR, lambda: loader.state)
+    return [ColumnInfo(name=stats.name, dtype=stats.dtype) for stats in state.column_stats.values()]
 
 
 @APP.post("/api/views/{view_uuid}/columns/{column}/values", response_model=List[Dict[str, Union[str, int]]])
-def column_values(
+async def column_values(
     view_uuid: str,
     column: str,
     media_indices: MediaIndices,
 ) -> List[Dict[str, Union[str, int]]]:
-    """Get the columns of the view."""
-    df = LocalLoader(view_uuid).get_dataframe(media_indices=media_indices if len(media_indices.media_ids) > 0 else None)
-    value_counts = df[column].sort_values().astype(str).value_counts()
-    return [{"label": value, "count": count} for value, count in value_counts.items()]
+    """Get the counts of the values of a column, in the selection if any.
+    The counts of all rows are taken from the column statistics, the counts in a selection are queried."""
+    loader = await get_loader_async(view_uuid)
+    column_stats = await run_in(DB_EXECUTOR, lambda: get_column_stats(loader.state, column))
+    value_counts = await run_in(
+        DB_EXECUTOR, loader.get_value_counts, column, None if media_indices.is_empty else media_indices
+    )
+    return format_value_counts(value_counts, column_stats.dtype)
+
+
+async def get_loader_async(view_uuid: str) -> LocalLoader:
+    """Get the loader for a view in the database executor, as finding the most recent view queries the catalog."""
+    return await run_in(DB_EXECUTOR, get_loader, view_uuid)
+
+
+def stream_export_response(
+    schema: pa.Schema, batches: Iterator[pa.RecordBatch], export_format: ExportFormat, name: str
+) -> StreamingResponse:
+    """Stream record batches as an export file, written and sent one batch at a time in the database executor."""
+    media_type, extension = EXPORT_FORMATS[export_format]
+    return StreamingResponse(
+        iterate_in(DB_EXECUTOR, stream_export(schema, batches, export_format)),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={name}.{extension}"},
+    )
+
+
+async def get_labeled_dataframe(loader: LocalLoader, label: Label, media_indices: MediaIndices) -> pd.DataFrame:
+    """Get the labeled items with their data, limited to the label (if any) and the selection (if any)."""
+    df = await run_in(CPU_EXECUTOR, loader.label_manager.get_dataframe, label.title if label.title != "" else None)
+
+    # limit to selection if media_indices is provided
+    if not media_indices.is_empty:
+        df = df[df["media_id"].isin(await run_in(DB_EXECUTOR, get_media_ids, loader.cache_dir, media_indices))]
+
+    dff = await run_in(DB_EXECUTOR, loader.get_dataframe, MediaIndices(media_ids=df["media_id"].tolist()))
+    return await run_in(CPU_EXECUTOR, pd.merge, df, dff, left_on="media_id", right_on="id")
 
 
 @APP.get("/{path:path}", response_class=HTMLResponse)
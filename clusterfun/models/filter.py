@@ -19,7 +19,7 @@ is_float(element: Any) -> bool
     Determines if an element can be converted to a float.
 """
 
-from typing import Any, List, Union
+from typing import Any, Collection, List, Optional, Union
 
 from pydantic import BaseModel  # pylint: disable=no-name-in-module
 
@@ -42,7 +42,7 @@ class Filter(BaseModel):  # pylint: disable=too-few-public-methods
     comparison: str
     values: List[Union[str, float, int]]
 
-    def is_valid(self, columns: List[str], con) -> bool:
+    def is_valid(self, columns: List[str], con=None, column_values: Optional[Collection[Any]] = None) -> bool:
         """
         Validation of given values to prevent injection and SQL errors.
         Parameters
@@ -50,6 +50,9 @@ class Filter(BaseModel):  # pylint: disable=too-few-public-methods
         columns: List[str]
             List of columns in the table
         con: connection object for the database
+        column_values: Optional[Collection[Any]]
+            The distinct values of the filter column. If given, non-numeric values are
+            validated against these instead of querying the database.
 
         Returns
         -------
@@ -62,12 +65,12 @@ class Filter(BaseModel):  # pylint: disable=too-few-public-methods
             if self.comparison not in [">", "<", "=", "!=", ">=", "<=", "IN", "NOT IN"]:
                 return False
             # validate result of value: should be value of column if categorical else number
-            if (
-                not str(value).isnumeric()
-                and not is_float(value)
-                and not filter_value_in_column(self.column, value, con)
-            ):
-                return False
+            if not str(value).isnumeric() and not is_float(value):
+                if column_values is not None:
+                    if value not in column_values:
+                        return False
+                elif not filter_value_in_column(self.column, value, con):
+                    return False
             if value == "":
                 return False
             return True
@@ -7,6 +7,10 @@ indices with optional sorting and pagination. The MediaIndices class is built on
 Pydantic's BaseModel, providing data validation and serialization functionality.
 
 A media index is a unique identifier for a media file, so that we can load it from a database.
+Pages are selected by page number, or by the cursor returned with the previous page,
+see clusterfun/storage/local/pagination.py.
+Instead of the media indices, a selection registered on the server can be given by its token,
+see clusterfun/storage/local/selections.py.
 
 Classes
 -------
@@ -16,7 +20,7 @@ MediaIndices
 
 from typing import List, Optional
 
-from pydantic import BaseModel  # pylint: disable=no-name-in-module
+from pydantic import BaseModel, Field  # pylint: disable=no-name-in-module
 
 from clusterfun.models.filter import Filter  # pylint: disable=no-name-in-module
 
@@ -27,11 +31,19 @@ class MediaIndices(BaseModel):  # pylint: disable=too-few-public-methods
     Used for selecting a page of media in the grid view.
     """
 
-    media_ids: List[int]
+    media_ids: List[int] = []
+    selection: Optional[str] = None
     page: int = 0
+    page_size: int = Field(default=50, gt=0, le=1000)
+    cursor: Optional[str] = None
     sort_column: Optional[str] = None
     ascending: Optional[bool] = None
     filters: Optional[List[Filter]] = None
 
+    @property
+    def is_empty(self) -> bool:
+        """Whether no media indices or selection are given, e.g. to use all data instead."""
+        return len(self.media_ids) == 0 and self.selection is None
+
     def __len__(self) -> int:
         return len(self.media_ids)
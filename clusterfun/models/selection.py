@@ -0,0 +1,45 @@
+"""
+selection.py
+============
+
+This module provides the SelectionRequest class to register a selection of media on the server,
+by its media indices, by filters, by a region of a scatter plot or by any combination of these.
+The registered selection is referred to by its token, see clusterfun/storage/local/selections.py.
+
+Classes
+-------
+Region
+    A class representing a region of a scatter plot, a box and/or a lasso polygon.
+SelectionRequest
+    A class representing a selection of media to register, by media indices, filters and/or a region.
+"""
+
+from typing import List, Optional, Tuple
+
+from pydantic import BaseModel, Field, FiniteFloat  # pylint: disable=no-name-in-module
+
+from clusterfun.models.filter import Filter  # pylint: disable=no-name-in-module
+
+
+class Region(BaseModel):  # pylint: disable=too-few-public-methods
+    """
+    A class representing a region of a scatter plot in the coordinates of its x and y columns:
+    a box by the ranges of its axes, a lasso by the vertices of its polygon, or the part of the polygon inside the box.
+    An axis without a range is unbounded. See clusterfun/storage/local/spatial.py.
+    """
+
+    x_range: Optional[Tuple[FiniteFloat, FiniteFloat]] = None
+    y_range: Optional[Tuple[FiniteFloat, FiniteFloat]] = None
+    polygon: Optional[List[Tuple[FiniteFloat, FiniteFloat]]] = Field(default=None, min_length=3)
+
+
+class SelectionRequest(BaseModel):  # pylint: disable=too-few-public-methods
+    """
+    A class representing a selection of media to register, by media indices, filters and/or a region.
+    If more than one is given, the selection contains the media that match all of them.
+    If none is given, the selection contains all media.
+    """
+
+    media_ids: Optional[List[int]] = None
+    filters: Optional[List[Filter]] = None
+    region: Optional[Region] = None
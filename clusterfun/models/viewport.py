@@ -0,0 +1,30 @@
+"""
+viewport.py
+===========
+
+This module provides the Viewport class to request the part of a scatter plot that is visible in the browser,
+see clusterfun/storage/local/density.py.
+
+Classes
+-------
+Viewport
+    A class representing the visible part of a plot, in data coordinates and in pixels.
+"""
+
+from typing import Tuple
+
+from pydantic import BaseModel, Field, FiniteFloat  # pylint: disable=no-name-in-module
+
+
+class Viewport(BaseModel):  # pylint: disable=too-few-public-methods
+    """
+    A class representing the visible part of a plot: the ranges of the axes and the size of the plot in pixels.
+    If at most `max_points` points are visible, the points are returned, otherwise their density bins.
+    The ranges should be finite, NaN or infinite ranges are rejected.
+    """
+
+    x_range: Tuple[FiniteFloat, FiniteFloat]
+    y_range: Tuple[FiniteFloat, FiniteFloat]
+    width: int = Field(gt=0, le=16384)
+    height: int = Field(gt=0, le=16384)
+    max_points: int = Field(default=20_000, gt=0, le=1_000_000)
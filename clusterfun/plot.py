@@ -20,7 +20,7 @@ import socket
 import webbrowser
 from functools import partial
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Union
 from uuid import uuid4
 
 import pandas as pd
@@ -29,8 +29,10 @@ from fastapi.staticfiles import StaticFiles
 
 from clusterfun.app import APP
 from clusterfun.config import Config
-from clusterfun.storage.local.loader import LocalLoader
+from clusterfun.storage import get_loader, get_storer
+from clusterfun.storage.local.helpers import get_common_media_path, get_media_directory, is_local_media
 from clusterfun.storage.local.storer import LocalStorer
+from clusterfun.storage.sources import DataSource, iter_chunks
 
 
 def run_server(local_host: str, local_port: int):
@@ -99,8 +101,10 @@ class Plot:
 
     Methods
     -------
-    save(df: pd.DataFrame, cfg: Config) -> 'Plot':
+    save(df: Union[pd.DataFrame, DataSource], cfg: Config) -> 'Plot':
         Save a plot to local storage and return an instance of the Plot class.
+    append(uuid: str, df: pd.DataFrame) -> 'Plot':
+        Append rows to a stored plot, without saving the plot again.
     load(uuid: str) -> 'Plot':
         Load a plot from local storage using its unique identifier.
     load_config(uuid: str) -> Config:
@@ -131,14 +135,17 @@ class Plot:
         self.cfg = cfg
 
     @classmethod
-    def save(cls, df: pd.DataFrame, cfg: Config) -> "Plot":
+    def save(cls, df: Union[pd.DataFrame, DataSource], cfg: Config) -> "Plot":
         """
         Save a plot to local storage and return an instance of the Plot class.
 
         Parameters
         ----------
-        df : pd.DataFrame
+        df : Union[pd.DataFrame, DataSource]
             The data to be visualized in the plot, as a DataFrame.
+            Can also be an iterable of DataFrame chunks, a path to a Parquet or CSV file
+            or a pyarrow RecordBatchReader, in which case the data is saved chunk by chunk
+            and is not kept in memory. The data of the returned plot is then empty.
         cfg : Config
             The configuration object for the plot.
 
@@ -147,21 +154,54 @@ class Plot:
         Plot
             An instance of the Plot class with the saved data and configuration.
         """
+        uuid = str(uuid4())
+        if not isinstance(df, pd.DataFrame):
+            get_storer(cfg.save_method).save_chunks(uuid, iter_chunks(df), cfg)
+            if cfg.common_media_path is not None:
+                APP.mount("/media", StaticFiles(directory=cfg.common_media_path), name="media")
+            return cls(uuid, {}, cfg)
         # copy dataframe to not change original input
         df = df.copy()
-        uuid = str(uuid4())
-        if not str(df[cfg.media].iloc[0]).startswith("http") and not str(df[cfg.media].iloc[0]).startswith("s3://"):
+        if is_local_media(df[cfg.media].iloc[0]):
             # assume all media paths are local and replace with /media
-            common_media_path = os.path.commonpath(df[cfg.media].tolist())
-            if os.path.isfile(common_media_path):
-                common_media_path = os.path.dirname(common_media_path)
+            common_media_path = get_media_directory(get_common_media_path(df[cfg.media].tolist()))
             # store common media path in config
             cfg.common_media_path = common_media_path
             df[cfg.media] = df[cfg.media].astype(str).str.replace(str(common_media_path), "/media")
             APP.mount("/media", StaticFiles(directory=common_media_path), name="media")
-        LocalStorer().save(uuid, df, cfg)
+        get_storer(cfg.save_method).save(uuid, df, cfg)
         return cls(uuid, df.to_dict(), cfg)
 
+    @classmethod
+    def append(cls, uuid: str, df: pd.DataFrame) -> "Plot":
+        """
+        Append rows to a stored plot, without saving the plot again.
+        The existing rows keep their ids, so labels given to them stay valid.
+
+        Parameters
+        ----------
+        uuid : str
+            The unique identifier for the plot.
+        df : pd.DataFrame
+            The rows to append, with the same columns as the data of the plot.
+            Local media should be in the same directory as the media of the plot.
+
+        Returns
+        -------
+        Plot
+            An instance of the Plot class with the appended data and the updated configuration.
+        """
+        cfg = get_loader(uuid).load_config()
+        # copy dataframe to not change original input
+        df = df.copy()
+        if cfg.common_media_path is not None:
+            media = df[cfg.media].astype(str)
+            if not media.str.startswith(cfg.common_media_path).all():
+                raise ValueError(f"All media should be in {cfg.common_media_path} to append to this plot")
+            df[cfg.media] = media.str.replace(cfg.common_media_path, "/media")
+        get_storer(cfg.save_method).append(uuid, df)
+        return cls(uuid, df.to_dict(), cls.load_config(uuid))
+
     @classmethod
     def load(cls, uuid: str, cache_dir: Optional[Path] = None) -> "Plot":
         """
@@ -177,7 +217,7 @@ class Plot:
         Plot
             An instance of the Plot class with the loaded data and configuration.
         """
-        return cls(*LocalLoader(uuid, cache_dir).load())
+        return cls(*get_loader(uuid, cache_dir).load())
 
     @staticmethod
     def load_config(uuid: str) -> Config:
@@ -194,7 +234,7 @@ class Plot:
         Config
             The configuration object for the plot.
         """
-        return LocalLoader(uuid).load_config()
+        return get_loader(uuid).load_config()
 
     def as_json(self) -> Dict[str, Any]:
         """
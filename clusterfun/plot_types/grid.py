@@ -20,27 +20,34 @@ from clusterfun.config import Config
 from clusterfun.plot import Plot
 from clusterfun.plot_types import DOCSTRING_STANDARD
 from clusterfun.storage.local.helpers import get_columns_for_db
+from clusterfun.storage.sources import DataSource, split_source
 from clusterfun.validation import validate
 
 
 def grid(  # pylint: disable=missing-function-docstring, too-many-arguments
-    df: pd.DataFrame,
+    df: Union[pd.DataFrame, DataSource],
     media: str,
     title: Optional[str] = None,
     bounding_box: Optional[str] = None,
     show: bool = True,
     display: Optional[Union[str, List[str]]] = None,
 ) -> Path:  # pylint: disable=too-many-arguments
+    sample, df = split_source(df)
     cfg = Config(
         type="grid",
         media=media,
         bounding_box=bounding_box,
-        columns=get_columns_for_db(df, media, "grid"),
+        columns=get_columns_for_db(sample, media, "grid"),
         title=title,
         display=display,
     )
-    validate(df, cfg)
+    validate(sample, cfg)
     return Plot.save(df, cfg).show(show)
 
 
-grid.__doc__ = "Display just a grid of images." + DOCSTRING_STANDARD
+grid.__doc__ = """Display just a grid of images.
+    :param df: Union[pd.DataFrame, DataSource]
+        The dataframe with the data to plot.
+        Can also be an iterable of dataframes, a path to a Parquet or CSV file
+        or a pyarrow RecordBatchReader, to plot data that does not fit in memory.
+""" + DOCSTRING_STANDARD
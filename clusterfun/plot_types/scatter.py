@@ -14,11 +14,12 @@ from clusterfun.config import Config
 from clusterfun.plot import Plot
 from clusterfun.plot_types import DOCSTRING_STANDARD
 from clusterfun.storage.local.helpers import get_columns_for_db
+from clusterfun.storage.sources import DataSource, split_source
 from clusterfun.validation import validate
 
 
 def scatter(
-    df: pd.DataFrame,
+    df: Union[pd.DataFrame, DataSource],
     x: str,
     y: str,
     media: str,
@@ -31,12 +32,13 @@ def scatter(
     hline: Optional[float] = None,
     vline: Optional[float] = None,
 ):  # pylint: disable=too-many-arguments,missing-function-docstring
+    sample, df = split_source(df)
     cfg = Config(
         type="scatter",
         x=x,
         y=y,
         media=media,
-        columns=get_columns_for_db(df, media, "scatter", x, y),
+        columns=get_columns_for_db(sample, media, "scatter", x, y),
         color=color,
         bounding_box=bounding_box,
         title=title,
@@ -45,14 +47,16 @@ def scatter(
         vline=vline,
         hline=hline,
     )
-    validate(df, cfg)
+    validate(sample, cfg)
     return Plot.save(df, cfg).show(show)
 
 
 scatter.__doc__ = (
     """
-        :param df: pd.DataFrame
-            The dataframe with the data to plot
+        :param df: Union[pd.DataFrame, DataSource]
+            The dataframe with the data to plot.
+            Can also be an iterable of dataframes, a path to a Parquet or CSV file
+            or a pyarrow RecordBatchReader, to plot data that does not fit in memory.
         :param x: str
             The column name of the data to plot on the x-axis.
         :param y: str
@@ -1,20 +1,68 @@
-"""File to serve a plot from local storage using its unique identifier."""
+"""File to serve a plot from local storage using its unique identifier,
+or to remove old plots from local storage with `clusterfun gc`."""
 
 import argparse
 import os
+import sys
 from pathlib import Path
+from typing import List
 
 from fastapi.staticfiles import StaticFiles
 
 from clusterfun.app import APP
 from clusterfun.plot import Plot
+from clusterfun.storage.local.cache_manager import CacheManager, parse_bytes
+from clusterfun.storage.local.helpers import get_cache_dir
 from clusterfun.storage.local.loader import LocalLoader
 
 
+def gc(args: List[str]):
+    """
+    Remove plots from local storage that exceed the maximum age or byte budget.
+    Pinned plots and plots with labels are never removed.
+    """
+    parser = argparse.ArgumentParser(
+        prog="clusterfun gc",
+        description="Remove the least recently used plots from local storage. "
+        "Pinned plots and plots with labels are never removed.",
+    )
+    parser.add_argument(
+        "--max-bytes",
+        type=parse_bytes,
+        help="The byte budget, e.g. 10G. Defaults to the CLUSTERFUN_CACHE_MAX_BYTES environment variable.",
+    )
+    parser.add_argument(
+        "--max-age-days",
+        type=float,
+        help="The maximum number of days since a plot was last opened. "
+        "Defaults to the CLUSTERFUN_CACHE_MAX_AGE_DAYS environment variable.",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="Only list the plots that would be removed.")
+    parsed = parser.parse_args(args)
+
+    cache_manager = CacheManager.from_env(get_cache_dir())
+    if parsed.max_bytes is not None:
+        cache_manager.max_bytes = parsed.max_bytes
+    if parsed.max_age_days is not None:
+        cache_manager.max_age_days = parsed.max_age_days
+    if not cache_manager.enabled:
+        parser.error(
+            "set --max-bytes or --max-age-days, or the CLUSTERFUN_CACHE_MAX_BYTES "
+            "or CLUSTERFUN_CACHE_MAX_AGE_DAYS environment variable"
+        )
+    removed = cache_manager.collect(dry_run=parsed.dry_run)
+    for view in removed:
+        print(f"{'Would remove' if parsed.dry_run else 'Removed'} {view.uuid} ({view.bytes:,} bytes)")
+    print(f"{'Would free' if parsed.dry_run else 'Freed'} {sum(view.bytes for view in removed):,} bytes")
+
+
 def main():
     """
     Serve a plot from local storage using its unique identifier.
     """
+    if len(sys.argv) > 1 and sys.argv[1] == "gc":
+        gc(sys.argv[2:])
+        return
     parser = argparse.ArgumentParser(description="Serve a plot from local storage using its unique identifier.")
     parser.add_argument(
         "location",
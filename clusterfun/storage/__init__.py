@@ -0,0 +1,54 @@
+"""Storage module, selects the storer and loader for a plot."""
+
+from pathlib import Path
+from typing import Optional
+
+from clusterfun.constants import PARQUET_FILE
+from clusterfun.storage.local.loader import LocalLoader
+from clusterfun.storage.local.storer import LocalStorer
+from clusterfun.storage.parquet.loader import ParquetLoader
+from clusterfun.storage.parquet.storer import ParquetStorer
+
+STORER_REGISTRY = {
+    "local": LocalStorer,
+    "parquet": ParquetStorer,
+}
+
+
+def get_storer(save_method: str, cache_dir: Optional[Path] = None) -> LocalStorer:
+    """Get the storer for the given save method, default to LocalStorer.
+
+    Parameters
+    ----------
+    save_method : str
+        The save method as set in the config, e.g. "local" or "parquet"
+    cache_dir : Optional[Path], optional
+        The directory to store the data in, by default None
+
+    Returns
+    -------
+    LocalStorer
+        The storer for the save method
+    """
+    return STORER_REGISTRY.get(save_method, LocalStorer)(cache_dir)
+
+
+def get_loader(uuid: str, cache_dir: Optional[Path] = None) -> LocalLoader:
+    """Get the loader for a stored plot, based on the files in its directory.
+
+    Parameters
+    ----------
+    uuid : str
+        The uuid of the plot, or "recent" for the most recent plot
+    cache_dir : Optional[Path], optional
+        The directory to load the data from, by default None
+
+    Returns
+    -------
+    LocalLoader
+        A ParquetLoader if the plot was stored as Parquet, a LocalLoader otherwise
+    """
+    loader = LocalLoader(uuid, cache_dir)
+    if (loader.cache_dir / PARQUET_FILE).exists():
+        return ParquetLoader(loader.cache_dir.stem, loader.cache_dir.parent)
+    return loader
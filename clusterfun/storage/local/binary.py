@@ -0,0 +1,250 @@
+"""
+binary.py
+=========
+
+This module provides the binary format of the plot data, as an alternative for data.json.
+Instead of JSON lists, the columns of each trace are stored as little-endian typed arrays,
+so the frontend can wrap them in a typed array (e.g. Float32Array) without parsing.
+
+Layout of the file:
+- 4 bytes magic: b"CFUN"
+- uint32 version
+- uint32 length of the header
+- uint32 reserved, zero, so the header starts at byte 16
+- the header: UTF-8 encoded JSON, padded with spaces to a multiple of 8 bytes
+- the buffers, each starting at a multiple of 8 bytes from the start of the file,
+  so they can be wrapped in a typed array (e.g. `new Float64Array(buffer, offset)`) without copying
+
+The header is a dictionary with a "traces" key, with for every trace all keys of the trace that are not
+arrays, plus a "buffers" dictionary mapping the array keys to their buffer. A buffer has an offset
+(relative to the end of the header), a length (number of items) and a dtype: int32, float32 or float64.
+String arrays are dictionary encoded: the buffer holds int32 codes into the "categories" of the buffer,
+with -1 for missing values. Marker colors are stored with the key "marker.color".
+
+Classes
+-------
+BinaryDataWriter
+    Writes the plot data to the binary format one trace at a time.
+
+Functions
+---------
+encode_data(data: List[Dict[str, Any]]) -> bytes
+    Encode the plot data to the binary format.
+decode_data(content: bytes) -> List[Dict[str, Any]]
+    Decode the binary format back to plot data.
+is_current(path: Path) -> bool
+    Check if a binary plot data file exists and has the current version of the format.
+"""
+
+import shutil
+import struct
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+import orjson
+import pandas as pd
+
+MAGIC = b"CFUN"
+# version 1 had a 12 byte prefix, which left the buffers misaligned
+VERSION = 2
+# the magic, version, header length and a reserved field
+PREFIX = struct.Struct("<4sIII")
+ALIGNMENT = 8
+# floats are stored as float32, unless they are too large to be stored precisely
+FLOAT32_MAX_EXACT = 2**24
+BINARY_FILE = "data.bin"
+
+
+def pad(length: int) -> int:
+    """Get the number of padding bytes to align the given length."""
+    return (ALIGNMENT - length % ALIGNMENT) % ALIGNMENT
+
+
+def encode_array(values: List[Any]) -> Tuple[np.ndarray, Dict[str, Any]]:
+    """Encode a list of values as a typed array.
+
+    Parameters
+    ----------
+    values : List[Any]
+        The values of a trace column
+
+    Returns
+    -------
+    Tuple[np.ndarray, Dict[str, Any]]
+        The typed array and its buffer description, without offset
+    """
+    array = np.asarray(values)
+    if array.dtype.kind in "biu" and (len(array) == 0 or np.abs(array).max() < 2**31):
+        return array.astype("<i4"), {"dtype": "int32"}
+    if array.dtype.kind in "biuf":
+        finite = array[np.isfinite(array)]
+        if len(finite) == 0 or np.abs(finite).max() < FLOAT32_MAX_EXACT:
+            return array.astype("<f4"), {"dtype": "float32"}
+        return array.astype("<f8"), {"dtype": "float64"}
+    codes, categories = pd.factorize(pd.Series(values, dtype=object))
+    return codes.astype("<i4"), {"dtype": "int32", "categories": categories.tolist()}
+
+
+def encode_trace(trace: Dict[str, Any], offset: int) -> Tuple[Dict[str, Any], List[bytes]]:
+    """Encode a trace of the plot data to its header and buffers.
+
+    Parameters
+    ----------
+    trace : Dict[str, Any]
+        A trace of the plot data
+    offset : int
+        The offset of the first buffer of the trace, relative to the end of the header
+
+    Returns
+    -------
+    Tuple[Dict[str, Any], List[bytes]]
+        The header of the trace and its buffers, padded to the alignment
+    """
+    arrays = {key: trace[key] for key in ["id", "x", "y"] if isinstance(trace.get(key), list)}
+    header_trace = {key: value for key, value in trace.items() if key not in arrays}
+    marker = trace.get("marker")
+    if isinstance(marker, dict) and isinstance(marker.get("color"), list):
+        arrays["marker.color"] = marker["color"]
+        header_trace["marker"] = {key: value for key, value in marker.items() if key != "color"}
+    header_trace["buffers"] = {}
+    buffers = []
+    for key, values in arrays.items():
+        array, description = encode_array(values)
+        description.update({"offset": offset, "length": len(array)})
+        header_trace["buffers"][key] = description
+        buffer = array.tobytes()
+        buffers.append(buffer + b"\0" * pad(len(buffer)))
+        offset += len(buffers[-1])
+    return header_trace, buffers
+
+
+def encode_header(traces: List[Dict[str, Any]]) -> bytes:
+    """Encode the start of the file up to the buffers: the magic, version, header length and header."""
+    header = orjson.dumps({"traces": traces}, option=orjson.OPT_SERIALIZE_NUMPY)  # pylint: disable=no-member
+    header += b" " * pad(len(header))
+    return PREFIX.pack(MAGIC, VERSION, len(header), 0) + header
+
+
+def encode_data(data: List[Dict[str, Any]]) -> bytes:
+    """Encode the plot data to the binary format.
+
+    Parameters
+    ----------
+    data : List[Dict[str, Any]]
+        The plot data, as stored in data.json
+
+    Returns
+    -------
+    bytes
+        The binary encoded data
+    """
+    traces, buffers = [], []
+    offset = 0
+    for trace in data:
+        header_trace, trace_buffers = encode_trace(trace, offset)
+        traces.append(header_trace)
+        buffers.extend(trace_buffers)
+        offset += sum(len(buffer) for buffer in trace_buffers)
+    return encode_header(traces) + b"".join(buffers)
+
+
+def is_current(path: Path) -> bool:
+    """Check if a binary plot data file exists and has the current version of the format."""
+    try:
+        with open(path, "rb") as f:
+            prefix = f.read(PREFIX.size)
+    except FileNotFoundError:
+        return False
+    return len(prefix) == PREFIX.size and PREFIX.unpack(prefix)[:2] == (MAGIC, VERSION)
+
+
+class BinaryDataWriter:
+    """Writes the plot data to the binary format one trace at a time, so the traces do not need to be in memory
+    at the same time. The header is only complete after the last trace, so the buffers are written
+    to a temporary file first and copied after the header on close."""
+
+    def __init__(self, path: Path):
+        """Initialise the writer.
+
+        Parameters
+        ----------
+        path : Path
+            The path of the binary file to write
+        """
+        self.path = path
+        self.traces: List[Dict[str, Any]] = []
+        self.offset = 0
+        self.body = tempfile.TemporaryFile(dir=path.parent)  # pylint: disable=consider-using-with
+
+    def write(self, trace: Dict[str, Any]):
+        """Encode a trace and write its buffers."""
+        header_trace, buffers = encode_trace(trace, self.offset)
+        self.traces.append(header_trace)
+        for buffer in buffers:
+            self.body.write(buffer)
+            self.offset += len(buffer)
+
+    def close(self):
+        """Write the header and the buffers to the binary file, replacing the old file if any."""
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(encode_header(self.traces))
+            self.body.seek(0)
+            shutil.copyfileobj(self.body, f)
+        self.body.close()
+        tmp_path.replace(self.path)
+
+    def __enter__(self) -> "BinaryDataWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.body.close()
+
+
+def decode_data(content: bytes) -> List[Dict[str, Any]]:
+    """Decode the binary format back to plot data.
+
+    Parameters
+    ----------
+    content : bytes
+        The binary encoded data
+
+    Returns
+    -------
+    List[Dict[str, Any]]
+        The plot data, as stored in data.json. Floats are stored as float32, so they can differ slightly.
+
+    Raises
+    ------
+    ValueError
+        If the content is not in the binary format
+    """
+    magic, version, header_length, _ = PREFIX.unpack_from(content)
+    if magic != MAGIC:
+        raise ValueError("Content is not clusterfun binary plot data")
+    if version != VERSION:
+        raise ValueError(f"Binary plot data of version {version} is not supported, expected version {VERSION}")
+    header = orjson.loads(content[PREFIX.size : PREFIX.size + header_length])  # pylint: disable=no-member
+    body = memoryview(content)[PREFIX.size + header_length :]
+    data = []
+    for header_trace in header["traces"]:
+        trace = {key: value for key, value in header_trace.items() if key != "buffers"}
+        for key, description in header_trace["buffers"].items():
+            dtype = {"int32": "<i4", "float32": "<f4", "float64": "<f8"}[description["dtype"]]
+            array = np.frombuffer(body, dtype=dtype, count=description["length"], offset=description["offset"])
+            if "categories" in description:
+                categories = description["categories"]
+                values = [categories[code] if code >= 0 else None for code in array.tolist()]
+            else:
+                values = array.tolist()
+            if key == "marker.color":
+                trace["marker"] = {**trace.get("marker", {}), "color": values}
+            else:
+                trace[key] = values
+        data.append(trace)
+    return data
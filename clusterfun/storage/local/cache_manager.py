@@ -0,0 +1,149 @@
+"""
+cache_manager.py
+================
+
+This module provides the garbage collection of the cache directory. Every plot is stored in its own directory
+in the cache directory, so without cleaning up the cache directory keeps growing.
+
+The cache manager removes views that have not been opened for longer than a maximum age, and then removes
+the least recently used views until the views that can be removed fit in a byte budget.
+Views that are pinned in the catalog or that have labels are never removed, and do not count toward the budget.
+Only directories with a config are views: other directories in the cache directory are left alone.
+
+The maximum age and byte budget are set with environment variables, and no views are removed when they are not set:
+- CLUSTERFUN_CACHE_MAX_BYTES: the byte budget, e.g. 10000000000 or 10G
+- CLUSTERFUN_CACHE_MAX_AGE_DAYS: the maximum number of days since a view was last opened
+
+Garbage collection runs after every stored plot, and with the `clusterfun gc` command.
+
+Classes
+-------
+CacheManager
+    Removes views from a cache directory to keep it within a maximum age and byte budget.
+"""
+
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from clusterfun.storage.local.catalog import Catalog, ViewInfo, is_view_directory
+from clusterfun.storage.local.label_manager import LabelManager
+from clusterfun.storage.local.view_state import VIEW_STATES
+
+BYTE_UNITS = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+class CacheManager:
+    """Removes views from a cache directory to keep it within a maximum age and byte budget."""
+
+    def __init__(self, cache_dir: Path, max_bytes: Optional[int] = None, max_age_days: Optional[float] = None):
+        """Initialise the cache manager.
+
+        Parameters
+        ----------
+        cache_dir : Path
+            The cache directory with a directory per view
+        max_bytes : Optional[int], optional
+            The maximum total size of the views, by default None for no maximum
+        max_age_days : Optional[float], optional
+            The maximum number of days since a view was last opened, by default None for no maximum
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.catalog = Catalog(cache_dir)
+
+    @classmethod
+    def from_env(cls, cache_dir: Path) -> "CacheManager":
+        """Create a cache manager with the byte budget and maximum age set in the environment variables."""
+        max_bytes = os.environ.get("CLUSTERFUN_CACHE_MAX_BYTES")
+        max_age_days = os.environ.get("CLUSTERFUN_CACHE_MAX_AGE_DAYS")
+        return cls(
+            cache_dir,
+            max_bytes=parse_bytes(max_bytes) if max_bytes else None,
+            max_age_days=float(max_age_days) if max_age_days else None,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        """Whether a byte budget or maximum age is set."""
+        return self.max_bytes is not None or self.max_age_days is not None
+
+    def collect(self, keep: Optional[str] = None, dry_run: bool = False) -> List[ViewInfo]:
+        """Removes views that are too old, then the least recently used views until the views fit in the byte budget.
+
+        Parameters
+        ----------
+        keep : Optional[str], optional
+            The uuid of a view that should not be removed, e.g. the view that was just stored, by default None.
+            Like labeled and pinned views, it does not count toward the byte budget
+        dry_run : bool, optional
+            Whether to only return the views that would be removed, by default False
+
+        Returns
+        -------
+        List[ViewInfo]
+            The removed views
+        """
+        if not self.enabled:
+            return []
+        now = time.time()
+        views = []
+        for view in self.catalog.get_least_recently_used():
+            if not is_view_directory(self.cache_dir / view.uuid):
+                # removed by hand or not a view: forget it, but leave the directory alone
+                if not dry_run:
+                    self.catalog.remove(view.uuid)
+            elif view.uuid != keep and not self.is_labeled(view.uuid):
+                views.append(view)
+        total_bytes = sum(view.bytes for view in views)
+        removed = []
+        for view in views:
+            too_old = self.max_age_days is not None and now - view.last_used > self.max_age_days * SECONDS_PER_DAY
+            over_budget = self.max_bytes is not None and total_bytes > self.max_bytes
+            if not too_old and not over_budget:
+                # views are sorted by last use, so the next views are not too old either
+                break
+            if not dry_run:
+                self.remove(view.uuid)
+            total_bytes -= view.bytes
+            removed.append(view)
+        return removed
+
+    def is_labeled(self, uuid: str) -> bool:
+        """Whether any item of a view has a label."""
+        return len(LabelManager(self.cache_dir / uuid).read_labels()) > 0
+
+    def remove(self, uuid: str):
+        """Removes a view from the cache directory and the catalog. Directories that are not views are kept."""
+        if is_view_directory(self.cache_dir / uuid):
+            shutil.rmtree(self.cache_dir / uuid, ignore_errors=True)
+        self.catalog.remove(uuid)
+        VIEW_STATES.invalidate(self.cache_dir / uuid)
+
+
+def parse_bytes(value: str) -> int:
+    """Parse a number of bytes with an optional unit, e.g. 1024, 500M or 10G.
+
+    Parameters
+    ----------
+    value : str
+        The number of bytes
+
+    Returns
+    -------
+    int
+        The number of bytes
+
+    Raises
+    ------
+    ValueError
+        If the value is not a number of bytes
+    """
+    value = value.strip().upper().removesuffix("B").removesuffix("I")
+    if value and value[-1] in BYTE_UNITS:
+        return int(float(value[:-1]) * BYTE_UNITS[value[-1]])
+    return int(value)
@@ -0,0 +1,297 @@
+"""
+catalog.py
+==========
+
+This module provides the catalog of the cache directory: a small SQLite database with a row per stored view,
+so the most recent view can be found and the views can be listed without going over all view directories.
+
+The catalog is kept up to date by the LocalStorer. If the catalog does not exist yet, for example for a cache
+directory written by an older version of clusterfun, it is built once by scanning the cache directory.
+Views that other writers store in the cache directory after that are added when the most recent view is looked up.
+
+Classes
+-------
+ViewInfo
+    The catalog entry of a stored view.
+Catalog
+    The catalog of the views in a cache directory.
+"""
+
+import dataclasses
+import json
+import os
+import sqlite3
+import tempfile
+from pathlib import Path
+from typing import Any, List, Optional, Tuple
+
+from clusterfun.constants import PARQUET_FILE
+
+CATALOG_FILE = "catalog.db"
+# seconds to wait for another process writing to the catalog
+CATALOG_TIMEOUT = 30.0
+
+
+@dataclasses.dataclass
+class ViewInfo:  # pylint: disable=too-many-instance-attributes
+    """The catalog entry of a stored view."""
+
+    uuid: str
+    created: float
+    rows: Optional[int]
+    bytes: int
+    plot_type: Optional[str]
+    title: Optional[str] = None
+    accessed: Optional[float] = None
+    pinned: bool = False
+
+    @property
+    def last_used(self) -> float:
+        """The time the view was last opened, or created if it was never opened."""
+        return self.created if self.accessed is None else self.accessed
+
+
+VIEW_FIELDS = [field.name for field in dataclasses.fields(ViewInfo)]
+COLUMNS = ", ".join(VIEW_FIELDS)
+
+
+class Catalog:
+    """The catalog of the views in a cache directory."""
+
+    def __init__(self, cache_dir: Path):
+        """Initialise the catalog.
+
+        Parameters
+        ----------
+        cache_dir : Path
+            The cache directory with a directory per view
+        """
+        self.cache_dir = cache_dir
+        self.path = cache_dir / CATALOG_FILE
+
+    def connect(self) -> sqlite3.Connection:
+        """Connect to the catalog. If it does not exist yet, it is built from the cache directory first,
+        so views stored before the catalog existed are added too."""
+        if not self.path.exists():
+            self.rebuild()
+        return connect_catalog(self.path)
+
+    def add(self, view: ViewInfo):
+        """Adds a view to the catalog. If the view is already in the catalog,
+        its rows and bytes are updated and it keeps its created time."""
+        con = self.connect()
+        with con:
+            con.execute(
+                f"INSERT INTO views ({COLUMNS}) VALUES ({', '.join('?' * len(VIEW_FIELDS))}) "
+                "ON CONFLICT (uuid) DO UPDATE SET rows = excluded.rows, bytes = excluded.bytes, "
+                "plot_type = excluded.plot_type, title = excluded.title",
+                dataclasses.astuple(view),
+            )
+        con.close()
+
+    def remove(self, uuid: str):
+        """Removes a view from the catalog."""
+        con = self.connect()
+        with con:
+            con.execute("DELETE FROM views WHERE uuid = ?", (uuid,))
+        con.close()
+
+    def get_views(self, limit: Optional[int] = None, offset: int = 0) -> List[ViewInfo]:
+        """Gets the views in the catalog, most recent first.
+
+        Parameters
+        ----------
+        limit : Optional[int], optional
+            The maximum number of views to return, by default None which returns all views
+        offset : int, optional
+            The number of views to skip, by default 0
+
+        Returns
+        -------
+        List[ViewInfo]
+            The views
+        """
+        con = self.connect()
+        rows = con.execute(
+            f"SELECT {COLUMNS} FROM views ORDER BY created DESC LIMIT ? OFFSET ?",
+            (-1 if limit is None else limit, offset),
+        ).fetchall()
+        con.close()
+        return [to_view_info(row) for row in rows]
+
+    def get_least_recently_used(self) -> List[ViewInfo]:
+        """Gets the views that are not pinned, least recently used first."""
+        con = self.connect()
+        rows = con.execute(
+            f"SELECT {COLUMNS} FROM views WHERE NOT pinned ORDER BY COALESCE(accessed, created), created"
+        ).fetchall()
+        con.close()
+        return [to_view_info(row) for row in rows]
+
+    def get_total_bytes(self) -> int:
+        """Gets the total size in bytes of the views in the catalog."""
+        con = self.connect()
+        total = con.execute("SELECT COALESCE(SUM(bytes), 0) FROM views").fetchone()[0]
+        con.close()
+        return total
+
+    def record_access(self, uuid: str, accessed: float):
+        """Records the time a view was last opened."""
+        con = self.connect()
+        with con:
+            con.execute("UPDATE views SET accessed = ? WHERE uuid = ?", (accessed, uuid))
+        con.close()
+
+    def set_pinned(self, uuid: str, pinned: bool) -> bool:
+        """Pins or unpins a view. Pinned views are never evicted from the cache directory.
+
+        Parameters
+        ----------
+        uuid : str
+            The uuid of the view
+        pinned : bool
+            Whether the view should be pinned
+
+        Returns
+        -------
+        bool
+            Whether the view is in the catalog
+        """
+        con = self.connect()
+        with con:
+            updated = con.execute("UPDATE views SET pinned = ? WHERE uuid = ?", (pinned, uuid)).rowcount
+        con.close()
+        return updated > 0
+
+    def add_missing(self):
+        """Adds the views of the cache directory that are missing from the catalog, e.g. stored by an older version
+        of clusterfun or copied into the cache directory after the catalog was built.
+        Only the names of the directories are listed, the missing views are read like `rebuild` reads them."""
+        con = self.connect()
+        known = {row[0] for row in con.execute("SELECT uuid FROM views")}
+        con.close()
+        for name in os.listdir(self.cache_dir):
+            directory = self.cache_dir / name
+            if name in known or not is_view_directory(directory):
+                continue
+            try:
+                self.add(get_view_info(directory))
+            except OSError:
+                # e.g. the directory was removed while it was read
+                pass
+
+    def get_recent(self) -> Optional[str]:
+        """Gets the uuid of the most recently created view, or None if there are no views.
+        Views missing from the catalog are added first, views whose directory was removed are removed from it."""
+        self.add_missing()
+        while True:
+            views = self.get_views(limit=1)
+            if len(views) == 0:
+                return None
+            if (self.cache_dir / views[0].uuid).is_dir():
+                return views[0].uuid
+            self.remove(views[0].uuid)
+
+    def rebuild(self):
+        """Rebuilds the catalog by scanning the cache directory."""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        views = [get_view_info(directory) for directory in self.cache_dir.iterdir() if is_view_directory(directory)]
+        # a temporary file of its own, so concurrent rebuilds do not write to each other's file
+        with tempfile.NamedTemporaryFile(dir=self.cache_dir, prefix=CATALOG_FILE, suffix=".tmp", delete=False) as f:
+            tmp_path = Path(f.name)
+        try:
+            con = connect_catalog(tmp_path)
+            with con:
+                con.executemany(
+                    f"INSERT INTO views ({COLUMNS}) VALUES ({', '.join('?' * len(VIEW_FIELDS))})",
+                    [dataclasses.astuple(view) for view in views],
+                )
+            con.close()
+            tmp_path.replace(self.path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+
+def connect_catalog(path: Path) -> sqlite3.Connection:
+    """Connect to the catalog database at the given path, creating its table if it does not exist yet."""
+    con = sqlite3.connect(path, timeout=CATALOG_TIMEOUT)
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS views ("
+        "uuid TEXT PRIMARY KEY, created REAL NOT NULL, rows INTEGER, bytes INTEGER NOT NULL, "
+        "plot_type TEXT, title TEXT, accessed REAL, pinned INTEGER NOT NULL DEFAULT 0)"
+    )
+    con.execute("CREATE INDEX IF NOT EXISTS idx_views_created ON views (created)")
+    # catalogs created before views could be pinned do not have these columns yet
+    existing_columns = {row[1] for row in con.execute("PRAGMA table_info(views)")}
+    for column, definition in [("accessed", "REAL"), ("pinned", "INTEGER NOT NULL DEFAULT 0")]:
+        if column not in existing_columns:
+            con.execute(f"ALTER TABLE views ADD COLUMN {column} {definition}")
+    return con
+
+
+def to_view_info(row: Tuple[Any, ...]) -> ViewInfo:
+    """Convert a row of the catalog to a ViewInfo."""
+    view = ViewInfo(*row)
+    view.pinned = bool(view.pinned)
+    return view
+
+
+def is_view_directory(directory: Path) -> bool:
+    """Whether a directory in the cache directory is a stored view, i.e. it has a config.
+    Other directories, e.g. created by the user, are not views and are never registered or removed."""
+    return (directory / "config.json").is_file()
+
+
+def get_directory_size(directory: Path) -> int:
+    """Get the total size in bytes of the files in a view directory."""
+    return sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+
+def count_rows(directory: Path) -> Optional[int]:
+    """Count the rows stored in a view directory, or None if they cannot be counted."""
+    try:
+        if (directory / PARQUET_FILE).exists():
+            import pyarrow.parquet as pq  # pylint: disable=import-outside-toplevel
+
+            return pq.ParquetFile(directory / PARQUET_FILE).metadata.num_rows
+        if (directory / "database.db").exists():
+            con = sqlite3.connect(directory / "database.db")
+            try:
+                return con.execute("SELECT COUNT(*) FROM database").fetchone()[0]
+            finally:
+                con.close()
+    except (sqlite3.Error, OSError, ValueError):
+        return None
+    return None
+
+
+def get_view_info(directory: Path, created: Optional[float] = None) -> ViewInfo:
+    """Get the catalog entry of a view directory.
+
+    Parameters
+    ----------
+    directory : Path
+        The directory of the view
+    created : Optional[float], optional
+        The time the view was created, by default None which uses the creation time of the directory
+
+    Returns
+    -------
+    ViewInfo
+        The catalog entry of the view
+    """
+    plot_type, title = None, None
+    try:
+        with open(directory / "config.json", encoding="utf-8") as f:
+            config = json.load(f)
+        plot_type, title = config.get("type"), config.get("title")
+    except (OSError, ValueError):
+        pass
+    return ViewInfo(
+        uuid=directory.name,
+        created=directory.stat().st_ctime if created is None else created,
+        rows=count_rows(directory),
+        bytes=get_directory_size(directory),
+        plot_type=plot_type,
+        title=title,
+    )
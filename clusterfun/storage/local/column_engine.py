@@ -0,0 +1,371 @@
+"""
+column_engine.py
+================
+
+This module provides an in-memory filter engine for views stored in SQLite. The columns of a view are loaded once
+into NumPy arrays, text columns dictionary encoded as integer codes into their distinct values, after which filters
+are evaluated as vectorized boolean masks instead of SQLite scans. The filtered traces, the ids of a selection and
+the value counts within a selection are then taken from the arrays as well.
+
+Filters are evaluated with the same semantics as the SQL of clusterfun/storage/local/query.py: invalid filters are
+skipped, missing values never match (also not for != and NOT IN) and numbers compared to a text column are compared
+as text, as SQLite does.
+
+The engine is optional: the loaded columns of the views are kept in a least recently used cache with a memory budget,
+set in bytes with the CLUSTERFUN_ENGINE_CACHE_BYTES environment variable. Views that are estimated to take more
+memory than the budget are not loaded, their requests are answered by SQLite. Set the budget to 0 to disable the
+engine. The columns are loaded in the background on the first request of a view, which is answered by SQLite.
+They are loaded one at a time, so loading does not take much more memory than the budget. Views whose columns fail
+to load are answered by SQLite until their data changes.
+
+Classes
+-------
+Column
+    A column of a view loaded into memory.
+ColumnEngine
+    The loaded columns of a view, evaluating filters on them.
+ColumnEngineCache
+    A least recently used cache of the loaded columns of the views.
+"""
+
+import dataclasses
+import operator
+import os
+import sqlite3
+import threading
+from concurrent.futures import Executor
+from typing import TYPE_CHECKING, Any, Callable, Dict, FrozenSet, Hashable, List, Optional, Sequence, Set, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from clusterfun.config import Config
+from clusterfun.executors import CPU_EXECUTOR
+from clusterfun.models.filter import Filter
+from clusterfun.storage.local.column_stats import ColumnStats
+from clusterfun.storage.local.data import PlotColumns
+from clusterfun.storage.local.ingest import quote_identifier
+from clusterfun.storage.local.lru import LRUCache
+from clusterfun.storage.local.query import to_sql_value
+
+if TYPE_CHECKING:  # pragma: no cover
+    from clusterfun.storage.local.loader import LocalLoader
+    from clusterfun.storage.local.view_state import ViewState
+
+# default memory budget of the cache
+ENGINE_CACHE_BYTES = 256 * 1024 * 1024
+# estimated memory per distinct value of a text column
+CATEGORY_BYTES = 64
+COMPARISONS: Dict[str, Callable[[Any, Any], Any]] = {
+    ">": operator.gt,
+    "<": operator.lt,
+    ">=": operator.ge,
+    "<=": operator.le,
+    "=": operator.eq,
+    "!=": operator.ne,
+}
+
+
+@dataclasses.dataclass
+class Column:
+    """A column of a view loaded into memory. Numeric columns hold their values, with a mask of the missing values.
+    Text columns hold int32 codes into their distinct values (`categories`), with -1 for missing values."""
+
+    values: np.ndarray
+    nulls: np.ndarray
+    categories: Optional[np.ndarray] = None
+    category_set: FrozenSet[Any] = frozenset()
+
+    @classmethod
+    def from_values(cls, values: np.ndarray, numeric: bool) -> "Column":
+        """Load a column from an object array of the values as returned by SQLite, None for missing values."""
+        nulls = pd.isna(values)
+        if numeric:
+            present = np.array(values[~nulls].tolist())
+            # values of other types in a numeric column, e.g. text or very large integers, are compared as text
+            if present.dtype.kind in "iuf":
+                filled = np.zeros(len(values), dtype=np.int64 if present.dtype.kind in "iu" else np.float64)
+                filled[~nulls] = present
+                return cls(values=filled, nulls=nulls)
+        codes, categories = pd.factorize(values)
+        return cls(
+            values=codes.astype(np.int32),
+            nulls=nulls,
+            categories=np.asarray(categories, dtype=object),
+            category_set=frozenset(categories.tolist()),
+        )
+
+    @property
+    def nbytes(self) -> int:
+        """The approximate memory used by the column."""
+        return self.values.nbytes + self.nulls.nbytes + CATEGORY_BYTES * len(self.category_set)
+
+    def to_objects(self, mask: Union[np.ndarray, slice]) -> np.ndarray:
+        """Get the values of the rows in the mask as an object array of Python values, None for missing values.
+        The mask can also be a slice, e.g. `slice(None)` for all rows."""
+        if self.categories is not None:
+            codes = self.values[mask]
+            result = self.categories[np.maximum(codes, 0)] if len(self.categories) > 0 else codes.astype(object)
+            result[codes < 0] = None
+            return result
+        result = np.array(self.values[mask].tolist(), dtype=object)
+        result[self.nulls[mask]] = None
+        return result
+
+    def compare(self, comparison: str, values: Sequence[Any]) -> np.ndarray:
+        """
+        Get the mask of the rows matching a comparison with the values of a (valid) filter.
+
+        Parameters
+        ----------
+        comparison : str
+            One of >, <, >=, <=, =, !=, IN and NOT IN
+        values : Sequence[Any]
+            The values of the filter, as bound to the SQL query
+
+        Returns
+        -------
+        np.ndarray
+            The boolean mask of the matching rows
+        """
+        if self.categories is not None:
+            # numbers are compared as text with text columns, as in SQLite
+            values = [value if isinstance(value, str) else str(value) for value in values]
+            if comparison in ["IN", "NOT IN"]:
+                matches = np.isin(self.categories, values)
+                matching = matches if comparison == "IN" else ~matches
+            else:
+                matching = np.array([COMPARISONS[comparison](category, values[0]) for category in self.categories])
+            # the code of missing values is -1, which never matches
+            lookup = np.append(matching.astype(bool), False)
+            return lookup[self.values]
+        if comparison in ["IN", "NOT IN"]:
+            matches = np.isin(self.values, [value for value in values if not isinstance(value, str)])
+            mask = matches if comparison == "IN" else ~matches
+        elif isinstance(values[0], str):
+            # text never equals a number and numbers sort before text, as in SQLite, e.g. for "nan" and "inf"
+            mask = np.full(len(self.values), COMPARISONS[comparison](0, 1))
+        else:
+            mask = COMPARISONS[comparison](self.values, values[0])
+        return mask & ~self.nulls
+
+
+class ColumnEngine:
+    """The loaded columns of a view, ordered by id, evaluating filters on them."""
+
+    def __init__(self, ids: np.ndarray, columns: Dict[str, Column], config: Config):
+        """Initialise the engine.
+
+        Parameters
+        ----------
+        ids : np.ndarray
+            The sorted ids of the rows
+        columns : Dict[str, Column]
+            The loaded columns, by name
+        config : Config
+            The config of the view, used to validate the filter columns
+        """
+        self.ids = ids
+        self.columns = columns
+        self.config = config
+
+    @classmethod
+    def from_sqlite(cls, con: sqlite3.Connection, config: Config, exclude: Sequence[str] = ()) -> "ColumnEngine":
+        """
+        Load the columns of the database of a view, but the BLOB columns and the columns to exclude.
+        The columns are read one at a time, so loading them takes little more memory than the loaded columns.
+        Rows appended while loading are left out, as only the rows up to the last id read first are read.
+
+        Raises
+        ------
+        ValueError
+            If rows were removed while loading, so the columns do not line up
+        """
+        column_types = {
+            row[1]: row[2]
+            for row in con.execute("PRAGMA table_info(database)")
+            if row[2] != "BLOB" and row[1] not in exclude and row[1] != "id"
+        }
+        ids = np.fromiter((row[0] for row in con.execute("SELECT id FROM database ORDER BY id")), dtype=np.int64)
+        last_id = int(ids[-1]) if len(ids) > 0 else None
+        columns = {}
+        for name, column_type in column_types.items():
+            query = f"SELECT {quote_identifier(name)} FROM database WHERE id <= ? ORDER BY id"
+            values = np.fromiter((row[0] for row in con.execute(query, (last_id,))), dtype=object)
+            if len(values) != len(ids):
+                raise ValueError(f"The rows of the database changed while loading column {name}")
+            columns[name] = Column.from_values(values, numeric=column_type in ["INTEGER", "REAL"])
+        return cls(ids, columns, config)
+
+    @property
+    def nbytes(self) -> int:
+        """The approximate memory used by the loaded columns."""
+        return self.ids.nbytes + sum(column.nbytes for column in self.columns.values())
+
+    def can_evaluate(self, filters: List[Filter]) -> bool:
+        """Whether all filters can be evaluated, i.e. their columns are loaded or they are invalid anyway."""
+        return all(
+            filter_item.column in self.columns or filter_item.column not in self.config.columns
+            for filter_item in filters
+        )
+
+    def evaluate(self, filters: List[Filter], mask: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Get the mask of the rows matching all valid filters, skipping invalid filters as `get_filter_query` does.
+
+        Parameters
+        ----------
+        filters : List[Filter]
+            The filters, which should pass `can_evaluate`
+        mask : Optional[np.ndarray], optional
+            The mask of the rows to start from, by default None which starts from all rows
+
+        Returns
+        -------
+        np.ndarray
+            The boolean mask of the matching rows, in the order of `ids`
+        """
+        mask = np.ones(len(self.ids), dtype=bool) if mask is None else mask.copy()
+        for filter_item in filters:
+            column = self.columns.get(filter_item.column)
+            # categorical values are validated against the distinct values, there are none in numeric columns
+            if column is None or not filter_item.is_valid(self.config.columns, column_values=column.category_set):
+                continue
+            values = [to_sql_value(value) for value in filter_item.values]
+            mask &= column.compare(filter_item.comparison, values)
+        return mask
+
+    def id_mask(self, media_ids: Sequence[int]) -> np.ndarray:
+        """Get the mask of the rows with the given ids."""
+        return np.isin(self.ids, np.asarray(media_ids, dtype=np.int64))
+
+    def get_plot_columns(self, config: Config, mask: np.ndarray) -> PlotColumns:
+        """Get the id, x, y and color columns of the rows in the mask, as used by `build_data_dict`."""
+        columns = {}
+        if config.type != "grid":
+            columns = {
+                key: self.columns[name].to_objects(mask)
+                for key, name in [("x", config.x), ("y", config.y), ("color", config.color)]
+                if name is not None
+            }
+        return PlotColumns(ids=self.ids[mask], x=columns.get("x"), y=columns.get("y"), color=columns.get("color"))
+
+    def value_counts(self, column: str, mask: np.ndarray) -> List[Tuple[Any, int]]:
+        """Count the values of a column in the rows of the mask, in the same order as `get_sqlite_value_counts`."""
+        values = self.columns[column].to_objects(mask)
+        nulls = pd.isna(values)
+        counts = pd.Series(values[~nulls]).value_counts(sort=False)
+        value_counts = sorted(zip(counts.index.tolist(), counts.tolist()), key=lambda item: (-item[1], item[0]))
+        null_count = int(nulls.sum())
+        if null_count > 0:
+            # missing values come first in ties, as in SQLite
+            value_counts = sorted([(None, null_count)] + value_counts, key=lambda item: -item[1])
+        return value_counts
+
+
+class ColumnEngineCache:
+    """A least recently used cache of the loaded columns of the views, keyed by the directory of the view."""
+
+    def __init__(self, max_bytes: int, executor: Optional[Executor] = None):
+        """Initialise the cache.
+
+        Parameters
+        ----------
+        max_bytes : int
+            The approximate maximum memory used by the loaded columns, views that need more are not loaded
+        executor : Optional[Executor], optional
+            The executor to load the columns in, by default None which loads them when they are requested
+        """
+        self.cache: LRUCache[Tuple[Any, ColumnEngine]] = LRUCache(max_bytes)
+        self.executor = executor
+        self._loading: Set[Hashable] = set()
+        # per view, the version of the data whose columns failed to load, which is not loaded again
+        self._failed: Dict[Hashable, Any] = {}
+        self._lock = threading.Lock()
+
+    def get(self, loader: "LocalLoader") -> Optional[ColumnEngine]:
+        """Get the loaded columns of the view of a loader, loading them if they fit in the budget.
+        With an executor, columns that are not loaded yet are loaded in the executor and None is returned until then,
+        so the request that triggers the loading is answered by SQLite instead of waiting for it.
+
+        Parameters
+        ----------
+        loader : LocalLoader
+            The loader of the view
+
+        Returns
+        -------
+        Optional[ColumnEngine]
+            The loaded columns, or None if they are not loaded (yet), the view has no database, does not fit
+            in the budget or its columns failed to load
+        """
+        state = loader.state
+        version = state.data_version
+        entry = self.cache.get(loader.cache_dir, validate=lambda cached: cached[0] == version)
+        if entry is not None:
+            return entry[1]
+        # views without a database, e.g. Parquet views, are read by column already
+        if (
+            state.connections is None
+            or estimate_nbytes(list(state.column_stats.values()), [state.config.media]) > self.cache.max_cost
+        ):
+            return None
+        if self._failed.get(loader.cache_dir) == version:
+            return None
+        if self.executor is None:
+            return self.load(loader, state)
+        with self._lock:
+            if loader.cache_dir in self._loading:
+                return None
+            self._loading.add(loader.cache_dir)
+        future = self.executor.submit(self.load, loader, state)
+        future.add_done_callback(lambda _: self._loading.discard(loader.cache_dir))
+        return None
+
+    def load(self, loader: "LocalLoader", state: "ViewState") -> ColumnEngine:
+        """Load the columns of the view of a loader as of a state of the view, and cache them for the version
+        of its data. If loading fails, the columns are not loaded again until the data changes.
+
+        Parameters
+        ----------
+        loader : LocalLoader
+            The loader of the view
+        state : ViewState
+            The state of the view to load the columns of, with the pool of connections to its data
+
+        Returns
+        -------
+        ColumnEngine
+            The loaded columns
+        """
+        assert state.connections is not None  # MyPy
+        try:
+            engine = ColumnEngine.from_sqlite(state.connections.get(), state.config, exclude=[state.config.media])
+        except Exception:
+            self._failed[loader.cache_dir] = state.data_version
+            raise
+        self._failed.pop(loader.cache_dir, None)
+        self.cache.put(loader.cache_dir, (state.data_version, engine), cost=engine.nbytes)
+        return engine
+
+    def stats(self) -> Dict[str, Any]:
+        """Get the statistics of the cache."""
+        return self.cache.stats()
+
+
+def estimate_nbytes(column_stats: Sequence[ColumnStats], exclude: Sequence[str]) -> int:
+    """Estimate the memory used by loading the columns of a view, from their statistics."""
+    nbytes = 0
+    for stats in column_stats:
+        if stats.name in exclude:
+            continue
+        if stats.dtype == "object":
+            nbytes += stats.count * 5 + stats.distinct_count * CATEGORY_BYTES
+        else:
+            nbytes += stats.count * 9
+    return nbytes
+
+
+ENGINES = ColumnEngineCache(
+    int(os.environ.get("CLUSTERFUN_ENGINE_CACHE_BYTES", ENGINE_CACHE_BYTES)), executor=CPU_EXECUTOR
+)
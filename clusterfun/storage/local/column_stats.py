@@ -0,0 +1,190 @@
+"""
+column_stats.py
+===============
+
+This module provides the column statistics of a view: per column the pandas dtype, the number of missing values,
+the minimum and maximum, the number of distinct values and the counts of the most common values.
+The statistics are computed when the view is stored and saved next to the data, so listing the columns and counting
+the values of a column do not load the data into pandas. Only counts within a selection are queried from the data.
+
+Columns with more than STATS_TOP_K distinct values keep the counts of their STATS_TOP_K most common values,
+their full counts are queried from the data when needed.
+
+Classes
+-------
+ColumnStats
+    The statistics of a column.
+
+Functions
+---------
+read_column_stats(save_dir: Path) -> Optional[List[ColumnStats]]
+    Read the column statistics of a view.
+write_column_stats(save_dir: Path, stats: List[ColumnStats])
+    Write the column statistics of a view.
+get_sqlite_column_stats(con: sqlite3.Connection) -> List[ColumnStats]
+    Compute the column statistics of the database of a view.
+get_sqlite_value_counts(con: sqlite3.Connection, column: str, query: Optional[Query], limit: Optional[int])
+    Count the values of a column of the database of a view, with SQL.
+format_value_counts(value_counts: List[Tuple[Any, int]], dtype: str) -> List[Dict[str, Union[str, int]]]
+    Format value counts as returned by the values endpoint.
+"""
+
+import dataclasses
+import json
+import sqlite3
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from clusterfun.storage.local.ingest import quote_identifier
+from clusterfun.storage.local.query import Query
+
+STATS_FILE = "column_stats.json"
+# number of most common values to keep the counts of
+STATS_TOP_K = 1000
+
+
+@dataclasses.dataclass
+class ColumnStats:  # pylint: disable=too-many-instance-attributes
+    """The statistics of a column, as computed when storing the view.
+    `top_values` holds the counts of the most common values, most common first, with missing values as None."""
+
+    name: str
+    dtype: str
+    count: int
+    null_count: int
+    min: Any
+    max: Any
+    distinct_count: int
+    top_values: List[Tuple[Any, int]]
+
+    @property
+    def is_complete(self) -> bool:
+        """Whether `top_values` holds the counts of all values of the column, including the missing values."""
+        return len(self.top_values) >= self.distinct_count + int(self.null_count > 0)
+
+
+def read_column_stats(save_dir: Path) -> Optional[List[ColumnStats]]:
+    """Read the column statistics of a view, None if the view was stored without them."""
+    try:
+        with open(save_dir / STATS_FILE, encoding="utf-8") as f:
+            return [
+                ColumnStats(**{**stats, "top_values": [tuple(item) for item in stats["top_values"]]})
+                for stats in json.load(f)
+            ]
+    except FileNotFoundError:
+        return None
+
+
+def write_column_stats(save_dir: Path, stats: List[ColumnStats]):
+    """Write the column statistics of a view, to a new file that replaces the old one.
+    The new file is a temporary file of its own, as the statistics of legacy views are written when they are read,
+    which can happen in several threads at once, see `LocalLoader.read_state`."""
+    with tempfile.NamedTemporaryFile(
+        "w", dir=save_dir, prefix=STATS_FILE, suffix=".tmp", delete=False, encoding="utf-8"
+    ) as f:
+        tmp_path = Path(f.name)
+        # bytes values of BLOB columns are not counted, see `get_sqlite_column_stats`
+        json.dump([dataclasses.asdict(column_stats) for column_stats in stats], f, default=str)
+    try:
+        tmp_path.replace(save_dir / STATS_FILE)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def get_sqlite_dtype(column_type: str, count: int, null_count: int) -> str:
+    """Get the dtype of a column of the database as read by `pd.read_sql_query`, which infers it from the values."""
+    if count == null_count:
+        return "object"
+    if column_type == "INTEGER":
+        # missing values turn integer columns into float columns
+        return "int64" if null_count == 0 else "float64"
+    if column_type == "REAL":
+        return "float64"
+    return "object"
+
+
+def get_sqlite_column_stats(con: sqlite3.Connection) -> List[ColumnStats]:
+    """
+    Compute the column statistics of the database of a view.
+
+    Parameters
+    ----------
+    con : sqlite3.Connection
+        A connection to the database of the view
+
+    Returns
+    -------
+    List[ColumnStats]
+        The statistics of the columns, in the order of the columns of the database
+    """
+    stats = []
+    for _, column, column_type, *_ in con.execute("PRAGMA table_info(database)").fetchall():
+        column_sql = quote_identifier(column)
+        count, non_null_count, minimum, maximum, distinct_count = con.execute(
+            f"SELECT COUNT(*), COUNT({column_sql}), MIN({column_sql}), MAX({column_sql}), "
+            f"COUNT(DISTINCT {column_sql}) FROM database"
+        ).fetchone()
+        null_count = count - non_null_count
+        if column_type == "BLOB":
+            top_values: List[Tuple[Any, int]] = []
+            minimum = maximum = None
+        elif distinct_count == non_null_count:
+            # every value occurs once, so there is nothing to count
+            top_values = [(None, null_count)] if null_count > 0 else []
+            query = Query(
+                f"SELECT {column_sql} FROM database WHERE {column_sql} IS NOT NULL ORDER BY {column_sql} LIMIT ?",
+                (STATS_TOP_K,),
+            )
+            top_values += [(row[0], 1) for row in con.execute(query.sql, query.params)]
+        else:
+            top_values = get_sqlite_value_counts(con, column, limit=STATS_TOP_K)
+        stats.append(
+            ColumnStats(
+                name=column,
+                dtype=get_sqlite_dtype(column_type, count, null_count),
+                count=count,
+                null_count=null_count,
+                min=minimum,
+                max=maximum,
+                distinct_count=distinct_count,
+                top_values=top_values,
+            )
+        )
+    return stats
+
+
+def get_sqlite_value_counts(
+    con: sqlite3.Connection, column: str, query: Optional[Query] = None, limit: Optional[int] = None
+) -> List[Tuple[Any, int]]:
+    """
+    Count the values of a column of the database of a view with a GROUP BY, most common first.
+
+    Parameters
+    ----------
+    con : sqlite3.Connection
+        A connection to the database of the view
+    column : str
+        The column to count the values of
+    query : Optional[Query], optional
+        The query of the rows to count the values in, by default None which counts all rows
+    limit : Optional[int], optional
+        The number of most common values to return, by default None which returns all values
+
+    Returns
+    -------
+    List[Tuple[Any, int]]
+        The values with their counts, ties ordered by value, with missing values as None
+    """
+    column_sql = quote_identifier(column)
+    source = Query("database") if query is None else Query("(") + query + ")"
+    result = Query(f"SELECT {column_sql}, COUNT(*) FROM ") + source + f" GROUP BY {column_sql} ORDER BY 2 DESC, 1"
+    if limit is not None:
+        result += Query(" LIMIT ?", (limit,))
+    return list(con.execute(result.sql, result.params))
+
+
+def format_value_counts(value_counts: List[Tuple[Any, int]], dtype: str) -> List[Dict[str, Union[str, int]]]:
+    """Format value counts with the values as strings, as pandas would format the values of a column of `dtype`."""
+    missing = "nan" if dtype.startswith("float") else "None"
+    return [{"label": missing if value is None else str(value), "count": count} for value, count in value_counts]
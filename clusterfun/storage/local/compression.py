@@ -0,0 +1,168 @@
+"""
+compression.py
+==============
+
+This module provides the precompressed versions of the view payload, so the view can be sent compressed
+without compressing the plot data on every request.
+
+The view payload is `{"data":<data.json>,"uuid":...,"config":...}`. The uuid and config are only known
+when the view is requested (the labels are part of the config), so just the start of the payload,
+`{"data":<data.json>`, is compressed at save time. On a request, the end of the payload is compressed
+and added to it:
+- gzip: data.json.deflate holds the CRC-32 and length of the start of the payload, followed by the raw
+  deflate stream of it, ended with a sync flush so more deflate blocks can follow. On a request the
+  gzip header, the stored deflate stream, the compressed end of the payload and the gzip trailer are sent.
+- zstd: data.json.zst holds a zstd frame of the start of the payload. On a request a second frame with the
+  end of the payload is sent, as zstd decoders decode concatenated frames as one stream.
+  zstd is only available when the optional zstandard package is installed.
+
+Functions
+---------
+save_compressed_data(save_dir: Path, chunk_size: int = CHUNK_SIZE)
+    Saves the compressed versions of the start of the view payload.
+get_encoding(accept_encoding: str, save_dir: Path) -> Optional[str]
+    Gets the best encoding for the Accept-Encoding header that is stored for the view.
+stream_compressed(save_dir: Path, encoding: str, end: bytes, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]
+    Streams the compressed view payload.
+"""
+
+import struct
+import zlib
+from pathlib import Path
+from typing import BinaryIO, Iterator, Optional
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - zstandard is optional
+    zstandard = None
+
+DATA_START = b'{"data":'
+GZIP_FILE = "data.json.deflate"
+ZSTD_FILE = "data.json.zst"
+COMPRESSION_LEVEL = 6
+CHUNK_SIZE = 1024 * 1024
+# gzip header: magic, deflate, no flags, no modification time, no extra flags, unknown OS
+GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+# preferred encodings first
+ENCODING_FILES = {"zstd": ZSTD_FILE, "gzip": GZIP_FILE}
+
+
+def read_chunks(f: BinaryIO, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Read a file in chunks."""
+    while chunk := f.read(chunk_size):
+        yield chunk
+
+
+def save_compressed_data(save_dir: Path, chunk_size: int = CHUNK_SIZE):
+    """
+    Saves the compressed versions of the start of the view payload, read from data.json in the given directory.
+
+    Parameters
+    ----------
+    save_dir : Path
+        The directory of the view
+    chunk_size : int, optional
+        The number of bytes to compress at a time, by default CHUNK_SIZE
+    """
+    with open(save_dir / "data.json", "rb") as f, open(save_dir / f"{GZIP_FILE}.tmp", "wb") as f_gzip:
+        compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+        crc, length = zlib.crc32(DATA_START), len(DATA_START)
+        # room for the CRC-32 and length, written once the data is compressed
+        f_gzip.write(b"\0" * 8)
+        f_gzip.write(compressor.compress(DATA_START))
+        for chunk in read_chunks(f, chunk_size):
+            crc, length = zlib.crc32(chunk, crc), length + len(chunk)
+            f_gzip.write(compressor.compress(chunk))
+        f_gzip.write(compressor.flush(zlib.Z_SYNC_FLUSH))
+        f_gzip.seek(0)
+        f_gzip.write(struct.pack("<II", crc, length & 0xFFFFFFFF))
+    (save_dir / f"{GZIP_FILE}.tmp").replace(save_dir / GZIP_FILE)
+
+    if zstandard is None:
+        # remove a version saved with zstandard installed, as it would be out of date
+        (save_dir / ZSTD_FILE).unlink(missing_ok=True)
+        return
+    with open(save_dir / "data.json", "rb") as f, open(save_dir / f"{ZSTD_FILE}.tmp", "wb") as f_zstd:
+        with zstandard.ZstdCompressor(level=COMPRESSION_LEVEL).stream_writer(f_zstd, closefd=False) as writer:
+            writer.write(DATA_START)
+            for chunk in read_chunks(f, chunk_size):
+                writer.write(chunk)
+    (save_dir / f"{ZSTD_FILE}.tmp").replace(save_dir / ZSTD_FILE)
+
+
+def get_encoding(accept_encoding: str, save_dir: Path) -> Optional[str]:
+    """
+    Gets the best encoding for the Accept-Encoding header that is stored for the view.
+
+    Parameters
+    ----------
+    accept_encoding : str
+        The Accept-Encoding header of the request, e.g. "gzip, deflate, br, zstd"
+    save_dir : Path
+        The directory of the view
+
+    Returns
+    -------
+    Optional[str]
+        The encoding to send the view payload with, or None if it should be sent uncompressed
+    """
+    accepted = {}
+    for item in accept_encoding.split(","):
+        encoding, _, params = item.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                continue
+        accepted[encoding.strip().lower()] = quality
+    for encoding, file_name in ENCODING_FILES.items():
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if quality > 0 and (save_dir / file_name).exists() and (encoding != "zstd" or zstandard is not None):
+            return encoding
+    return None
+
+
+def stream_compressed(save_dir: Path, encoding: str, end: bytes, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Streams the compressed view payload.
+
+    Parameters
+    ----------
+    save_dir : Path
+        The directory of the view
+    encoding : str
+        The encoding, "gzip" or "zstd"
+    end : bytes
+        The end of the payload, following the data
+    chunk_size : int, optional
+        The number of bytes to read at a time, by default CHUNK_SIZE
+
+    Returns
+    -------
+    Iterator[bytes]
+        The chunks of the compressed payload
+    """
+    # open the file before yielding, so a missing file raises before the response is started
+    f = open(save_dir / ENCODING_FILES[encoding], "rb")  # pylint: disable=consider-using-with
+    if encoding == "gzip":
+        return _stream_gzip(f, end, chunk_size)
+    return _stream_zstd(f, end, chunk_size)
+
+
+def _stream_gzip(f: BinaryIO, end: bytes, chunk_size: int) -> Iterator[bytes]:
+    """Streams the stored deflate stream as a gzip stream, followed by the end of the payload."""
+    with f:
+        crc, length = struct.unpack("<II", f.read(8))
+        yield GZIP_HEADER
+        yield from read_chunks(f, chunk_size)
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+    yield compressor.compress(end) + compressor.flush()
+    yield struct.pack("<II", zlib.crc32(end, crc), (length + len(end)) & 0xFFFFFFFF)
+
+
+def _stream_zstd(f: BinaryIO, end: bytes, chunk_size: int) -> Iterator[bytes]:
+    """Streams the stored zstd frame, followed by a frame with the end of the payload."""
+    with f:
+        yield from read_chunks(f, chunk_size)
+    yield zstandard.ZstdCompressor(level=COMPRESSION_LEVEL).compress(end)
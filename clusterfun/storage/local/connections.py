@@ -0,0 +1,99 @@
+"""
+connections.py
+==============
+
+This module provides the pool of read-only SQLite connections of a view, so requests reuse connections
+instead of opening and closing the database for every query.
+
+Every thread gets its own connection, as a SQLite connection should not be used by two threads at the same time.
+The connections are opened read-only and the database is memory-mapped. They are not opened with `immutable=1`,
+as appending rows and saving chunks change the database while it is open. Every connection caches its prepared
+statements, which the parameterized queries reuse. A database that is changed (e.g. by appending rows) changes the
+version of the view state, which retires the pool of the old state: it hands out no more connections, but the
+connections it handed out are not closed under the threads that may still be querying them. Each one is closed when
+it is no longer used, i.e. when its thread is done with it and the pool is released.
+
+Classes
+-------
+ConnectionPool
+    A pool of thread-local read-only connections to the database of a view.
+"""
+
+import sqlite3
+import threading
+import urllib.parse
+from pathlib import Path
+from typing import List
+
+# bytes of the database that are memory-mapped
+MMAP_SIZE = 256 * 1024 * 1024
+# page cache per connection in KiB
+CACHE_SIZE_KIB = 16 * 1024
+# prepared statements cached per connection, keyed by their SQL text, see clusterfun/storage/local/query.py
+CACHED_STATEMENTS = 256
+
+
+class ConnectionPool:
+    """A pool of thread-local read-only connections to the database of a view."""
+
+    def __init__(self, db_path: Path):
+        """Initialise the pool. Connections are opened when a thread first asks for one.
+
+        Parameters
+        ----------
+        db_path : Path
+            The path to the database
+        """
+        self.db_path = db_path
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self.closed = False
+
+    @property
+    def uri(self) -> str:
+        """The URI to open the database read-only."""
+        return f"file:{urllib.parse.quote(str(self.db_path.absolute()))}?mode=ro"
+
+    def get(self) -> sqlite3.Connection:
+        """Get the connection of the current thread, opening it if the thread does not have one yet.
+
+        Returns
+        -------
+        sqlite3.Connection
+            A read-only connection to the database
+
+        Raises
+        ------
+        sqlite3.ProgrammingError
+            If the pool is retired
+        """
+        if self.closed:
+            raise sqlite3.ProgrammingError(f"The connection pool of {self.db_path} is retired")
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = connect_read_only(self.uri)
+            with self._lock:
+                self._connections.append(con)
+            self._local.con = con
+        return con
+
+    def close(self):
+        """Retire the pool, it hands out no more connections. The connections are not closed here, as other threads
+        can be querying them: the pool lets go of them, so each one is closed once the thread using it is done with it
+        and the pool, with the connections of the threads, is garbage collected."""
+        with self._lock:
+            self.closed = True
+            self._connections = []
+
+    def __len__(self) -> int:
+        return len(self._connections)
+
+
+def connect_read_only(uri: str) -> sqlite3.Connection:
+    """Open a read-only connection to a database URI, with the database memory-mapped."""
+    # the connections are closed when they are garbage collected, which can happen in another thread
+    con = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=CACHED_STATEMENTS)
+    con.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    con.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}")
+    return con
@@ -6,14 +6,29 @@ This module contains functions for formatting the data to be used in the plotly
 """
 
 import sqlite3
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Sequence, Tuple, TypedDict
+
+import numpy as np
+import pandas as pd
 
 from clusterfun.config import Config
 from clusterfun.constants import COLORS
+from clusterfun.storage.local.ingest import quote_identifier
+from clusterfun.storage.local.query import Query
+
+
+class PlotColumns(TypedDict):
+    """The id, x, y and color columns of a plot as numpy arrays, as used by `build_data_dict`.
+    None for the columns the plot does not use."""
+
+    ids: np.ndarray
+    x: Optional[np.ndarray]
+    y: Optional[np.ndarray]
+    color: Optional[np.ndarray]
 
 
 def get_data_dict(
-    con: sqlite3.Connection, cfg: Config, query_addition: Optional[str] = None
+    con: sqlite3.Connection, cfg: Config, query_addition: Optional[Query] = None
 ) -> Tuple[List[Dict[str, Any]], Optional[List[str]]]:
     """Get data for plotly graph. Used to store directly to disk here.
     - Used when saving the data for the first time. By saving the data in the right format once,
@@ -21,14 +36,16 @@ def get_data_dict(
     use the data from disk instead of querying the database again.
     - Also used when filtering data and we need to update the data on the fly.
 
+    The plot columns are read with a single query and split into traces by `build_data_dict`.
+
     Parameters
     ----------
     con : sqlite3.Connection
         Database connection
     cfg : Config
         Configuration object
-    query_addition : Optional[str], optional
-        Additional query string to add to the query, by default None
+    query_addition : Optional[Query], optional
+        Additional condition with its parameters to add to the query, by default None
         Used for filtering data
 
     Returns
@@ -39,140 +56,159 @@ def get_data_dict(
 
         List of colors for each data point. Used for coloring the data points.
     """
-    colors = None
-    if cfg.color is not None and cfg.color_is_categorical:
-        return get_data_per_color(cfg, con, query_addition)
-    if cfg.type == "grid":
-        data = get_grid_data(con, query_addition)
-    else:
-        data = get_data_standard(cfg, con, query_addition)
-    return data, colors
+    color_values = None
+    if cfg.color is not None and cfg.color_is_categorical and query_addition:
+        # the colors of the full dataset, so the traces keep their colors when filtering
+        color_values = cfg.colors if cfg.colors is not None else get_color_values(con, cfg)
+    return build_data_dict(cfg, **read_plot_columns(con, cfg, query_addition), color_values=color_values)
 
 
-def get_data_standard(
-    cfg: Config,
-    con: sqlite3.Connection,
-    query_addition: Optional[str] = None,
-) -> List[Dict[str, Any]]:
-    """Get data for standard plotly graph, in case there is no color column.
+def read_plot_columns(con: sqlite3.Connection, cfg: Config, query_addition: Optional[Query] = None) -> PlotColumns:
+    """Read the id, x, y and color columns of the database as numpy arrays, as used by `build_data_dict`.
+    The rows are ordered by id, so without filters the colors appear in the same order as in the table.
 
     Parameters
     ----------
-    cfg : Config
-        Configuration object
     con : sqlite3.Connection
         Database connection
-    query_addition : Optional[str], optional
-        Additional query string to add to the query, by default None
+    cfg : Config
+        Configuration object
+    query_addition : Optional[Query], optional
+        Additional condition with its parameters to add to the query, by default None
         Used for filtering data
 
     Returns
     -------
-    List[Dict[str, Any]]
-        Data for plotly graph.
-        List of dicts with keys: id, x, y, mode, type
+    PlotColumns
+        The ids and the x, y and color columns, None for columns the plot does not use
     """
-    select_columns = ["id"]
-    if cfg.x is not None:
-        select_columns.append(cfg.x)
-    if cfg.y is not None:
-        select_columns.append(cfg.y)
-    if cfg.color is not None and not cfg.color_is_categorical:
-        select_columns.append(cfg.color)
-
-    query = f"SELECT {','.join(select_columns)} FROM database"
-
+    columns = {"ids": "id"}
+    if cfg.type != "grid":
+        columns.update(
+            {key: column for key, column in [("x", cfg.x), ("y", cfg.y), ("color", cfg.color)] if column is not None}
+        )
+    keys = list(columns)
+    query = Query(f"SELECT {','.join(quote_identifier(column) for column in columns.values())} FROM database")
     if query_addition:
-        query += f" WHERE {query_addition}"
-    res = con.execute(query).fetchall()
-    data = [
-        {
-            "id": [x[0] for x in res],
-            "mode": "markers",
-            "type": "scattergl",
-        }
-    ]
-    if cfg.x is not None:
-        data[0]["x"] = [x[1] for x in res]
-    if cfg.y is not None:
-        data[0]["y"] = [x[2] for x in res]
-    if cfg.color is not None and not cfg.color_is_categorical:
-        # Color is always categorical here, index always the last column
-        data[0]["marker"] = {"color": [x[-1] for x in res], "colorscale": "Viridis", "showscale": True}
-    return data
-
-
-def get_grid_data(con: sqlite3.Connection, query_addition: Optional[str] = None) -> List[Dict[str, List[int]]]:
-    """Get data for the grid. The grid is a special case as it does not have x and y values,
-    so we can be more efficient here.
+        query += Query(" WHERE ") + query_addition
+    query += " ORDER BY id"
+    rows = con.execute(query.sql, query.params).fetchall()
+    # a single object array of all rows, sliced into columns, is much faster than building a list per column.
+    # Object arrays keep the values as returned by SQLite, as columns can hold values of different types.
+    values = np.array(rows, dtype=object).reshape(len(rows), len(keys))
+    arrays = {key: values[:, idx] for idx, key in enumerate(keys)}
+    return PlotColumns(
+        ids=arrays["ids"].astype(np.int64), x=arrays.get("x"), y=arrays.get("y"), color=arrays.get("color")
+    )
+
+
+def get_color_values(con: sqlite3.Connection, cfg: Config) -> List[Any]:
+    """Get the distinct values of the color column, in order of appearance."""
+    assert cfg.color is not None  # MyPy
+    # NOT INDEXED keeps the colors in order of appearance instead of the order of the color index
+    return [row[0] for row in con.execute(f"SELECT DISTINCT {quote_identifier(cfg.color)} FROM database NOT INDEXED")]
+
+
+def build_data_dict(  # pylint: disable=too-many-arguments
+    cfg: Config,
+    ids: np.ndarray,
+    x: Optional[np.ndarray] = None,
+    y: Optional[np.ndarray] = None,
+    color: Optional[np.ndarray] = None,
+    color_values: Optional[Sequence[Any]] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[List[Any]]]:
+    """Build the data for the plotly graph from column arrays.
+    This is the columnar counterpart of `get_data_dict`, used by storage backends that do not use SQLite.
 
     Parameters
     ----------
-    con : sqlite3.Connection
-        Database connection
-    query_addition : Optional[str], optional
-        Additional query string to add to the query, by default None
-        Used when filtering data.
+    cfg : Config
+        Configuration object
+    ids : np.ndarray
+        The ids of the data points
+    x : Optional[np.ndarray], optional
+        The values of the x column, by default None
+    y : Optional[np.ndarray], optional
+        The values of the y column, by default None
+    color : Optional[np.ndarray], optional
+        The values of the color column, by default None
+    color_values : Optional[Sequence[Any]], optional
+        The distinct color values in the order of the traces, by default None.
+        Defaults to the values of `color` in order of appearance. When filtering,
+        pass the values of the full dataset so the trace colors stay the same.
 
     Returns
     -------
-    List[Dict[str, List[int]]]
-        Data for the grid
-    """
-    query = "SELECT id FROM database"
-    if query_addition:
-        query += f" WHERE {query_addition}"
-    res = con.execute(query).fetchall()
-    data = [{"id": [x[0] for x in res]}]
-    return data
+    Tuple[List[Dict[str, Any]], Optional[List[Any]]]
+        Data for plotly graph, same format as `get_data_dict`.
 
-
-def get_data_per_color(
-    cfg: Config, con: sqlite3.Connection, query_addition: Optional[str] = None
-) -> Tuple[List[Dict[str, Any]], List[str]]:
-    """Get data for plotly graph per color.
+        List of colors for each data point. Used for coloring the data points.
+    """
+    if cfg.color is not None and cfg.color_is_categorical:
+        assert color is not None and x is not None and y is not None, "Categorical colors require x, y and color"
+        if color_values is None:
+            color_values = pd.unique(color).tolist()
+        # group the points by color in a single pass: a stable sort by color code keeps the order within a color,
+        # the group boundaries are then found with a binary search. Points with other colors get code -1.
+        codes = pd.Index(color_values).get_indexer(color)
+        order = np.argsort(codes, kind="stable")
+        boundaries = np.searchsorted(codes[order], np.arange(len(color_values) + 1), side="left")
+        ids, x, y = ids[order], x[order], y[order]
+        data = []
+        for idx, color_value in enumerate(color_values):
+            group = slice(boundaries[idx], boundaries[idx + 1])
+            data.append(
+                {
+                    "id": ids[group].tolist(),
+                    "x": x[group].tolist(),
+                    "y": y[group].tolist(),
+                    "mode": "markers",
+                    "type": "scattergl",
+                    "name": color_value,
+                    "marker": {
+                        "color": COLORS[idx % len(COLORS)],
+                        "opacity": 1.0 if cfg.type != "histogram" else 0.5,
+                    },
+                }
+            )
+        return data, list(color_values)
+    if cfg.type == "grid":
+        return [{"id": ids.tolist()}], None
+    trace: Dict[str, Any] = {"id": ids.tolist(), "mode": "markers", "type": "scattergl"}
+    if x is not None:
+        trace["x"] = x.tolist()
+    if y is not None:
+        trace["y"] = y.tolist()
+    if color is not None:
+        trace["marker"] = {"color": color.tolist(), "colorscale": "Viridis", "showscale": True}
+    return [trace], None
+
+
+def merge_data_dicts(data: List[Dict[str, Any]], new_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Merge the plotly data of newly added rows into the existing plotly data.
+    The new data should be built with the existing colors first, see `build_data_dict`,
+    so the traces of both line up by index. Traces for new colors are added at the end.
 
     Parameters
     ----------
-    cfg : Config
-        Configuration object
-    con : sqlite3.Connection
-        Database connection
-    query_addition : Optional[str], optional
-        Additional query string to add to the query, by default None
-        Used when filtering data.
+    data : List[Dict[str, Any]]
+        The existing data, is updated in place
+    new_data : List[Dict[str, Any]]
+        The data of the new rows
 
     Returns
     -------
-    Tuple[List[Dict[str, Any]], List[str]]
-        Data for plotly graph.
-        List of dicts with keys: id, x, y, mode, type, name (the color) and marker (indicating the color)
-
-        List of colors for each data point. Used for coloring the data points.
+    List[Dict[str, Any]]
+        The merged data
     """
-    colors, data = [], []
-    res = con.execute(f"SELECT DISTINCT {cfg.color} FROM database")
-    results: List[Any] = res.fetchall()
-    for idx, color in enumerate([x[0] for x in results]):
-        colors.append(color)
-        query = f"SELECT id,{cfg.x},{cfg.y},{cfg.color} FROM database WHERE {cfg.color} = '{color}'"
-        if query_addition:
-            if not query_addition.lstrip(" ").startswith("AND"):
-                query_addition = "AND " + query_addition
-            query += f" {query_addition}"
-        res_query: List[Any] = con.execute(query).fetchall()
-        data.append(
-            {
-                "id": [x[0] for x in res_query],
-                "x": [x[1] for x in res_query],
-                "y": [x[2] for x in res_query],
-                "mode": "markers",
-                "type": "scattergl",
-                "name": color,
-                "marker": {
-                    "color": COLORS[idx % len(COLORS)],
-                    "opacity": 1.0 if cfg.type != "histogram" else 0.5,
-                },
-            }
-        )
-    return data, colors
+    for idx, new_trace in enumerate(new_data):
+        if idx >= len(data):
+            data.append(new_trace)
+            continue
+        for key in ["id", "x", "y"]:
+            if key in new_trace:
+                data[idx][key].extend(new_trace[key])
+        new_marker_color = new_trace.get("marker", {}).get("color")
+        if isinstance(new_marker_color, list):
+            data[idx]["marker"]["color"].extend(new_marker_color)
+    return data
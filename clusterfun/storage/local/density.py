@@ -0,0 +1,354 @@
+"""
+density.py
+==========
+
+This module provides the density pyramid of a scatter plot: the number of points per bin of a grid over the x and y
+extent of the plot, at several resolutions. Level l has 2**l by 2**l bins, every level halves the bin width and height
+of the level before it. Each bin also holds a representative point, the one with the smallest id.
+
+The pyramid is computed when the view is stored and saved next to the data, views stored before that get theirs
+saved when they are first read. Plots with millions of points are too
+large to send to the browser at once, so the plot is requested per viewport instead: if few points fall inside the
+viewport, they are sent as they are, otherwise the bins of the level that matches the pixel size of the viewport are
+sent. Choosing those bins only slices the stored pyramid, so zooming and panning do not query the data.
+
+Only the non-empty bins are stored, as rows of their cell (the row-major index of the bin in its level),
+point count and representative id.
+
+Classes
+-------
+PyramidNotFoundError
+    Raised for a view without a density pyramid.
+DensityLevel
+    The non-empty bins of a level of the pyramid.
+DensityPyramid
+    The density pyramid of a scatter plot.
+
+Functions
+---------
+build_pyramid(ids: np.ndarray, x: np.ndarray, y: np.ndarray, levels: int) -> Optional[DensityPyramid]
+    Build the density pyramid of the points of a plot.
+read_pyramid(save_dir: Path) -> Optional[DensityPyramid]
+    Read the density pyramid of a view.
+write_pyramid(save_dir: Path, pyramid: Optional[DensityPyramid])
+    Write the density pyramid of a view.
+has_pyramid(cfg: Config) -> bool
+    Whether a plot gets a density pyramid.
+get_plot_points(cfg: Config, data: List[Dict[str, Any]]) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]
+    Get the points of a plot from its plot data.
+get_sqlite_pyramid(con: sqlite3.Connection, cfg: Config) -> Optional[DensityPyramid]
+    Build the density pyramid of the database of a view.
+"""
+
+import dataclasses
+import math
+import sqlite3
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from clusterfun.config import Config
+from clusterfun.storage.local.ingest import quote_identifier
+
+DENSITY_FILE = "density.npz"
+# number of levels of the pyramid, the finest level has 2**(DENSITY_LEVELS - 1) bins per axis
+DENSITY_LEVELS = 11
+# target width and height of a bin on screen, in pixels
+BIN_PIXELS = 4
+
+
+class PyramidNotFoundError(KeyError):
+    """Raised for a view without a density pyramid, e.g. a plot that is not a scatter plot."""
+
+
+@dataclasses.dataclass
+class DensityLevel:
+    """The non-empty bins of a level of the pyramid, sorted by cell.
+    The cell of a bin is its row-major index in the grid of `size` by `size` bins."""
+
+    size: int
+    cells: np.ndarray
+    counts: np.ndarray
+    ids: np.ndarray
+
+    @property
+    def nbytes(self) -> int:
+        """The memory used by the bins."""
+        return self.cells.nbytes + self.counts.nbytes + self.ids.nbytes
+
+
+@dataclasses.dataclass
+class DensityPyramid:
+    """The density pyramid of a scatter plot over the extent [x_min, x_max] by [y_min, y_max], coarsest level first."""
+
+    x_min: float
+    x_max: float
+    y_min: float
+    y_max: float
+    levels: List[DensityLevel]
+
+    @property
+    def nbytes(self) -> int:
+        """The memory used by the bins of all levels."""
+        return sum(level.nbytes for level in self.levels)
+
+    @property
+    def x_span(self) -> float:
+        """The width of the extent, 1 if all points have the same x."""
+        return self.x_max - self.x_min or 1.0
+
+    @property
+    def y_span(self) -> float:
+        """The height of the extent, 1 if all points have the same y."""
+        return self.y_max - self.y_min or 1.0
+
+    def get_cells(self, x: np.ndarray, y: np.ndarray, size: int) -> np.ndarray:
+        """Get the cells of the points with the given x and y in the level with `size` by `size` bins."""
+        # the maximum falls in the last bin instead of just after it
+        column = np.clip(((x - self.x_min) / self.x_span * size).astype(np.int64), 0, size - 1)
+        row = np.clip(((y - self.y_min) / self.y_span * size).astype(np.int64), 0, size - 1)
+        return row * size + column
+
+    def select_level(self, x_range: Tuple[float, float], y_range: Tuple[float, float], width: int, height: int) -> int:
+        """
+        Select the finest level whose bins are at least BIN_PIXELS pixels wide and high in the viewport.
+
+        Parameters
+        ----------
+        x_range : Tuple[float, float]
+            The x range of the viewport
+        y_range : Tuple[float, float]
+            The y range of the viewport
+        width : int
+            The width of the viewport in pixels
+        height : int
+            The height of the viewport in pixels
+
+        Returns
+        -------
+        int
+            The index of the level
+        """
+        level = len(self.levels) - 1
+        for span, (start, end), pixels in [(self.x_span, x_range, width), (self.y_span, y_range, height)]:
+            if end > start:
+                # bins at level l are span / 2**l wide, which should be at least BIN_PIXELS * (end - start) / pixels
+                level = min(level, math.floor(math.log2(span * pixels / (BIN_PIXELS * (end - start)))))
+        return max(level, 0)
+
+    def get_bins(self, level: int, x_range: Tuple[float, float], y_range: Tuple[float, float]) -> Dict[str, Any]:
+        """
+        Get the non-empty bins of a level that overlap the viewport.
+
+        Parameters
+        ----------
+        level : int
+            The index of the level
+        x_range : Tuple[float, float]
+            The x range of the viewport
+        y_range : Tuple[float, float]
+            The y range of the viewport
+
+        Returns
+        -------
+        Dict[str, Any]
+            The bin width and height, and the centers, point counts and representative ids of the bins
+        """
+        density_level = self.levels[level]
+        bin_width, bin_height = self.x_span / density_level.size, self.y_span / density_level.size
+        mask = self.get_overlap(density_level, x_range, y_range)
+        cells = density_level.cells[mask]
+        return {
+            "level": level,
+            "bin_width": bin_width,
+            "bin_height": bin_height,
+            "x": (self.x_min + (cells % density_level.size + 0.5) * bin_width).tolist(),
+            "y": (self.y_min + (cells // density_level.size + 0.5) * bin_height).tolist(),
+            "count": density_level.counts[mask].tolist(),
+            "id": density_level.ids[mask].tolist(),
+        }
+
+    def count_points(self, x_range: Tuple[float, float], y_range: Tuple[float, float]) -> int:
+        """Count the points in the bins of the finest level that overlap the viewport,
+        an upper bound of the number of points inside the viewport."""
+        finest = self.levels[-1]
+        return int(finest.counts[self.get_overlap(finest, x_range, y_range)].sum())
+
+    def get_overlap(
+        self, density_level: DensityLevel, x_range: Tuple[float, float], y_range: Tuple[float, float]
+    ) -> np.ndarray:
+        """Get the mask of the bins of a level that overlap the viewport."""
+        column, row = density_level.cells % density_level.size, density_level.cells // density_level.size
+        first_column, last_column = get_bin_range(x_range, self.x_min, self.x_span, density_level.size)
+        first_row, last_row = get_bin_range(y_range, self.y_min, self.y_span, density_level.size)
+        return (column >= first_column) & (column <= last_column) & (row >= first_row) & (row <= last_row)
+
+
+def get_bin_range(value_range: Tuple[float, float], minimum: float, span: float, size: int) -> Tuple[int, int]:
+    """Get the first and last bin index of an axis with `size` bins that overlap a range of values."""
+    start, end = (np.asarray(value_range, dtype=np.float64) - minimum) / span * size
+    return int(np.clip(np.floor(start), -1, size)), int(np.clip(np.floor(end), -1, size))
+
+
+def group_cells(cells: np.ndarray, counts: np.ndarray, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Group at least one row by cell, summing the counts and keeping the smallest id of each cell, sorted by cell."""
+    order = np.lexsort((ids, cells))
+    cells, counts, ids = cells[order], counts[order], ids[order]
+    starts = np.flatnonzero(np.concatenate([[True], cells[1:] != cells[:-1]]))
+    return cells[starts], np.add.reduceat(counts, starts), ids[starts]
+
+
+def build_pyramid(
+    ids: np.ndarray, x: np.ndarray, y: np.ndarray, levels: int = DENSITY_LEVELS
+) -> Optional[DensityPyramid]:
+    """
+    Build the density pyramid of the points of a plot. Points with a missing x or y are left out.
+
+    Parameters
+    ----------
+    ids : np.ndarray
+        The ids of the points
+    x : np.ndarray
+        The x values of the points, as floats
+    y : np.ndarray
+        The y values of the points, as floats
+    levels : int, optional
+        The number of levels, by default DENSITY_LEVELS
+
+    Returns
+    -------
+    Optional[DensityPyramid]
+        The pyramid, or None if no point has both an x and a y
+    """
+    present = ~(np.isnan(x) | np.isnan(y))
+    ids, x, y = np.asarray(ids, dtype=np.int64)[present], x[present], y[present]
+    if len(ids) == 0:
+        return None
+    pyramid = DensityPyramid(
+        x_min=float(x.min()), x_max=float(x.max()), y_min=float(y.min()), y_max=float(y.max()), levels=[]
+    )
+    size = 2 ** (levels - 1)
+    cells, counts, ids = group_cells(pyramid.get_cells(x, y, size), np.ones(len(ids), dtype=np.int64), ids)
+    pyramid.levels.append(DensityLevel(size=size, cells=cells, counts=counts, ids=ids))
+    while size > 1:
+        # every bin of a level covers two by two bins of the next level
+        column, row = cells % size // 2, cells // size // 2
+        size //= 2
+        cells, counts, ids = group_cells(row * size + column, counts, ids)
+        pyramid.levels.insert(0, DensityLevel(size=size, cells=cells, counts=counts, ids=ids))
+    return pyramid
+
+
+def read_pyramid(save_dir: Path) -> Optional[DensityPyramid]:
+    """Read the density pyramid of a view, None if the view was stored without one."""
+    try:
+        with np.load(save_dir / DENSITY_FILE) as arrays:
+            if "extent" not in arrays:
+                # the plot gets no pyramid, see `write_pyramid`
+                return None
+            extent = arrays["extent"]
+            return DensityPyramid(
+                x_min=float(extent[0]),
+                x_max=float(extent[1]),
+                y_min=float(extent[2]),
+                y_max=float(extent[3]),
+                levels=[
+                    DensityLevel(
+                        size=2**level,
+                        cells=arrays[f"cells_{level}"],
+                        counts=arrays[f"counts_{level}"],
+                        ids=arrays[f"ids_{level}"],
+                    )
+                    for level in range(int(arrays["levels"]))
+                ],
+            )
+    except FileNotFoundError:
+        return None
+
+
+def write_pyramid(save_dir: Path, pyramid: Optional[DensityPyramid]):
+    """Write the density pyramid of a view, to a new file that replaces the old one.
+    Without a pyramid, e.g. when x or y is not numeric, a file without levels is written, so a view without a file
+    is known to be stored before the pyramid was saved with it, see `LocalLoader.read_state`."""
+    arrays: Dict[str, np.ndarray] = {"levels": np.array(0)}
+    if pyramid is not None:
+        arrays["extent"] = np.array([pyramid.x_min, pyramid.x_max, pyramid.y_min, pyramid.y_max])
+        arrays["levels"] = np.array(len(pyramid.levels))
+        for level, density_level in enumerate(pyramid.levels):
+            arrays[f"cells_{level}"] = density_level.cells
+            arrays[f"counts_{level}"] = density_level.counts
+            arrays[f"ids_{level}"] = density_level.ids
+    # a temporary file of its own, as the pyramids of legacy views are written when they are read by any thread,
+    # and a file object, as np.savez adds the .npz suffix to paths
+    with tempfile.NamedTemporaryFile(dir=save_dir, prefix=DENSITY_FILE, suffix=".tmp", delete=False) as f:
+        tmp_path = Path(f.name)
+        np.savez(f, **arrays)
+    try:
+        tmp_path.replace(save_dir / DENSITY_FILE)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def has_pyramid(cfg: Config) -> bool:
+    """Whether a plot gets a density pyramid: scatter plots with an x and a y column."""
+    return cfg.type == "scatter" and cfg.x is not None and cfg.y is not None
+
+
+def get_plot_points(cfg: Config, data: List[Dict[str, Any]]) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Get the points of a plot from its plot data, the traces as saved to data.json, to build the pyramid from.
+
+    Parameters
+    ----------
+    cfg : Config
+        The config of the plot
+    data : List[Dict[str, Any]]
+        The traces of the plot, with their ids and x and y values
+
+    Returns
+    -------
+    Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]
+        The ids and the x and y values as floats, or None if the plot gets no pyramid or its x or y is not numeric
+    """
+    if not has_pyramid(cfg) or len(data) == 0:
+        return None
+    try:
+        ids, x, y = (
+            np.concatenate([np.asarray(trace[key], dtype=dtype) for trace in data])
+            for key, dtype in [("id", np.int64), ("x", np.float64), ("y", np.float64)]
+        )
+    except (TypeError, ValueError):
+        return None
+    return ids, x, y
+
+
+def get_sqlite_pyramid(con: sqlite3.Connection, cfg: Config) -> Optional[DensityPyramid]:
+    """
+    Build the density pyramid of the database of a view.
+
+    Parameters
+    ----------
+    con : sqlite3.Connection
+        A connection to the database of the view
+    cfg : Config
+        The config of the plot
+
+    Returns
+    -------
+    Optional[DensityPyramid]
+        The pyramid, or None if the plot gets no pyramid or its x or y column is not numeric
+    """
+    if not has_pyramid(cfg):
+        return None
+    assert cfg.x is not None and cfg.y is not None  # MyPy
+    x_sql, y_sql = quote_identifier(cfg.x), quote_identifier(cfg.y)
+    rows = con.execute(
+        f"SELECT id, {x_sql}, {y_sql} FROM database WHERE {x_sql} IS NOT NULL AND {y_sql} IS NOT NULL"
+    ).fetchall()
+    try:
+        values = np.array(rows, dtype=np.float64).reshape(len(rows), 3)
+    except (TypeError, ValueError):
+        return None
+    return build_pyramid(values[:, 0].astype(np.int64), values[:, 1], values[:, 2])
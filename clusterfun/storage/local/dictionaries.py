@@ -0,0 +1,93 @@
+"""
+dictionaries.py
+===============
+
+This module provides the column dictionaries of a view: the distinct values of its categorical (text) columns,
+stored at save time in a sidecar file next to the data. Filters on categorical columns are validated against
+the values of the filter column, which are then looked up in the cached dictionary instead of queried from the data
+for every filter value.
+
+Columns with more than DICTIONARY_MAX_CARDINALITY distinct values, e.g. the media paths, get no dictionary.
+Filters on those columns are validated with a single query for all filter values, see `get_present_values`.
+
+Functions
+---------
+read_dictionaries(save_dir: Path) -> Dict[str, FrozenSet[Any]]
+    Read the column dictionaries of a view.
+write_dictionaries(save_dir: Path, dictionaries: Dict[str, List[Any]])
+    Write the column dictionaries of a view.
+get_sqlite_dictionaries(con: sqlite3.Connection, exclude: Collection[str]) -> Dict[str, List[Any]]
+    Get the distinct values of the text columns of a database.
+get_present_values(con: sqlite3.Connection, column: str, values: Sequence[Any]) -> Set[Any]
+    Get the values that occur in a column of a database.
+"""
+
+import json
+import sqlite3
+from pathlib import Path
+from typing import Any, Collection, Dict, FrozenSet, List, Sequence, Set
+
+from clusterfun.storage.local.ingest import quote_identifier
+from clusterfun.storage.local.query import in_values
+
+DICTIONARIES_FILE = "dictionaries.json"
+# columns with more distinct values than this get no dictionary
+DICTIONARY_MAX_CARDINALITY = 10_000
+
+
+def read_dictionaries(save_dir: Path) -> Dict[str, FrozenSet[Any]]:
+    """Read the column dictionaries of a view, empty if the view was stored without them."""
+    try:
+        with open(save_dir / DICTIONARIES_FILE, encoding="utf-8") as f:
+            return {column: frozenset(values) for column, values in json.load(f).items()}
+    except FileNotFoundError:
+        return {}
+
+
+def write_dictionaries(save_dir: Path, dictionaries: Dict[str, List[Any]]):
+    """Write the column dictionaries of a view, to a new file that replaces the old one."""
+    with open(save_dir / f"{DICTIONARIES_FILE}.tmp", "w", encoding="utf-8") as f:
+        json.dump(dictionaries, f)
+    (save_dir / f"{DICTIONARIES_FILE}.tmp").replace(save_dir / DICTIONARIES_FILE)
+
+
+def get_sqlite_dictionaries(con: sqlite3.Connection, exclude: Collection[str] = ()) -> Dict[str, List[Any]]:
+    """
+    Get the distinct values of the text columns of the database of a view.
+
+    Parameters
+    ----------
+    con : sqlite3.Connection
+        A connection to the database of the view
+    exclude : Collection[str], optional
+        Columns to skip, e.g. the media column, by default ()
+
+    Returns
+    -------
+    Dict[str, List[Any]]
+        The distinct values per column, for the columns with at most DICTIONARY_MAX_CARDINALITY distinct values
+    """
+    dictionaries = {}
+    for _, column, column_type, *_ in con.execute("PRAGMA table_info(database)").fetchall():
+        if column_type != "TEXT" or column in exclude:
+            continue
+        column_sql = quote_identifier(column)
+        values = [
+            row[0]
+            for row in con.execute(
+                f"SELECT DISTINCT {column_sql} FROM database WHERE {column_sql} IS NOT NULL LIMIT ?",
+                (DICTIONARY_MAX_CARDINALITY + 1,),
+            )
+        ]
+        if len(values) <= DICTIONARY_MAX_CARDINALITY:
+            dictionaries[column] = values
+    return dictionaries
+
+
+def get_present_values(con: sqlite3.Connection, column: str, values: Sequence[Any]) -> Set[Any]:
+    """Get the values that occur in a column of the database of a view, with a single query for all values."""
+    query = in_values(column, values)
+    column_sql = quote_identifier(column)
+    return {
+        row[0] for row in con.execute(f"SELECT DISTINCT {column_sql} FROM database WHERE {query.sql}", query.params)
+    }
@@ -0,0 +1,403 @@
+"""
+exports.py
+==========
+
+This module provides the streamed exports of the data of a view, e.g. the media selected in the grid
+or the labeled media, as CSV, Parquet or an Arrow IPC stream.
+
+The rows are read in record batches: from a cursor on the database of the view, or from the Parquet file.
+Every batch is written and sent before the next one is read, so the memory an export takes does not depend
+on the number of rows it has, except for sorted exports of Parquet files, which sort the matching rows in memory.
+
+Classes
+-------
+ChunkSink
+    A file-like sink that hands out the bytes written to it so far.
+
+Functions
+---------
+get_arrow_schema(schema: Dict[str, str]) -> pa.Schema
+    Get the Arrow schema of the columns of the database of a view.
+iter_cursor_batches(con: sqlite3.Connection, cursor: sqlite3.Cursor, schema: pa.Schema, batch_size: int)
+    Read the rows of a cursor as record batches.
+get_csv_timestamp_unit(chunks: Iterable[pa.Array]) -> Optional[str]
+    Get how pandas writes a timestamp column as CSV.
+format_csv_timestamps(array: pa.Array, unit: Optional[str]) -> pa.Array
+    Format timestamps as text like pandas writes them as CSV.
+get_csv_schema(schema: pa.Schema, units: Dict[str, Optional[str]], nullable_integers: List[str]) -> pa.Schema
+    Get the schema of record batches as they are exported as CSV.
+iter_csv_batches(batches: Iterator[pa.RecordBatch], units: Dict[str, Optional[str]], schema: pa.Schema)
+    Convert record batches to be exported as CSV like pandas writes them.
+get_nullable_integers(con: sqlite3.Connection, query: Query, schema: pa.Schema) -> List[str]
+    Get the integer columns of the database that have missing values in the rows of a query.
+get_label_schema(schema: pa.Schema, label_names: List[str]) -> pa.Schema
+    Get the schema of the labeled media, with a column per label.
+iter_labeled_batches(batches: Iterator[pa.RecordBatch], labels: Dict[str, List[str]], label_names: List[str], ...)
+    Add the label columns to record batches of media.
+stream_export(schema: pa.Schema, batches: Iterator[pa.RecordBatch], export_format: ExportFormat) -> Iterator[bytes]
+    Write record batches in an export format, chunk by chunk.
+close_batches(batches: Iterator[pa.RecordBatch])
+    Close the batches of an export if they are a generator.
+"""
+
+import csv
+import io
+import sqlite3
+from typing import Dict, Iterable, Iterator, List, Literal, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from clusterfun.storage.local.ingest import quote_identifier
+from clusterfun.storage.local.query import Query
+
+ExportFormat = Literal["csv", "parquet", "arrow"]
+# per format, the media type and extension of the exported file
+EXPORT_FORMATS: Dict[str, Tuple[str, str]] = {
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrow"),
+}
+# rows read and written at a time
+EXPORT_BATCH_SIZE = 10_000
+# Arrow types of the declared types of the database columns, other types are read as strings
+ARROW_TYPES = {"INTEGER": pa.int64(), "REAL": pa.float64(), "BLOB": pa.binary()}
+# per number of decimals of the seconds pandas writes, the timestamp unit that has as many decimals
+CSV_TIMESTAMP_UNITS = {0: "s", 3: "ms", 6: "us", 9: "ns"}
+NANOSECONDS = {"s": 1_000_000_000, "ms": 1_000_000, "us": 1_000, "ns": 1}
+SECONDS_PER_DAY = 86_400
+
+
+class ChunkSink:
+    """A file-like sink for the Parquet and Arrow writers, that hands out the bytes written to it so far.
+    It keeps track of its position, as the Parquet writer refers to its row groups by offset."""
+
+    closed = False
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.position = 0
+
+    def write(self, data: bytes) -> int:
+        """Write bytes to the sink."""
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        """Return the number of bytes written to the sink."""
+        return self.position
+
+    def flush(self):
+        """Nothing to flush, the bytes are taken with `take`."""
+
+    def close(self):
+        """Close the sink, the bytes written so far can still be taken."""
+        self.closed = True
+
+    def take(self) -> bytes:
+        """Take the bytes written since the last call."""
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def get_arrow_schema(schema: Dict[str, str]) -> pa.Schema:
+    """
+    Get the Arrow schema of the columns of the database of a view.
+    Timestamps are stored as text, so they are exported as strings like before.
+
+    Parameters
+    ----------
+    schema : Dict[str, str]
+        The names and declared types of the columns, see `LocalLoader._read_schema`
+
+    Returns
+    -------
+    pa.Schema
+        The schema of the exported rows
+    """
+    return pa.schema([(name, ARROW_TYPES.get(column_type, pa.string())) for name, column_type in schema.items()])
+
+
+def iter_cursor_batches(
+    con: sqlite3.Connection, cursor: sqlite3.Cursor, schema: pa.Schema, batch_size: int = EXPORT_BATCH_SIZE
+) -> Iterator[pa.RecordBatch]:
+    """
+    Read the rows of a cursor as record batches, closing its connection when all rows are read.
+
+    Parameters
+    ----------
+    con : sqlite3.Connection
+        The connection of the cursor, only used by this export
+    cursor : sqlite3.Cursor
+        The cursor of the query of the exported rows
+    schema : pa.Schema
+        The schema of the rows, see `get_arrow_schema`
+    batch_size : int, optional
+        The number of rows per batch, by default EXPORT_BATCH_SIZE
+
+    Returns
+    -------
+    Iterator[pa.RecordBatch]
+        The batches of rows
+    """
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if len(rows) == 0:
+                return
+            columns = zip(*rows)
+            yield pa.record_batch(
+                [pa.array(values, type=field.type) for field, values in zip(schema, columns)], schema=schema
+            )
+    finally:
+        con.close()
+
+
+def get_csv_timestamp_unit(chunks: Iterable[pa.Array]) -> Optional[str]:
+    """
+    Get how pandas writes a timestamp column as CSV, from all of its values: only the dates if the column has
+    no time zone and all of its values are at midnight, otherwise the dates and times, with as few decimals
+    of the seconds as its values need.
+
+    Parameters
+    ----------
+    chunks : Iterable[pa.Array]
+        The chunks of the timestamp column
+
+    Returns
+    -------
+    Optional[str]
+        The timestamp unit with the decimals to write, or None to write only the dates
+    """
+    dates_only, decimals = True, 0
+    for chunk in chunks:
+        timestamp_type = chunk.type
+        ticks_per_second = NANOSECONDS["s"] // NANOSECONDS[timestamp_type.unit]
+        values = pc.drop_null(chunk).cast(pa.int64()).to_numpy()
+        dates_only = dates_only and timestamp_type.tz is None
+        dates_only = dates_only and bool(np.all(values % (SECONDS_PER_DAY * ticks_per_second) == 0))
+        nanoseconds = values % ticks_per_second * NANOSECONDS[timestamp_type.unit]
+        while decimals < 9 and np.any(nanoseconds % 10 ** (9 - decimals) != 0):
+            decimals += 3
+    return None if dates_only else CSV_TIMESTAMP_UNITS[decimals]
+
+
+def format_csv_timestamps(array: pa.Array, unit: Optional[str]) -> pa.Array:
+    """
+    Format timestamps as text like pandas writes them as CSV, e.g. 2020-01-02, 2020-01-02 03:04:05.500
+    or 2020-01-02 03:04:05+01:00, and missing values as nulls.
+
+    Parameters
+    ----------
+    array : pa.Array
+        The timestamps
+    unit : Optional[str]
+        The timestamp unit with the decimals to write, or None to write only the dates, see `get_csv_timestamp_unit`
+
+    Returns
+    -------
+    pa.Array
+        The formatted timestamps
+    """
+    if unit is None:
+        return pc.strftime(array, format="%Y-%m-%d")
+    timezone = array.type.tz
+    # the seconds are formatted with the decimals of the unit
+    array = array.cast(pa.timestamp(unit, timezone))
+    if timezone is None:
+        return pc.strftime(array, format="%Y-%m-%d %H:%M:%S")
+    # pandas writes the offset as +01:00 where strftime writes +0100
+    text = pc.strftime(array, format="%Y-%m-%d %H:%M:%S%z")
+    return pc.replace_substring_regex(text, pattern=r"(\d\d)$", replacement=r":\1")
+
+
+def get_csv_schema(schema: pa.Schema, units: Dict[str, Optional[str]], nullable_integers: List[str]) -> pa.Schema:
+    """Get the schema of record batches as they are exported as CSV, see `iter_csv_batches`."""
+    fields = []
+    for field in schema:
+        if field.name in units:
+            field = field.with_type(pa.string())
+        elif field.name in nullable_integers:
+            field = field.with_type(pa.float64())
+        fields.append(field)
+    return pa.schema(fields)
+
+
+def iter_csv_batches(
+    batches: Iterator[pa.RecordBatch], units: Dict[str, Optional[str]], schema: pa.Schema
+) -> Iterator[pa.RecordBatch]:
+    """
+    Convert record batches to be exported as CSV like pandas writes them: the timestamp columns are formatted
+    as text, and integer columns with missing values are written as floats, as pandas reads them as floats.
+
+    Parameters
+    ----------
+    batches : Iterator[pa.RecordBatch]
+        The batches to export
+    units : Dict[str, Optional[str]]
+        Per timestamp column, how to format it, see `get_csv_timestamp_unit`
+    schema : pa.Schema
+        The schema of the converted batches, see `get_csv_schema`
+
+    Returns
+    -------
+    Iterator[pa.RecordBatch]
+        The converted batches
+    """
+    try:
+        for batch in batches:
+            columns = [
+                format_csv_timestamps(column, units[field.name]) if field.name in units else column.cast(field.type)
+                for field, column in zip(schema, batch.columns)
+            ]
+            yield pa.record_batch(columns, schema=schema)
+    finally:
+        close_batches(batches)
+
+
+def get_nullable_integers(con: sqlite3.Connection, query: Query, schema: pa.Schema) -> List[str]:
+    """
+    Get the integer columns of the database that have missing values in the rows of a query,
+    which pandas reads as floats, see `iter_csv_batches`.
+
+    Parameters
+    ----------
+    con : sqlite3.Connection
+        The connection to the database
+    query : Query
+        The query of the exported rows
+    schema : pa.Schema
+        The schema of the rows, see `get_arrow_schema`
+
+    Returns
+    -------
+    List[str]
+        The integer columns with missing values
+    """
+    integers = [field.name for field in schema if pa.types.is_integer(field.type)]
+    if len(integers) == 0:
+        return []
+    columns = ", ".join(f"MAX({quote_identifier(column)} IS NULL)" for column in integers)
+    has_nulls = con.execute(f"SELECT {columns} FROM ({query.sql})", query.params).fetchone()
+    return [column for column, has_null in zip(integers, has_nulls) if has_null]
+
+
+def get_label_schema(schema: pa.Schema, label_names: List[str]) -> pa.Schema:
+    """
+    Get the schema of the labeled media: their media id, a column per label with 1 if they have the label
+    and 0 if not, and their data.
+
+    Parameters
+    ----------
+    schema : pa.Schema
+        The schema of the data
+    label_names : List[str]
+        The labels, sorted
+
+    Returns
+    -------
+    pa.Schema
+        The schema of the exported labeled media
+    """
+    fields = [pa.field("media_id", pa.int64())] + [pa.field(label, pa.int64()) for label in label_names]
+    return pa.schema(fields + list(schema))
+
+
+def iter_labeled_batches(
+    batches: Iterator[pa.RecordBatch], labels: Dict[str, List[str]], label_names: List[str], schema: pa.Schema
+) -> Iterator[pa.RecordBatch]:
+    """
+    Add the label columns to record batches of media.
+
+    Parameters
+    ----------
+    batches : Iterator[pa.RecordBatch]
+        The batches of the data of the media, with an `id` column
+    labels : Dict[str, List[str]]
+        The labels per media id, as stored by the label manager
+    label_names : List[str]
+        The labels to add a column for, in the order of the schema
+    schema : pa.Schema
+        The schema of the labeled media, see `get_label_schema`
+
+    Returns
+    -------
+    Iterator[pa.RecordBatch]
+        The batches of labeled media
+    """
+    try:
+        for batch in batches:
+            media_ids = batch.column("id").to_pylist()
+            media_labels = [labels.get(str(media_id), []) for media_id in media_ids]
+            label_columns = [
+                pa.array([int(label in item_labels) for item_labels in media_labels], type=pa.int64())
+                for label in label_names
+            ]
+            yield pa.record_batch([pa.array(media_ids, type=pa.int64()), *label_columns, *batch.columns], schema=schema)
+    finally:
+        close_batches(batches)
+
+
+def stream_export(schema: pa.Schema, batches: Iterator[pa.RecordBatch], export_format: ExportFormat) -> Iterator[bytes]:
+    """
+    Write record batches in an export format, chunk by chunk.
+    CSV is written like `DataFrame.to_csv(index=False)`: missing values as empty fields and quoted when needed.
+    The batches are closed when the export is, also when it is closed before its end.
+
+    Parameters
+    ----------
+    schema : pa.Schema
+        The schema of the batches
+    batches : Iterator[pa.RecordBatch]
+        The batches to export
+    export_format : ExportFormat
+        The format to export, one of csv, parquet or arrow
+
+    Returns
+    -------
+    Iterator[bytes]
+        The chunks of the exported file, one per batch and the header and footer if any
+    """
+    try:
+        if export_format == "csv":
+            yield from stream_csv(schema, batches)
+            return
+        sink = ChunkSink()
+        if export_format == "parquet":
+            writer = pq.ParquetWriter(sink, schema)
+        else:
+            writer = pa.ipc.new_stream(sink, schema)
+        for batch in batches:
+            if batch.num_rows > 0:
+                writer.write_batch(batch)
+                yield sink.take()
+        writer.close()
+        yield sink.take()
+    finally:
+        close_batches(batches)
+
+
+def close_batches(batches: Iterator[pa.RecordBatch]):
+    """Close the batches of an export if they are a generator, also when the export is closed before its end,
+    e.g. when the client disconnects, so the connection they read from is closed right away."""
+    close = getattr(batches, "close", None)
+    if close is not None:
+        close()
+
+
+def stream_csv(schema: pa.Schema, batches: Iterator[pa.RecordBatch]) -> Iterator[bytes]:
+    """Write record batches as CSV, chunk by chunk, see `stream_export`."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(schema.names)
+    for batch in batches:
+        columns = [column.to_pylist() for column in batch.columns]
+        writer.writerows([["" if value is None else value for value in row] for row in zip(*columns)])
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
@@ -0,0 +1,115 @@
+"""
+filter_cache.py
+===============
+
+This module provides the process-wide cache of filter results: the serialized plot data or id mask of a view
+for a set of filters. People inspecting the same view tend to apply the same few filters, which are then only validated,
+queried and serialized once.
+
+Filters are normalized before they are used as key: filters are combined with AND, so their order does not matter,
+and neither does the order of the values of IN and NOT IN filters. Values are compared as they are bound to the query,
+so 50 and "50" are the same value.
+
+Cached results are tied to the version of the data of the view: the config, column metadata and data files,
+but not the labels. A result for an older version (e.g. before rows were appended) is never returned.
+
+The memory budget of the cache is set with the CLUSTERFUN_FILTER_CACHE_BYTES environment variable.
+
+Classes
+-------
+FilterResultCache
+    A least recently used cache of the serialized filter results of the views.
+
+Functions
+---------
+get_filter_key(filters: List[Filter]) -> Tuple[Hashable, ...]
+    Get the normalized key of a set of filters.
+"""
+
+import os
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, List, Tuple
+
+from clusterfun.models.filter import Filter
+from clusterfun.storage.local.lru import LRUCache
+from clusterfun.storage.local.query import to_sql_value
+
+# default memory budget of the cache
+FILTER_CACHE_BYTES = 64 * 1024 * 1024
+
+
+def get_filter_key(filters: List[Filter]) -> Tuple[Hashable, ...]:
+    """
+    Get the normalized key of a set of filters, the same for sets of filters that select the same rows.
+
+    Parameters
+    ----------
+    filters : List[Filter]
+        The filters
+
+    Returns
+    -------
+    Tuple[Hashable, ...]
+        The sorted and unique filters, each as a tuple of its column, comparison and values
+    """
+    keys = []
+    for filter_item in filters:
+        values = [to_sql_value(value) for value in filter_item.values]
+        if filter_item.comparison in ["IN", "NOT IN"]:
+            values = sorted(set(values), key=lambda value: (isinstance(value, str), value))
+        keys.append((filter_item.column, filter_item.comparison, tuple(values)))
+    return tuple(sorted(set(keys), key=repr))
+
+
+class FilterResultCache:
+    """A least recently used cache of the serialized filter results of the views,
+    keyed by the directory of the view and the normalized filters."""
+
+    def __init__(self, max_bytes: int):
+        """Initialise the cache.
+
+        Parameters
+        ----------
+        max_bytes : int
+            The maximum size of the cached results in bytes
+        """
+        self.cache: LRUCache[Tuple[Any, bytes]] = LRUCache(max_bytes)
+
+    def get_or_compute(  # pylint: disable=too-many-arguments
+        self, cache_dir: Path, filters: List[Filter], version: Any, compute: Callable[[], bytes], kind: str = "traces"
+    ) -> bytes:
+        """
+        Get the result of the filters for the view, computing and caching it if it is not cached or out of date.
+
+        Parameters
+        ----------
+        cache_dir : Path
+            The directory of the view
+        filters : List[Filter]
+            The filters
+        version : Any
+            The version of the data of the view, see `ViewState.data_version`
+        compute : Callable[[], bytes]
+            Computes the serialized result
+        kind : str, optional
+            The kind of result, e.g. "traces" or "mask", by default "traces"
+
+        Returns
+        -------
+        bytes
+            The serialized result
+        """
+        key = (cache_dir, kind, get_filter_key(filters))
+        entry = self.cache.get(key, validate=lambda cached: cached[0] == version)
+        if entry is not None:
+            return entry[1]
+        result = compute()
+        self.cache.put(key, (version, result), cost=len(result))
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """Get the statistics of the cache."""
+        return self.cache.stats()
+
+
+FILTER_RESULTS = FilterResultCache(int(os.environ.get("CLUSTERFUN_FILTER_CACHE_BYTES", FILTER_CACHE_BYTES)))
@@ -1,8 +1,9 @@
 """Helper functions for local loading and storing"""
 
+import os
 import sqlite3
 from pathlib import Path
-from typing import Any, List, Optional
+from typing import Any, Collection, Iterable, Iterator, List, Mapping, Optional, Union
 
 import orjson
 import pandas as pd
@@ -10,6 +11,11 @@ import pandas as pd
 from clusterfun.config import Config
 from clusterfun.models.filter import Filter, is_float
 from clusterfun.models.media_indices import MediaIndices
+from clusterfun.storage.local.catalog import Catalog
+from clusterfun.storage.local.dictionaries import get_present_values
+from clusterfun.storage.local.pagination import get_cursor_query, get_order_query, get_sort, is_paged
+from clusterfun.storage.local.query import Query, filter_to_query, in_values, join_conditions
+from clusterfun.validation import ColumnNotFoundException
 
 
 def format_df_for_db(cfg: Config, df: pd.DataFrame) -> pd.DataFrame:
@@ -22,6 +28,90 @@ def format_df_for_db(cfg: Config, df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
+def is_local_media(path: Any) -> bool:
+    """Check if a media path is a local path, as opposed to an http(s) or S3 URL."""
+    return not str(path).startswith("http") and not str(path).startswith("s3://")
+
+
+def get_common_media_path(paths: Iterable[Any], common_media_path: Optional[str] = None) -> str:
+    """Get the common path of local media paths.
+
+    Parameters
+    ----------
+    paths : Iterable[Any]
+        The media paths
+    common_media_path : Optional[str], optional
+        The common path of previously seen media paths, by default None.
+        Used to compute the common path chunk by chunk.
+
+    Returns
+    -------
+    str
+        The common path. Can still be a file if there is just one unique path, see `get_media_directory`.
+    """
+    paths = [str(path) for path in paths]
+    if common_media_path is not None:
+        paths.append(common_media_path)
+    return os.path.commonpath(paths)
+
+
+def get_media_directory(common_media_path: str) -> str:
+    """Get the directory to serve local media from, given the common path of all media paths."""
+    if os.path.isfile(common_media_path):
+        return os.path.dirname(common_media_path)
+    return common_media_path
+
+
+class ChunkFormatter:
+    """Formats DataFrame chunks for storage, so data can be stored chunk by chunk.
+    Assigns consecutive ids to the rows, formats the bounding boxes and keeps track of the common
+    path of local media. As that path is only known after the last chunk, the media paths are not replaced
+    here but should be replaced in storage afterwards, see `ChunkFormatter.media_directory`."""
+
+    def __init__(self, cfg: Config, start_id: int = 0):
+        """Initialise the formatter.
+
+        Parameters
+        ----------
+        cfg : Config
+            Configuration object
+        start_id : int, optional
+            The id of the first row, by default 0
+        """
+        self.cfg = cfg
+        self.next_id = start_id
+        self.local_media: Optional[bool] = None
+        self.common_media_path: Optional[str] = None
+
+    @property
+    def media_directory(self) -> Optional[str]:
+        """The directory to serve local media from, None if the media is not local."""
+        if self.common_media_path is None:
+            return None
+        return get_media_directory(self.common_media_path)
+
+    def format(self, chunk: pd.DataFrame) -> pd.DataFrame:
+        """Format a single non-empty chunk, returns a copy with just the columns in `cfg.columns`.
+        Only a sample of the data is validated before saving, so every chunk is checked for the columns."""
+        for column in self.cfg.columns:
+            if column != "id" and column not in chunk.columns:
+                raise ColumnNotFoundException(f"{column} not in columns of chunk starting at row {self.next_id}")
+        if self.local_media is None:
+            self.local_media = is_local_media(chunk[self.cfg.media].iloc[0])
+        if self.local_media:
+            self.common_media_path = get_common_media_path(chunk[self.cfg.media].tolist(), self.common_media_path)
+        chunk = format_df_for_db(self.cfg, chunk.copy())
+        chunk.index = pd.RangeIndex(self.next_id, self.next_id + len(chunk))
+        self.next_id += len(chunk)
+        return chunk.reset_index(drop=False).rename(columns={"index": "id"})[self.cfg.columns]
+
+    def __call__(self, chunks: Iterable[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+        """Format all non-empty chunks."""
+        for chunk in chunks:
+            if len(chunk) > 0:
+                yield self.format(chunk)
+
+
 def get_columns_for_db(
     df: pd.DataFrame, media: str, plot_type: str, x: Optional[str] = None, y: Optional[str] = None
 ) -> List[str]:
@@ -44,72 +134,107 @@ def get_columns_for_db(
     return columns
 
 
-def get_filter_query(con: sqlite3.Connection, config: Config, filters: List[Filter]):
-    """Get the query to apply the filters"""
-    query = ""
-    for idx, filter_item in enumerate(filters):
+def get_filter_query(
+    con: sqlite3.Connection,
+    config: Config,
+    filters: List[Filter],
+    dictionaries: Optional[Mapping[str, Collection[Any]]] = None,
+) -> Query:
+    """Get the condition to apply the filters, skipping invalid filters. Empty if there are no valid filters.
+
+    Parameters
+    ----------
+    con : sqlite3.Connection
+        Connection to the database
+    config : Config
+        The config of the plot, used to validate the filter columns
+    filters : List[Filter]
+        The filters to apply
+    dictionaries : Optional[Mapping[str, Collection[Any]]], optional
+        The distinct values of the categorical columns, see clusterfun/storage/local/dictionaries.py.
+        Categorical filter values are validated against these, or with a single query for columns without them.
+
+    Returns
+    -------
+    Query
+        The condition of the valid filters
+    """
+    conditions = []
+    for filter_item in filters:
+        column_values = (dictionaries or {}).get(filter_item.column)
+        categorical_values = [value for value in filter_item.values if not is_number(value)]
+        if column_values is None and filter_item.column in config.columns and len(categorical_values) > 0:
+            column_values = get_present_values(con, filter_item.column, categorical_values)
         # Check if filter is valid for given column
-        if not filter_item.is_valid(config.columns, con):
-            continue
-        # Add AND statement if not first or last filter
-        if 0 < idx < len(filters):
-            query += " AND "
-        # Add filter to query string
-        value_str = ""
-        for value in filter_item.values:
-            if str(value).isnumeric() or is_float(value):
-                value_str += f"{value},"
-            else:
-                value_str += f"'{value}',"
-        if filter_item.comparison in ["IN", "NOT IN"]:
-            query += f"{filter_item.column} {filter_item.comparison} ({value_str[:-1]})"
-        else:
-            query += f"{filter_item.column} {filter_item.comparison} {value_str[:-1]}"
-    return query
+        if filter_item.is_valid(config.columns, con, column_values=column_values):
+            conditions.append(filter_to_query(filter_item))
+    return join_conditions(conditions)
+
+
+def is_number(value: Any) -> bool:
+    """Check if a filter value is a number, as opposed to a categorical value, in the same way as `Filter.is_valid`"""
+    return str(value).isnumeric() or is_float(value)
 
 
 def get_media_query(
-    media_indices: MediaIndices, paginate: bool = True, config: Optional[Config] = None, con: Optional[Any] = None
-) -> str:
-    """Get the query for the media, used for the grid"""
-    if len(media_indices) == 1:
-        query = f"SELECT * FROM database WHERE id = {media_indices.media_ids[0]}"
+    media_indices: MediaIndices,
+    paginate: bool = True,
+    config: Optional[Config] = None,
+    con: Optional[Any] = None,
+    selection_table: Optional[str] = None,
+    lookahead: bool = False,
+    dictionaries: Optional[Mapping[str, Collection[Any]]] = None,
+) -> Query:
+    """Get the query for the media, used for the grid.
+    If the media indices refer to a selection, `selection_table` is the temporary table with its ids.
+    Pages are selected by the cursor of the media indices if it is given, by the page number otherwise.
+    With `lookahead`, a page includes the first row of the next page, if any."""
+    if media_indices.selection is not None:
+        assert selection_table is not None, "If a selection is provided, its table must be provided"
+        conditions = [Query(f"id IN (SELECT id FROM temp.{selection_table})")]
     else:
-        query = f"SELECT * FROM database WHERE id IN {str(tuple(media_indices.media_ids))}"
+        conditions = [in_values("id", media_indices.media_ids)]
     if media_indices.filters and len(media_indices.filters) > 0:
         assert con is not None and config is not None, "If filters are provided, con and config must be provided"
-        filter_query = get_filter_query(con, config=config, filters=media_indices.filters)
-        if filter_query:
-            query += f" AND {filter_query}"
-    if (
-        media_indices.sort_column is not None
-        and media_indices.sort_column != ""
-        and media_indices.ascending is not None
-    ):
-        query += f" ORDER BY {media_indices.sort_column} {'ASC' if media_indices.ascending else 'DESC'}"
-    if len(media_indices.media_ids) > 50 and paginate:
-        offset = media_indices.page * 50
-        query += f" LIMIT 50 OFFSET {offset}"
+        conditions.append(
+            get_filter_query(con, config=config, filters=media_indices.filters, dictionaries=dictionaries)
+        )
+    sort = get_sort(media_indices)
+    if paginate and media_indices.cursor is not None:
+        conditions.append(get_cursor_query(media_indices.cursor, sort))
+    query = Query("SELECT * FROM database WHERE ") + join_conditions(conditions)
+    # in the order of the pages, and by id if not sorted, so exports are in a stable order too
+    query += get_order_query(sort)
+    if paginate and is_paged(media_indices):
+        # one extra row tells if there is a next page, see `fetch_page` in clusterfun/storage/local/loader.py
+        query += Query(" LIMIT ?", (media_indices.page_size + 1 if lookahead else media_indices.page_size,))
+        if media_indices.cursor is None:
+            query += Query(" OFFSET ?", (media_indices.page * media_indices.page_size,))
     return query
 
 
+def get_cache_dir() -> Path:
+    """Get the cache directory with the stored plots, as set in the CLUSTERFUN_CACHE_DIR environment variable"""
+    return Path(os.environ.get("CLUSTERFUN_CACHE_DIR", os.path.expanduser("~/.cache/clusterfun")))
+
+
 def get_recent_dir(directory: Path) -> Path:
-    """Get the most recently created directory in a directory"""
-    # Get a list of all directories in the directory
-    directories = [d for d in directory.iterdir() if d.is_dir()]
-    # Sort the directories by creation time (oldest to newest) and get the most recent one
-    return max(directories, key=lambda d: d.stat().st_ctime)
+    """Get the most recently created view directory in a cache directory, as stored in its catalog"""
+    uuid = Catalog(directory).get_recent()
+    if uuid is None:
+        raise ValueError(f"No plots found in {directory}")
+    return directory / uuid
 
 
-def run_query(db_path: Path, query: str, fetch_one: bool = False) -> List:
+def run_query(con: sqlite3.Connection, query: Union[str, Query], fetch_one: bool = False) -> List:
     """Run a query on the database
 
     Parameters
     ----------
-    db_path : Path
-        Path to the database
-    query : str
-        Query to run
+    con : sqlite3.Connection
+        Connection to the database
+    query : Union[str, Query]
+        Query to run, with its parameters if it is a Query
     fetch_one : bool, optional
         Whether to fetch one result or all results, by default False
 
@@ -118,11 +243,12 @@ def run_query(db_path: Path, query: str, fetch_one: bool = False) -> List:
     List
         List of results
     """
-    con = sqlite3.connect(db_path, check_same_thread=False)
-    result = con.execute(query)
-    result = result.fetchone() if fetch_one else result.fetchall()
-    con.close()
-    result_list = list(result)
+    if isinstance(query, str):
+        query = Query(query)
+    cursor = con.execute(query.sql, query.params)
+    result = cursor.fetchone() if fetch_one else cursor.fetchall()
+    cursor.close()
+    result_list = list(result) if result is not None else []
     if len(result_list) == 0:
         raise ValueError(f"Query {query=} returned no results")
     return result_list
@@ -0,0 +1,317 @@
+"""
+ingest.py
+=========
+
+This module provides the bulk ingest path for writing a plot's dataframe to the local SQLite database.
+Instead of going through `DataFrame.to_sql`, the table is created with explicit column types and the
+rows are inserted in chunks with `executemany`, all inside a single transaction and with pragmas that
+trade durability for speed while the database is being written. The pragmas are restored afterwards,
+so later writes on the connection, e.g. appended rows, are journaled again.
+
+Functions
+---------
+get_sqlite_type(series: pd.Series) -> str
+    Get the SQLite column type for a pandas series.
+create_table(con: sqlite3.Connection, df: pd.DataFrame, table: str = "database")
+    Create a typed table for the given dataframe.
+insert_rows(con: sqlite3.Connection, df: pd.DataFrame, table: str = "database", chunk_size: int = INGEST_CHUNK_SIZE)
+    Insert the rows of a dataframe in chunks.
+create_indexes(con: sqlite3.Connection, columns: List[str], table: str = "database")
+    Create an index for each of the given columns.
+get_index_columns(cfg: Config, df: pd.DataFrame) -> List[str]
+    Get the columns to index for a plot.
+ingest_dataframe(con: sqlite3.Connection, df: pd.DataFrame, table: str = "database")
+    Create the table and insert all rows in a single transaction.
+ingest_chunks(con: sqlite3.Connection, chunks: Iterable[pd.DataFrame], table: str = "database") -> int
+    Create the table and insert the chunks one by one in a single transaction.
+"""
+
+import sqlite3
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from clusterfun.config import Config
+
+# number of rows passed to a single `executemany` call
+INGEST_CHUNK_SIZE = 50_000
+# page cache used while ingesting, in KiB (SQLite interprets negative cache sizes as KiB)
+INGEST_CACHE_SIZE_KIB = 512 * 1024
+# pragmas set on the connection while ingesting. The database is written once from scratch,
+# so if the process dies halfway the view is unusable anyway and we can skip the journal.
+INGEST_PRAGMAS: Dict[str, Any] = {
+    "journal_mode": "OFF",
+    "synchronous": "OFF",
+    "cache_size": -INGEST_CACHE_SIZE_KIB,
+    "temp_store": "MEMORY",
+}
+# columns with at most this many distinct values are indexed automatically
+INDEX_MAX_CARDINALITY = 1000
+
+
+def quote_identifier(name: str) -> str:
+    """Quote a column or table name for use in a SQLite statement."""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def get_sqlite_type(series: pd.Series) -> str:
+    """Get the SQLite column type for a pandas series.
+    Follows the same mapping as `DataFrame.to_sql`, except that bytes are stored as BLOB.
+
+    Parameters
+    ----------
+    series : pd.Series
+        The series to get the type for
+
+    Returns
+    -------
+    str
+        One of INTEGER, REAL, TIMESTAMP, BLOB or TEXT
+    """
+    dtype = series.dtype
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(dtype):
+        return "REAL"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "TIMESTAMP"
+    inferred = pd.api.types.infer_dtype(series, skipna=True)
+    if inferred in ["integer", "boolean"]:
+        return "INTEGER"
+    if inferred in ["floating", "mixed-integer-float", "decimal"]:
+        return "REAL"
+    if inferred in ["datetime64", "datetime", "date"]:
+        return "TIMESTAMP"
+    if inferred == "bytes":
+        return "BLOB"
+    return "TEXT"
+
+
+def can_be_primary_key(df: pd.DataFrame, column: str) -> bool:
+    """Check if a column can be declared as INTEGER PRIMARY KEY, i.e. if it holds unique integers."""
+    if list(df.columns).count(column) != 1:
+        return False
+    return pd.api.types.is_integer_dtype(df[column].dtype) and df[column].is_unique
+
+
+def create_table(con: sqlite3.Connection, df: pd.DataFrame, table: str = "database", primary_key: Optional[str] = None):
+    """Create a typed table for the given dataframe.
+
+    Parameters
+    ----------
+    con : sqlite3.Connection
+        Database connection
+    df : pd.DataFrame
+        The dataframe to create the table for. Only the columns and dtypes are used.
+    table : str, optional
+        The name of the table, by default "database"
+    primary_key : Optional[str], optional
+        Column to declare as INTEGER PRIMARY KEY, by default None.
+        This makes the column an alias of the rowid, so lookups on it do not need a separate index.
+    """
+    column_definitions = []
+    for column in df.columns:
+        if column == primary_key:
+            column_definitions.append(f"{quote_identifier(column)} INTEGER PRIMARY KEY")
+        else:
+            column_definitions.append(f"{quote_identifier(column)} {get_sqlite_type(df[column])}")
+    con.execute(f"CREATE TABLE {quote_identifier(table)} ({', '.join(column_definitions)})")
+
+
+def to_sqlite_values(series: pd.Series) -> List[Any]:
+    """Convert a series to a list of values that can be bound by sqlite3.
+    Missing values are converted to None, datetimes to strings like `DataFrame.to_sql` does."""
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        return [None if pd.isna(value) else value.isoformat(sep=" ") for value in series]
+    if isinstance(series.dtype, np.dtype) and series.dtype.kind in "biuf":
+        # plain numpy dtypes: NaN is stored as NULL by SQLite and booleans as integers
+        return series.tolist()
+    return series.astype(object).where(series.notna(), None).tolist()
+
+
+def insert_rows(
+    con: sqlite3.Connection, df: pd.DataFrame, table: str = "database", chunk_size: int = INGEST_CHUNK_SIZE
+):
+    """Insert the rows of a dataframe in chunks with `executemany`.
+    Does not commit, that is left to the caller.
+
+    Parameters
+    ----------
+    con : sqlite3.Connection
+        Database connection
+    df : pd.DataFrame
+        The rows to insert
+    table : str, optional
+        The name of the table, by default "database"
+    chunk_size : int, optional
+        The number of rows per `executemany` call, by default INGEST_CHUNK_SIZE
+    """
+    placeholders = ",".join(["?"] * len(df.columns))
+    columns = ",".join(quote_identifier(column) for column in df.columns)
+    query = f"INSERT INTO {quote_identifier(table)} ({columns}) VALUES ({placeholders})"
+    for start in range(0, len(df), chunk_size):
+        chunk = df.iloc[start : start + chunk_size]
+        values = [to_sqlite_values(chunk[column]) for column in chunk.columns]
+        try:
+            con.executemany(query, zip(*values))
+        except (sqlite3.InterfaceError, sqlite3.ProgrammingError) as exc:
+            raise sqlite3.InterfaceError(
+                "This dataframe could not be saved to the database. "
+                "Check if you have any columns with uncommon value types."
+            ) from exc
+
+
+def create_indexes(con: sqlite3.Connection, columns: List[str], table: str = "database"):
+    """Create an index for each of the given columns.
+
+    Parameters
+    ----------
+    con : sqlite3.Connection
+        Database connection
+    columns : List[str]
+        The columns to index
+    table : str, optional
+        The name of the table, by default "database"
+    """
+    for column in columns:
+        index_name = quote_identifier(f"idx_{table}_{column}")
+        con.execute(
+            f"CREATE INDEX IF NOT EXISTS {index_name} ON {quote_identifier(table)} ({quote_identifier(column)})"
+        )
+
+
+def get_index_columns(cfg: Config, df: pd.DataFrame) -> List[str]:
+    """Get the columns to index for a plot.
+    These are the color, x, y and display columns, the columns in `cfg.indexed_columns`
+    and any other column with at most INDEX_MAX_CARDINALITY distinct values.
+
+    Parameters
+    ----------
+    cfg : Config
+        Configuration object
+    df : pd.DataFrame
+        The dataframe as it will be stored in the database
+
+    Returns
+    -------
+    List[str]
+        The columns to index, in the order of the dataframe columns
+    """
+    candidates = {cfg.color, cfg.x, cfg.y}
+    if cfg.display is not None:
+        candidates.update([cfg.display] if isinstance(cfg.display, str) else cfg.display)
+    if cfg.indexed_columns is not None:
+        candidates.update(cfg.indexed_columns)
+    columns = []
+    for column in dict.fromkeys(df.columns):
+        # the id is the primary key, the media and bounding box are never queried on
+        if column in ["id", cfg.media, cfg.bounding_box]:
+            continue
+        if column not in candidates:
+            try:
+                if df[column].nunique() > INDEX_MAX_CARDINALITY:
+                    continue
+            except TypeError:
+                # unhashable values
+                continue
+        columns.append(column)
+    return columns
+
+
+def get_pragmas(con: sqlite3.Connection, keys: Iterable[str]) -> Dict[str, Any]:
+    """Get the values of the given pragmas on the connection."""
+    return {key: con.execute(f"PRAGMA {key}").fetchone()[0] for key in keys}
+
+
+def set_pragmas(con: sqlite3.Connection, pragmas: Dict[str, Any]):
+    """Set the given pragmas on the connection."""
+    for key, value in pragmas.items():
+        con.execute(f"PRAGMA {key} = {value}")
+
+
+def ingest_dataframe(  # pylint: disable=too-many-arguments
+    con: sqlite3.Connection,
+    df: pd.DataFrame,
+    table: str = "database",
+    chunk_size: int = INGEST_CHUNK_SIZE,
+    primary_key: Optional[str] = None,
+    indexes: Optional[List[str]] = None,
+):
+    """Create the table and insert all rows of the dataframe in a single transaction.
+    Indexes are built after all rows are inserted, which is a lot faster than updating them on every insert.
+
+    Parameters
+    ----------
+    con : sqlite3.Connection
+        Database connection, should point to a new database
+    df : pd.DataFrame
+        The dataframe to store
+    table : str, optional
+        The name of the table, by default "database"
+    chunk_size : int, optional
+        The number of rows per `executemany` call, by default INGEST_CHUNK_SIZE
+    primary_key : Optional[str], optional
+        Column to declare as INTEGER PRIMARY KEY, by default None.
+        Ignored if the column does not hold unique integers.
+    indexes : Optional[List[str]], optional
+        Columns to create an index on, by default None
+    """
+    if primary_key is not None and not can_be_primary_key(df, primary_key):
+        primary_key = None
+    ingest_chunks(con, [df], table, chunk_size, primary_key, indexes)
+
+
+def ingest_chunks(  # pylint: disable=too-many-arguments
+    con: sqlite3.Connection,
+    chunks: Iterable[pd.DataFrame],
+    table: str = "database",
+    chunk_size: int = INGEST_CHUNK_SIZE,
+    primary_key: Optional[str] = None,
+    indexes: Optional[List[str]] = None,
+) -> int:
+    """Create the table and insert the chunks one by one in a single transaction.
+    The table is created based on the columns and dtypes of the first chunk,
+    so only one chunk needs to be in memory at a time.
+
+    Parameters
+    ----------
+    con : sqlite3.Connection
+        Database connection, should point to a new database
+    chunks : Iterable[pd.DataFrame]
+        The chunks to store, all with the same columns
+    table : str, optional
+        The name of the table, by default "database"
+    chunk_size : int, optional
+        The number of rows per `executemany` call, by default INGEST_CHUNK_SIZE
+    primary_key : Optional[str], optional
+        Column to declare as INTEGER PRIMARY KEY, by default None.
+        The caller is responsible for the values being unique integers.
+    indexes : Optional[List[str]], optional
+        Columns to create an index on, by default None
+
+    Returns
+    -------
+    int
+        The number of inserted rows
+    """
+    previous_pragmas = get_pragmas(con, INGEST_PRAGMAS)
+    set_pragmas(con, INGEST_PRAGMAS)
+    n_rows = 0
+    try:
+        con.execute("BEGIN")
+        try:
+            for idx, chunk in enumerate(chunks):
+                if idx == 0:
+                    create_table(con, chunk, table, primary_key=primary_key)
+                insert_rows(con, chunk, table, chunk_size)
+                n_rows += len(chunk)
+            create_indexes(con, indexes or [], table)
+        except Exception:
+            con.rollback()
+            raise
+        con.commit()
+    finally:
+        # the journal mode can only be changed outside of a transaction
+        set_pragmas(con, previous_pragmas)
+    return n_rows
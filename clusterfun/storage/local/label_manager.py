@@ -1,12 +1,24 @@
 """Label storer for CRUD label management"""
 
 import json
+import tempfile
+import threading
 from collections import Counter
 from pathlib import Path
 from typing import Any, Dict, List, Optional
 
 import pandas as pd
 
+# a lock per view, as labels are saved and deleted in several threads at once, see clusterfun/executors.py
+_LABEL_LOCKS: Dict[Path, threading.Lock] = {}
+_LABEL_LOCKS_LOCK = threading.Lock()
+
+
+def get_label_lock(cache_dir: Path) -> threading.Lock:
+    """Get the lock of the labels of a view, so concurrent changes to its labels do not undo each other."""
+    with _LABEL_LOCKS_LOCK:
+        return _LABEL_LOCKS.setdefault(cache_dir.resolve(), threading.Lock())
+
 
 class LabelManager:
     """CRUD for labels"""
@@ -27,28 +39,38 @@ class LabelManager:
             return json.loads(file_content.read())
 
     def _write_labels(self, labels: Dict[str, List[str]]):
-        """Writes the labels to the S3 bucket."""
-        with open(self.cache_dir / "labels.json", "w", encoding="utf-8") as file_content_writer:
+        """Writes the labels to the S3 bucket.
+        The labels are written to a new file that replaces the old one, so readers never see a partial file."""
+        with tempfile.NamedTemporaryFile(
+            "w", dir=self.cache_dir, prefix="labels.json", suffix=".tmp", delete=False, encoding="utf-8"
+        ) as file_content_writer:
+            tmp_file = Path(file_content_writer.name)
             file_content_writer.write(json.dumps(labels))
+        try:
+            tmp_file.replace(self.cache_dir / "labels.json")
+        finally:
+            tmp_file.unlink(missing_ok=True)
 
     def save_label(self, label: str, media_indices: List[int]):
         """Saves the label to the database."""
-        labels = self.read_labels()
-        for media_id in media_indices:
-            labels.setdefault(str(media_id), [])
-            if label not in labels[str(media_id)]:
-                labels[str(media_id)].append(label)
-        self._write_labels(labels)
+        with get_label_lock(self.cache_dir):
+            labels = self.read_labels()
+            for media_id in media_indices:
+                labels.setdefault(str(media_id), [])
+                if label not in labels[str(media_id)]:
+                    labels[str(media_id)].append(label)
+            self._write_labels(labels)
 
     def delete_label(self, label: str, media_indices: List[int]):
         """Deletes the label from the database."""
-        labels = self.read_labels()
-        for media_id in media_indices:
-            if str(media_id) in labels and label in labels[str(media_id)]:
-                labels[str(media_id)].remove(label)
-                if len(labels[str(media_id)]) == 0:
-                    del labels[str(media_id)]
-        self._write_labels(labels)
+        with get_label_lock(self.cache_dir):
+            labels = self.read_labels()
+            for media_id in media_indices:
+                if str(media_id) in labels and label in labels[str(media_id)]:
+                    labels[str(media_id)].remove(label)
+                    if len(labels[str(media_id)]) == 0:
+                        del labels[str(media_id)]
+            self._write_labels(labels)
 
     def get_dataframe(self, label: Optional[str] = None) -> pd.DataFrame:
         """Get the dataframe including the labels"""
@@ -1,23 +1,91 @@
 """LocalLoader class for loading data from the local filesystem."""
 
+import copy
+import dataclasses
 import json
-import os
 import sqlite3
+import threading
+import time
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple, Union
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple, Union, cast
 
+import numpy as np
 import orjson
 import pandas as pd
+import pyarrow as pa
 
 from clusterfun.config import Config
 from clusterfun.models.filter import Filter
 from clusterfun.models.media_indices import MediaIndices
 from clusterfun.models.media_item import MediaItem
+from clusterfun.models.selection import Region, SelectionRequest
+from clusterfun.models.viewport import Viewport
 from clusterfun.storage.loader import Loader
-from clusterfun.storage.local.data import get_data_dict
-from clusterfun.storage.local.helpers import get_filter_query, get_media_query, get_recent_dir, run_query
+from clusterfun.storage.local.binary import BINARY_FILE, BinaryDataWriter, is_current
+from clusterfun.storage.local.catalog import Catalog
+from clusterfun.storage.local.column_engine import ENGINES, ColumnEngine
+from clusterfun.storage.local.column_stats import (
+    STATS_FILE,
+    ColumnStats,
+    get_sqlite_column_stats,
+    get_sqlite_value_counts,
+    read_column_stats,
+    write_column_stats,
+)
+from clusterfun.storage.local.compression import DATA_START, read_chunks, stream_compressed
+from clusterfun.storage.local.connections import ConnectionPool, connect_read_only
+from clusterfun.storage.local.data import build_data_dict, get_data_dict
+from clusterfun.storage.local.density import (
+    DENSITY_FILE,
+    DensityPyramid,
+    PyramidNotFoundError,
+    get_sqlite_pyramid,
+    read_pyramid,
+    write_pyramid,
+)
+from clusterfun.storage.local.dictionaries import DICTIONARIES_FILE, read_dictionaries
+from clusterfun.storage.local.exports import (
+    EXPORT_BATCH_SIZE,
+    ExportFormat,
+    get_arrow_schema,
+    get_csv_schema,
+    get_label_schema,
+    get_nullable_integers,
+    iter_csv_batches,
+    iter_cursor_batches,
+    iter_labeled_batches,
+)
+from clusterfun.storage.local.filter_cache import FILTER_RESULTS
+from clusterfun.storage.local.helpers import (
+    get_cache_dir,
+    get_filter_query,
+    get_media_query,
+    get_recent_dir,
+    run_query,
+)
 from clusterfun.storage.local.label_manager import LabelManager
+from clusterfun.storage.local.masks import encode_mask
+from clusterfun.storage.local.pagination import encode_cursor, get_sort
+from clusterfun.storage.local.query import Query
+from clusterfun.storage.local.selections import SELECTIONS, Selection
+from clusterfun.storage.local.spatial import (
+    get_grid_candidates,
+    get_sqlite_candidates,
+    read_spatial_index,
+    select_region,
+)
+from clusterfun.storage.local.view_state import VIEW_STATES, FileVersion, ViewState, get_file_version, get_json_cost
 from clusterfun.storage.storer import load_media
+from clusterfun.validation import ColumnNotFoundException
+
+# number of bytes read at a time when streaming the view payload
+VIEW_CHUNK_SIZE = 1024 * 1024
+# seconds between recording the access of a view in the catalog
+ACCESS_RESOLUTION = 60.0
+# views whose last recorded access is remembered, older accesses are forgotten first
+MAX_RECORDED_ACCESSES = 1024
+_RECORDED_ACCESSES: Dict[Path, float] = {}
+_RECORDED_ACCESSES_LOCK = threading.Lock()
 
 
 class LocalLoader(Loader):
@@ -36,7 +104,7 @@ class LocalLoader(Loader):
         """
         super().__init__(uuid)
         if cache_dir is None:
-            cache_dir = Path(os.environ.get("CLUSTERFUN_CACHE_DIR", os.path.expanduser("~/.cache/clusterfun")))
+            cache_dir = get_cache_dir()
         if uuid == "recent":
             uuid = get_recent_dir(cache_dir).stem
         self.cache_dir = cache_dir / uuid
@@ -51,6 +119,7 @@ class LocalLoader(Loader):
         """Load the data and config for the given uuid."""
         if not self.cache_dir.exists():
             raise FileExistsError(f"Could not find a directory for {self.uuid=} as {self.cache_dir}")
+        record_access(self.cache_dir)
         return self.uuid, self.load_data(), self.load_config()
 
     def load_data(self) -> Dict[str, List[Union[int, float]]]:
@@ -66,23 +135,182 @@ class LocalLoader(Loader):
         with open(self.cache_dir / "data.json", "rb") as f:
             return orjson.loads(f.read())  # pylint: disable=no-member
 
-    def load_config(self) -> Config:
-        """Loads the config from the json file"""
+    @property
+    def _data_path(self) -> Path:
+        """Return the path to the file with the stored data."""
+        return self.db_path
+
+    @property
+    def state(self) -> ViewState:
+        """Return the cached state of the view, which is shared with other loaders and should not be modified."""
+        return VIEW_STATES.get(self)
+
+    @property
+    def _version_paths(self) -> List[Path]:
+        """Return the paths to the config, labels, column metadata, density pyramid and data files, whose versions
+        tell if the cached state is up to date. The labels come second, see `ViewState.data_version`."""
+        return [
+            self.cache_dir / "config.json",
+            self.cache_dir / "labels.json",
+            self.cache_dir / DICTIONARIES_FILE,
+            self.cache_dir / STATS_FILE,
+            self.cache_dir / DENSITY_FILE,
+            self._data_path,
+        ]
+
+    def get_version(self) -> Tuple[FileVersion, ...]:
+        """Return the versions of the files of the view, see `_version_paths`,
+        used to check if the cached state is up to date."""
+        return tuple(get_file_version(path) for path in self._version_paths)
+
+    def _update_version(self, version: Tuple[FileVersion, ...], path: Path) -> Tuple[FileVersion, ...]:
+        """Return the versions of the files of the view with the version of a file that was written while reading
+        the state, so writing it does not make the state out of date."""
+        index = self._version_paths.index(path)
+        return version[:index] + (get_file_version(path),) + version[index + 1 :]
+
+    def read_state(self, version: Tuple[FileVersion, ...]) -> ViewState:
+        """Read the state of the view from its files.
+
+        Parameters
+        ----------
+        version : Tuple[FileVersion, ...]
+            The versions of the files, as returned by `get_version` before reading them
+
+        Returns
+        -------
+        ViewState
+            The state of the view
+        """
         with open(self.cache_dir / "config.json", encoding="utf-8") as f:
             config = Config(**json.load(f))
-        # add labels to the config
         labels = self.label_manager.read_labels()
-        config.labels = list({label for label_list in labels.values() for label in label_list})
+        connections = self._open_connections()
+        column_stats = read_column_stats(self.cache_dir)
+        if column_stats is None:
+            # views stored before the statistics were saved with them, saved now so they are computed once
+            column_stats = self._compute_column_stats(connections)
+            write_column_stats(self.cache_dir, column_stats)
+            version = self._update_version(version, self.cache_dir / STATS_FILE)
+        if (self.cache_dir / DENSITY_FILE).exists():
+            density = read_pyramid(self.cache_dir)
+        else:
+            # views stored before the density pyramid was saved with them, saved now so it is built once
+            density = self._compute_density(connections, config)
+            write_pyramid(self.cache_dir, density)
+            version = self._update_version(version, self.cache_dir / DENSITY_FILE)
+        return ViewState(
+            version=version,
+            config=config,
+            labels=labels,
+            label_vocabulary=list(dict.fromkeys(label for label_list in labels.values() for label in label_list)),
+            schema=self._read_schema(connections),
+            cost=get_json_cost(list(version[:4])) + (0 if density is None else density.nbytes),
+            connections=connections,
+            dictionaries=read_dictionaries(self.cache_dir),
+            column_stats={stats.name: stats for stats in column_stats},
+            density=density,
+        )
+
+    def _compute_column_stats(self, connections: Optional[ConnectionPool]) -> List[ColumnStats]:
+        """Compute the statistics of the columns from the stored data."""
+        assert connections is not None  # MyPy
+        return get_sqlite_column_stats(connections.get())
+
+    def _compute_density(self, connections: Optional[ConnectionPool], config: Config) -> Optional[DensityPyramid]:
+        """Compute the density pyramid from the stored data, None if the plot gets no pyramid."""
+        assert connections is not None  # MyPy
+        return get_sqlite_pyramid(connections.get(), config)
+
+    def _open_connections(self) -> Optional[ConnectionPool]:
+        """Open the pool of read-only connections to the database of the view."""
+        return ConnectionPool(self.db_path)
+
+    def _read_schema(self, connections: Optional[ConnectionPool]) -> Dict[str, str]:
+        """Read the names and declared types of the columns of the database."""
+        assert connections is not None  # MyPy
+        return {row[1]: row[2] for row in run_query(connections.get(), "PRAGMA table_info(database)")}
+
+    @property
+    def _connections(self) -> ConnectionPool:
+        """Return the pool of read-only connections to the database of the view, see `_open_connections`."""
+        connections = self.state.connections
+        assert connections is not None  # MyPy
+        return connections
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """Return the read-only connection to the database of the current thread, from the pool of the view."""
+        try:
+            return self._connections.get()
+        except sqlite3.ProgrammingError:
+            # the pool was retired as the view changed after getting its state, the new state has a new pool
+            return self._connections.get()
+
+    def load_config(self) -> Config:
+        """Loads the config, with the labels of the view added to it"""
+        state = self.state
+        config = copy.deepcopy(state.config)
+        config.labels = list(state.label_vocabulary)
         return config
 
+    def fetch_row(self, media_id: int) -> Tuple[Any, ...]:
+        """Fetch the raw row for a given media id, with the values in the order of `config.columns`."""
+        return tuple(
+            run_query(self.connection, Query("SELECT * FROM database WHERE id = ?", (media_id,)), fetch_one=True)
+        )
+
+    def fetch_rows(
+        self, media_indices: MediaIndices, paginate: bool = True, lookahead: bool = False
+    ) -> List[Tuple[Any, ...]]:
+        """Fetch the raw rows for the given media indices, with the values in the order of `config.columns`.
+        With `lookahead`, a page includes the first row of the next page, if any."""
+        con = self.connection
+        return run_query(con, self._get_media_query(con, media_indices, paginate=paginate, lookahead=lookahead))
+
+    @property
+    def column_names(self) -> List[str]:
+        """Return the names of the columns of the stored data, in the order of the fetched rows."""
+        return list(self.state.schema)
+
+    def _get_media_query(
+        self, con: sqlite3.Connection, media_indices: MediaIndices, paginate: bool = True, lookahead: bool = False
+    ) -> Query:
+        """Get the query for the media, with the ids of a selection loaded into a temporary table of the connection."""
+        selection_table = None
+        if media_indices.selection is not None:
+            selection_table = SELECTIONS.attach(con, self.cache_dir, media_indices.selection)
+        return get_media_query(
+            media_indices,
+            paginate=paginate,
+            config=self.state.config,
+            con=con,
+            selection_table=selection_table,
+            lookahead=lookahead,
+            dictionaries=self.state.dictionaries,
+        )
+
+    def get_filtered_ids(self, filters: List[Filter]) -> np.ndarray:
+        """Get the ids of the rows matching the filters."""
+        engine = ENGINES.get(self)
+        if engine is not None and engine.can_evaluate(filters):
+            return engine.ids[engine.evaluate(filters)]
+        con = self.connection
+        query = Query("SELECT id FROM database")
+        condition = get_filter_query(con, self.state.config, filters, dictionaries=self.state.dictionaries)
+        if condition:
+            query += Query(" WHERE ") + condition
+        cursor = con.execute(query.sql, query.params)
+        return np.fromiter((row[0] for row in cursor), dtype=np.int64)
+
+    def get_region_candidates(self, region: Region, x: str, y: str) -> np.ndarray:
+        """Get the points in the bounding box of a region from the stored data, for views without a spatial index.
+        The points are taken from the x and y columns of the plot."""
+        return get_sqlite_candidates(self.connection, x, y, region)
+
     def get_row(self, media_id: int, as_base64: bool = False) -> MediaItem:
         """Get a single row of data for a given uuid and media id."""
-        result = run_query(self.db_path, f"SELECT * FROM database WHERE id = {media_id}", fetch_one=True)
-        # index zero should be the id, index 1 the media src, everything else the remaining data
-        src, height, width = load_media(
-            result[1], as_base64=as_base64, common_media_path=self.load_config().common_media_path
-        )
-        return MediaItem(index=media_id, src=src, height=height, width=width, information=list(result[2:]))
+        return to_media_item(self.fetch_row(media_id), self.state, as_base64=as_base64)
 
     def get_rows(self, media_indices: MediaIndices) -> List[MediaItem]:
         """
@@ -98,24 +326,8 @@ class LocalLoader(Loader):
         List[MediaItem]
             List of queried items
         """
-        con, config = None, self.load_config()
-        if media_indices.filters:
-            con = sqlite3.connect(self.db_path, check_same_thread=False)
-        query = get_media_query(media_indices, config=config, con=con)
-        result = run_query(self.db_path, query)
-        items = []
-        labels = self.label_manager.read_labels()
-        for item in result:
-            src, height, width = load_media(item[1], common_media_path=config.common_media_path)
-            labels_item = None
-            if str(item[0]) in labels:
-                labels_item = labels[str(item[0])]
-            item = MediaItem(
-                index=item[0], src=src, height=height, width=width, information=list(item[2:]), labels=labels_item
-            )
-            items.append(item)
-
-        return items
+        state = self.state
+        return [to_media_item(row, state) for row in self.fetch_rows(media_indices)]
 
     def get_rows_metadata(self, media_indices: MediaIndices) -> List[Dict[str, Any]]:
         """
@@ -131,8 +343,7 @@ class LocalLoader(Loader):
         List[Dict[str, Any]]
             The metadata for the media items
         """
-        query = get_media_query(media_indices, paginate=False)
-        result = run_query(self.db_path, query)
+        result = self.fetch_rows(media_indices, paginate=False)
         items = []
         for item in result:
             items.append({"index": item[0], "information": item[2:]})
@@ -140,22 +351,443 @@ class LocalLoader(Loader):
 
     def filter(self, filters: List[Filter]) -> List[Dict[str, Any]]:
         """Filters the data based on the given filters."""
-        con = sqlite3.connect(self.db_path, check_same_thread=False)
-        config = self.load_config()
-        query = get_filter_query(con, config, filters)
+        engine = ENGINES.get(self)
+        if engine is not None and engine.can_evaluate(filters):
+            return filter_in_memory(engine, self.state.config, filters)
+        con, config = self.connection, self.state.config
+        query = get_filter_query(con, config, filters, dictionaries=self.state.dictionaries)
         # Get filtered data from database
         data = get_data_dict(con, config, query_addition=query)
-        con.close()
         return data[0]
 
+    def get_value_counts(self, column: str, media_indices: Optional[MediaIndices] = None) -> List[Tuple[Any, int]]:
+        """
+        Count the values of a column, most common first.
+        The counts of all rows are taken from the column statistics if they are complete.
+
+        Parameters
+        ----------
+        column : str
+            The column to count the values of
+        media_indices : Optional[MediaIndices], optional
+            The media to count the values of, by default None which counts the values of all rows
+
+        Returns
+        -------
+        List[Tuple[Any, int]]
+            The values with their counts, ties ordered by value, with missing values as None
+        """
+        column_stats = get_column_stats(self.state, column)
+        if media_indices is None and column_stats.is_complete:
+            return column_stats.top_values
+        engine = ENGINES.get(self)
+        if (
+            engine is not None
+            and media_indices is not None
+            and column in engine.columns
+            and engine.can_evaluate(media_indices.filters or [])
+        ):
+            mask = engine.evaluate(
+                media_indices.filters or [], engine.id_mask(get_media_ids(self.cache_dir, media_indices))
+            )
+            return engine.value_counts(column, mask)
+        con = self.connection
+        query = None if media_indices is None else self._get_media_query(con, media_indices, paginate=False)
+        return get_sqlite_value_counts(con, column, query=query)
+
     def get_dataframe(self, media_indices: Optional[MediaIndices] = None) -> pd.DataFrame:
         """Get the data as a pandas dataframe."""
-        con = sqlite3.connect(self.db_path)
+        con = self.connection
         if media_indices is not None:
-            config = self.load_config()
-            query = get_media_query(media_indices, config=config, con=con, paginate=False)
+            query = self._get_media_query(con, media_indices, paginate=False)
         else:
-            query = "SELECT * FROM database"
-        df = pd.read_sql_query(query, con)
-        con.close()
-        return df
+            query = Query("SELECT * FROM database")
+        return pd.read_sql_query(query.sql, con, params=query.params)
+
+    def get_export_batches(
+        self,
+        media_indices: MediaIndices,
+        batch_size: int = EXPORT_BATCH_SIZE,
+        export_format: Optional[ExportFormat] = None,
+    ) -> Tuple[pa.Schema, Iterator[pa.RecordBatch]]:
+        """
+        Read the rows of the media indices in record batches, to stream them as an export.
+        The rows are read from a cursor on a connection of its own, as the batches are read from the threads
+        of the database executor one at a time, while the connections of the pool belong to a single thread.
+
+        Parameters
+        ----------
+        media_indices : MediaIndices
+            The media to export, in their sort order if any
+        batch_size : int, optional
+            The number of rows per batch, by default EXPORT_BATCH_SIZE
+        export_format : Optional[ExportFormat], optional
+            The format the rows are exported in, by default None. For CSV, integer columns with missing values
+            are exported as floats like pandas reads them, which takes a pass over the rows first
+
+        Returns
+        -------
+        Tuple[pa.Schema, Iterator[pa.RecordBatch]]
+            The schema of the rows and the batches of rows
+        """
+        con = connect_read_only(self._connections.uri)
+        try:
+            query = self._get_media_query(con, media_indices, paginate=False)
+            schema = get_arrow_schema(self.state.schema)
+            nullable_integers = get_nullable_integers(con, query, schema) if export_format == "csv" else []
+            # run the query before the export is started, so an invalid query raises before the response is sent
+            cursor = con.execute(query.sql, query.params)
+        except Exception:
+            con.close()
+            raise
+        batches = iter_cursor_batches(con, cursor, schema, batch_size)
+        if len(nullable_integers) == 0:
+            return schema, batches
+        csv_schema = get_csv_schema(schema, {}, nullable_integers)
+        return csv_schema, iter_csv_batches(batches, {}, csv_schema)
+
+
+def record_access(cache_dir: Path):
+    """Records in the catalog that a view was opened, used to remove the least recently used views.
+    The access is recorded at most once per ACCESS_RESOLUTION seconds per view."""
+    now = time.time()
+    with _RECORDED_ACCESSES_LOCK:
+        if now - _RECORDED_ACCESSES.get(cache_dir, 0.0) < ACCESS_RESOLUTION:
+            return
+        if len(_RECORDED_ACCESSES) >= MAX_RECORDED_ACCESSES:
+            forget_recorded_accesses(now)
+        _RECORDED_ACCESSES[cache_dir] = now
+    try:
+        Catalog(cache_dir.parent).record_access(cache_dir.name, now)
+    except sqlite3.Error:
+        # e.g. a read-only cache directory, opening the view should not fail on this
+        pass
+
+
+def forget_recorded_accesses(now: float):
+    """Forget the recorded accesses that no longer hold up recording, or all of them if that is not enough.
+    Forgetting an access at most records the next access of the view earlier than needed."""
+    for cache_dir, accessed in list(_RECORDED_ACCESSES.items()):
+        if now - accessed >= ACCESS_RESOLUTION:
+            del _RECORDED_ACCESSES[cache_dir]
+    if len(_RECORDED_ACCESSES) >= MAX_RECORDED_ACCESSES:
+        _RECORDED_ACCESSES.clear()
+
+
+def to_media_item(row: Tuple[Any, ...], state: ViewState, as_base64: bool = False) -> MediaItem:
+    """
+    Creates the media item for a row as returned by `LocalLoader.fetch_row` or `LocalLoader.fetch_rows`,
+    loading its media. Loading the media can be slow, e.g. when it is downloaded from S3, so this is kept apart
+    from the query, and the state of the view is read with the query, so loading the media does not touch the database.
+
+    Parameters
+    ----------
+    row : Tuple[Any, ...]
+        The row, with the id at index zero, the media src at index one and the remaining data after it
+    state : ViewState
+        The state of the view, for its common media path and its labels
+    as_base64 : bool, optional
+        Whether to load the media as a base64 string, by default False
+
+    Returns
+    -------
+    MediaItem
+        The media item
+    """
+    src, height, width = load_media(row[1], as_base64=as_base64, common_media_path=state.config.common_media_path)
+    return MediaItem(
+        index=row[0],
+        src=src,
+        height=height,
+        width=width,
+        information=list(row[2:]),
+        labels=state.labels.get(str(row[0])),
+    )
+
+
+def filter_in_memory(engine: ColumnEngine, config: Config, filters: List[Filter]) -> List[Dict[str, Any]]:
+    """Filters the data with the columns loaded into memory, with the same result as `get_data_dict`."""
+    columns = engine.get_plot_columns(config, engine.evaluate(filters))
+    color_values = None
+    if config.color is not None and config.color_is_categorical:
+        # the colors of the full dataset, so the traces keep their colors when filtering
+        color_values = config.colors
+        if color_values is None:
+            color_values = pd.unique(engine.columns[config.color].to_objects(slice(None))).tolist()
+    data, _ = build_data_dict(config, **columns, color_values=color_values)
+    return data
+
+
+def get_media_ids(cache_dir: Path, media_indices: MediaIndices) -> List[int]:
+    """Get the media ids of the media indices of a view, the ids of its selection if it refers to one."""
+    if media_indices.selection is not None:
+        return SELECTIONS.get(cache_dir, media_indices.selection).ids.tolist()
+    return media_indices.media_ids
+
+
+def get_column_stats(state: ViewState, column: str) -> ColumnStats:
+    """Get the statistics of a column of a view, as computed when the view was stored.
+
+    Raises
+    ------
+    ColumnNotFoundException
+        If the column is not a column of the view
+    """
+    try:
+        return state.column_stats[column]
+    except KeyError as e:
+        raise ColumnNotFoundException(f"{column} not in columns of view") from e
+
+
+def fetch_page(loader: LocalLoader, media_indices: MediaIndices) -> Tuple[List[Tuple[Any, ...]], Optional[str]]:
+    """
+    Fetch the raw rows of a page, with the cursor to fetch the next page with.
+
+    Parameters
+    ----------
+    loader : LocalLoader
+        The loader of the view
+    media_indices : MediaIndices
+        The media indices, with the page number or the cursor of the page
+
+    Returns
+    -------
+    Tuple[List[Tuple[Any, ...]], Optional[str]]
+        The rows of the page, and the cursor of the next page or None if this is the last page
+    """
+    rows = loader.fetch_rows(media_indices, lookahead=True)
+    if len(rows) <= media_indices.page_size:
+        return rows, None
+    rows = rows[: media_indices.page_size]
+    sort = get_sort(media_indices)
+    value = rows[-1][loader.column_names.index(sort[0])] if sort is not None else None
+    return rows, encode_cursor(value, rows[-1][0])
+
+
+def select(loader: LocalLoader, request: SelectionRequest) -> Selection:
+    """
+    Registers a selection of media of a view, so later requests can refer to it by its token.
+
+    Parameters
+    ----------
+    loader : LocalLoader
+        The loader of the view
+    request : SelectionRequest
+        The media ids, filters and/or region of the selection
+
+    Returns
+    -------
+    Selection
+        The registered selection
+    """
+    candidates = []
+    if request.media_ids is not None:
+        candidates.append(np.asarray(request.media_ids, dtype=np.int64))
+    if request.region is not None:
+        candidates.append(get_region_ids(loader, request.region))
+    if request.filters is not None or len(candidates) == 0:
+        candidates.append(loader.get_filtered_ids(request.filters or []))
+    media_ids = candidates[0]
+    for other_ids in candidates[1:]:
+        media_ids = np.intersect1d(media_ids, other_ids)
+    return SELECTIONS.register(loader.cache_dir, media_ids)
+
+
+def get_region_ids(loader: LocalLoader, region: Region) -> np.ndarray:
+    """
+    Get the ids of the points of a scatter plot inside a region, see clusterfun/storage/local/spatial.py.
+
+    Parameters
+    ----------
+    loader : LocalLoader
+        The loader of the view
+    region : Region
+        The box and/or lasso polygon to select the points in
+
+    Returns
+    -------
+    np.ndarray
+        The ids of the points inside the region, sorted
+
+    Raises
+    ------
+    ColumnNotFoundException
+        If the plot has no x and y columns
+    """
+    state = loader.state
+    if state.config.x is None or state.config.y is None:
+        raise ColumnNotFoundException("The plot has no x and y columns to select a region of")
+    density = state.density
+    index = read_spatial_index(loader.cache_dir) if density is not None else None
+    # an index that does not belong to the pyramid of the state, e.g. while rows are appended, is not used
+    if density is not None and index is not None and len(index) == density.levels[-1].counts.sum():
+        return select_region(get_grid_candidates(index, density, region), region)
+    return select_region(loader.get_region_candidates(region, state.config.x, state.config.y), region)
+
+
+def filter_json(loader: LocalLoader, filters: List[Filter]) -> bytes:
+    """Filters the data of a view based on the given filters, serialized as JSON.
+    The results are cached per view and normalized filters, see clusterfun/storage/local/filter_cache.py."""
+    return FILTER_RESULTS.get_or_compute(
+        loader.cache_dir,
+        filters,
+        loader.state.data_version,
+        lambda: orjson.dumps(loader.filter(filters), option=orjson.OPT_SERIALIZE_NUMPY),  # pylint: disable=no-member
+    )
+
+
+def filter_mask(loader: LocalLoader, filters: List[Filter]) -> bytes:
+    """Get the ids of the rows of a view matching the filters, encoded as a mask over the ids of the view.
+    See clusterfun/storage/local/masks.py. The results are cached like those of `filter_json`."""
+    state = loader.state
+    max_id = state.column_stats["id"].max
+    return FILTER_RESULTS.get_or_compute(
+        loader.cache_dir,
+        filters,
+        state.data_version,
+        lambda: encode_mask(loader.get_filtered_ids(filters), 0 if max_id is None else max_id + 1),
+        kind="mask",
+    )
+
+
+def get_viewport(loader: LocalLoader, viewport: Viewport) -> Dict[str, Any]:
+    """
+    Get the part of a scatter plot inside a viewport, see clusterfun/storage/local/density.py.
+    The points are returned as filtered plot data if at most `viewport.max_points` of them can be inside
+    the viewport, otherwise the density bins of the level of the pyramid that matches the pixel size.
+
+    Parameters
+    ----------
+    loader : LocalLoader
+        The loader of the view
+    viewport : Viewport
+        The ranges of the axes and the size of the plot in pixels
+
+    Returns
+    -------
+    Dict[str, Any]
+        With mode "points", the plot data of the points in "data",
+        with mode "bins", the centers, counts and representative ids of the bins, see `DensityPyramid.get_bins`
+
+    Raises
+    ------
+    PyramidNotFoundError
+        If the view has no density pyramid
+    """
+    state = loader.state
+    config, density = state.config, state.density
+    if density is None or config.x is None or config.y is None:
+        raise PyramidNotFoundError(f"View {loader.uuid} has no density pyramid")
+    x_range = (min(viewport.x_range), max(viewport.x_range))
+    y_range = (min(viewport.y_range), max(viewport.y_range))
+    if density.count_points(x_range, y_range) <= viewport.max_points:
+        filters = [
+            Filter(column=column, comparison=comparison, values=[value])
+            for column, (start, end) in [(config.x, x_range), (config.y, y_range)]
+            for comparison, value in [(">=", start), ("<=", end)]
+        ]
+        return {"mode": "points", "data": loader.filter(filters)}
+    level = density.select_level(x_range, y_range, viewport.width, viewport.height)
+    return {"mode": "bins", **density.get_bins(level, x_range, y_range)}
+
+
+def get_label_export_batches(
+    loader: LocalLoader, label: Optional[str], media_indices: MediaIndices, export_format: Optional[ExportFormat] = None
+) -> Tuple[pa.Schema, Iterator[pa.RecordBatch]]:
+    """
+    Read the labeled media of a view in record batches, with a column per label, to stream them as an export.
+
+    Parameters
+    ----------
+    loader : LocalLoader
+        The loader of the view
+    label : Optional[str]
+        Only export the media with this label, by default all labeled media
+    media_indices : MediaIndices
+        Only export the labeled media of these media indices, unless they are empty
+    export_format : Optional[ExportFormat], optional
+        The format the labeled media are exported in, see `LocalLoader.get_export_batches`, by default None
+
+    Returns
+    -------
+    Tuple[pa.Schema, Iterator[pa.RecordBatch]]
+        The schema of the labeled media and the batches of labeled media
+    """
+    labels = loader.state.labels
+    media_ids = [int(media_id) for media_id, item_labels in labels.items() if label is None or label in item_labels]
+    if not media_indices.is_empty:
+        selected = set(get_media_ids(loader.cache_dir, media_indices))
+        media_ids = [media_id for media_id in media_ids if media_id in selected]
+    schema, batches = loader.get_export_batches(MediaIndices(media_ids=media_ids), export_format=export_format)
+    label_names = sorted({item_label for item_labels in labels.values() for item_label in item_labels})
+    label_schema = get_label_schema(schema, label_names)
+    return label_schema, iter_labeled_batches(batches, labels, label_names, label_schema)
+
+
+def stream_view(
+    loader: LocalLoader, encoding: Optional[str] = None, chunk_size: int = VIEW_CHUNK_SIZE
+) -> Iterator[bytes]:
+    """
+    Streams the view payload, the data, uuid and config of the plot as a JSON object.
+    The stored data.json is passed on as raw bytes, so the data is never parsed or serialized again.
+
+    Parameters
+    ----------
+    loader : LocalLoader
+        The loader of the view
+    encoding : Optional[str], optional
+        The encoding of the payload as returned by `get_encoding`, by default None.
+        The precompressed data stored for this encoding is used.
+    chunk_size : int, optional
+        The number of bytes of the stored data to read at a time, by default VIEW_CHUNK_SIZE
+
+    Returns
+    -------
+    Iterator[bytes]
+        The chunks of the (compressed) JSON payload
+    """
+    if not loader.cache_dir.exists():
+        raise FileExistsError(f"Could not find a directory for {loader.uuid=} as {loader.cache_dir}")
+    record_access(loader.cache_dir)
+    uuid = orjson.dumps(loader.uuid)  # pylint: disable=no-member
+    config = orjson.dumps(dataclasses.asdict(loader.load_config()))  # pylint: disable=no-member
+    end = b',"uuid":' + uuid + b',"config":' + config + b"}"
+    if encoding is not None:
+        return stream_compressed(loader.cache_dir, encoding, end, chunk_size)
+    # open the file before yielding, so a missing file raises before the response is started
+    f = open(loader.cache_dir / "data.json", "rb")  # pylint: disable=consider-using-with
+    return _stream_view(f, end, chunk_size)
+
+
+def get_binary_data_path(loader: LocalLoader) -> Path:
+    """
+    Returns the path to the binary plot data of a view, the typed array version of data.json.
+    Plots stored before the binary format existed, or with an older version of it, get the file written
+    on first request.
+
+    Parameters
+    ----------
+    loader : LocalLoader
+        The loader of the view
+
+    Returns
+    -------
+    Path
+        The path to the binary plot data
+    """
+    record_access(loader.cache_dir)
+    path = loader.cache_dir / BINARY_FILE
+    if not is_current(path):
+        with BinaryDataWriter(path) as writer:
+            # data.json holds the list of traces
+            for trace in cast(List[Dict[str, Any]], loader.load_data()):
+                writer.write(trace)
+    return path
+
+
+def _stream_view(f: BinaryIO, end: bytes, chunk_size: int) -> Iterator[bytes]:
+    """Yields the view payload around the raw data bytes and closes the data file."""
+    with f:
+        yield DATA_START
+        yield from read_chunks(f, chunk_size)
+    yield end
@@ -0,0 +1,147 @@
+"""
+lru.py
+======
+
+This module provides a thread-safe least recently used cache with a budget, used to keep state
+of the views in memory between requests.
+
+Classes
+-------
+LRUCache
+    A thread-safe least recently used cache, evicting entries when their total cost exceeds a budget.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Generic, Hashable, Optional, Tuple, TypeVar
+
+V = TypeVar("V")
+
+
+class LRUCache(Generic[V]):
+    """A thread-safe least recently used cache, evicting entries when their total cost exceeds a budget.
+    The cost of an entry is e.g. its approximate size in bytes."""
+
+    def __init__(self, max_cost: int, on_evict: Optional[Callable[[Hashable, V], None]] = None):
+        """Initialise the cache.
+
+        Parameters
+        ----------
+        max_cost : int
+            The maximum total cost of the entries. An entry that costs more than this is not cached.
+        on_evict : Optional[Callable[[Hashable, V], None]], optional
+            Called with the key and value of an entry that is evicted or replaced, e.g. to close it, by default None
+        """
+        self.max_cost = max_cost
+        self.on_evict = on_evict
+        self._entries: "OrderedDict[Hashable, Tuple[V, int]]" = OrderedDict()
+        self._cost = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Whether a key is cached, without counting as a use of the entry."""
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key: Hashable, validate: Optional[Callable[[V], bool]] = None) -> Optional[V]:
+        """Get the value for a key, or None if it is not cached. Counts as a use of the entry.
+
+        Parameters
+        ----------
+        key : Hashable
+            The key of the entry
+        validate : Optional[Callable[[V], bool]], optional
+            Checks if the cached value is still up to date, by default None.
+            A value that is out of date is evicted and counts as a miss.
+
+        Returns
+        -------
+        Optional[V]
+            The cached value, or None if it is not cached or out of date
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if validate is None or validate(entry[0]):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            del self._entries[key]
+            self._cost -= entry[1]
+            self.misses += 1
+        self._evict(key, entry[0])
+        return None
+
+    def put(self, key: Hashable, value: V, cost: int = 1):
+        """Cache a value, evicting the least recently used entries if the budget is exceeded."""
+        evicted = []
+        with self._lock:
+            if key in self._entries:
+                old_value, old_cost = self._entries.pop(key)
+                self._cost -= old_cost
+                if old_value is not value:
+                    evicted.append((key, old_value))
+            if cost <= self.max_cost:
+                self._entries[key] = (value, cost)
+                self._cost += cost
+            else:
+                evicted.append((key, value))
+            while self._cost > self.max_cost:
+                evicted_key, (evicted_value, evicted_cost) = self._entries.popitem(last=False)
+                self._cost -= evicted_cost
+                self.evictions += 1
+                evicted.append((evicted_key, evicted_value))
+        # called outside the lock, as closing a value can take a while
+        for evicted_key, evicted_value in evicted:
+            self._evict(evicted_key, evicted_value)
+
+    def pop(self, key: Hashable) -> Optional[V]:
+        """Remove an entry from the cache without calling `on_evict`, returning its value if it was cached."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            self._cost -= entry[1]
+            return entry[0]
+
+    def invalidate(self, key: Hashable):
+        """Remove an entry from the cache, calling `on_evict` for it."""
+        value = self.pop(key)
+        if value is not None:
+            self._evict(key, value)
+
+    def clear(self):
+        """Remove all entries from the cache, calling `on_evict` for each of them."""
+        with self._lock:
+            entries = list(self._entries.items())
+            self._entries.clear()
+            self._cost = 0
+        for key, (value, _) in entries:
+            self._evict(key, value)
+
+    def stats(self) -> Dict[str, Any]:
+        """Get the number of entries, their cost and the hit, miss and eviction counters of the cache."""
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "cost": self._cost,
+                "max_cost": self.max_cost,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / requests if requests > 0 else 0.0,
+            }
+
+    def _evict(self, key: Hashable, value: V):
+        """Call `on_evict` for an entry that is no longer cached."""
+        if self.on_evict is not None:
+            self.on_evict(key, value)
@@ -0,0 +1,105 @@
+"""
+masks.py
+========
+
+This module provides the binary format of id masks: the ids of the points of a view that match a set of filters.
+The browser already has the traces of the view, so a filter result can be sent as the matching ids only and applied
+to those traces, instead of sending the traces of the matching points again.
+
+The ids are encoded as a bitset over the id space of the view or as sorted ranges of consecutive ids,
+whichever is smaller. Scattered matches are small as a bitset (one bit per point of the view), while matches
+on a sorted or appended column are small as ranges.
+
+Layout of a mask, little-endian:
+- 4 bytes magic: b"CFMK"
+- uint32 version
+- uint32 encoding: 0 for a bitset, 1 for ranges
+- uint32 size of the id space: ids are in [0, size)
+- uint32 number of matching ids
+- the payload:
+  - bitset: ceil(size / 8) bytes, bit i (least significant bit first) is set if id i matches
+  - ranges: pairs of uint32 start (inclusive) and end (exclusive) ids
+
+Functions
+---------
+encode_mask(ids: np.ndarray, id_space: int) -> bytes
+    Encode the matching ids as a mask.
+decode_mask(content: bytes) -> np.ndarray
+    Decode a mask back to the matching ids.
+get_ranges(ids: np.ndarray) -> np.ndarray
+    Get the ranges of consecutive ids.
+"""
+
+import struct
+
+import numpy as np
+
+MAGIC = b"CFMK"
+VERSION = 1
+BITSET = 0
+RANGES = 1
+HEADER = struct.Struct("<IIII")
+
+
+def get_ranges(ids: np.ndarray) -> np.ndarray:
+    """Get the ranges of consecutive ids of sorted unique ids, as rows of start (inclusive) and end (exclusive)."""
+    if len(ids) == 0:
+        return np.empty((0, 2), dtype=np.int64)
+    breaks = np.flatnonzero(np.diff(ids) != 1)
+    starts = ids[np.concatenate([[0], breaks + 1])]
+    ends = ids[np.concatenate([breaks, [len(ids) - 1]])] + 1
+    return np.stack([starts, ends], axis=1)
+
+
+def encode_mask(ids: np.ndarray, id_space: int) -> bytes:
+    """
+    Encode the matching ids of a view as a mask, as a bitset or as ranges, whichever is smaller.
+
+    Parameters
+    ----------
+    ids : np.ndarray
+        The matching ids, in any order
+    id_space : int
+        The size of the id space of the view, one more than its largest id
+
+    Returns
+    -------
+    bytes
+        The encoded mask
+
+    Raises
+    ------
+    ValueError
+        If an id is outside of the id space
+    """
+    ids = np.unique(np.asarray(ids, dtype=np.int64))
+    if len(ids) > 0 and (ids[0] < 0 or ids[-1] >= id_space):
+        raise ValueError(f"Ids should be in [0, {id_space})")
+    ranges = get_ranges(ids)
+    if ranges.nbytes // 2 < (id_space + 7) // 8:
+        encoding, payload = RANGES, ranges.astype("<u4").tobytes()
+    else:
+        bits = np.zeros(id_space, dtype=bool)
+        bits[ids] = True
+        encoding, payload = BITSET, np.packbits(bits, bitorder="little").tobytes()
+    return MAGIC + HEADER.pack(VERSION, encoding, id_space, len(ids)) + payload
+
+
+def decode_mask(content: bytes) -> np.ndarray:
+    """Decode a mask back to the sorted matching ids.
+
+    Raises
+    ------
+    ValueError
+        If the content is not a mask
+    """
+    if content[:4] != MAGIC:
+        raise ValueError("Content is not a clusterfun id mask")
+    _, encoding, id_space, _ = HEADER.unpack_from(content, 4)
+    payload = np.frombuffer(content, dtype=np.uint8, offset=4 + HEADER.size)
+    if encoding == BITSET:
+        return np.flatnonzero(np.unpackbits(payload, count=id_space, bitorder="little")).astype(np.int64)
+    ranges = payload.view("<u4").reshape(-1, 2).astype(np.int64)
+    if len(ranges) == 0:
+        return np.empty(0, dtype=np.int64)
+    return np.concatenate([np.arange(start, end) for start, end in ranges])
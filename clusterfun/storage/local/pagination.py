@@ -0,0 +1,170 @@
+"""
+pagination.py
+=============
+
+This module provides the keyset pagination of the grid. A page of media is selected by a cursor, the sort value
+and id of the last item of the previous page, instead of by an offset. The database then seeks to the cursor
+instead of skipping all items before the page, so deep pages in sorted grids are as fast as the first page.
+
+The items are ordered by the sort column with the id as tie-breaker, in the same direction, so the order is total.
+As in SQLite, missing (NULL) sort values come first in ascending order and last in descending order.
+
+The cursor is JSON, encoded as URL-safe base64. Sort values that are not JSON types, e.g. the timestamps and dates
+of Parquet columns, are stored as ISO strings along with their type.
+
+Exceptions
+----------
+InvalidCursorError
+    Raised for a cursor that is not a cursor returned with a page.
+
+Functions
+---------
+get_sort(media_indices: MediaIndices) -> Optional[Tuple[str, bool]]
+    Get the sort column and direction of the media indices, if any.
+is_paged(media_indices: MediaIndices) -> bool
+    Check if a page of the media is requested.
+get_cursor_type(value: Any) -> Optional[str]
+    Get the type of a sort value that is not a JSON type.
+encode_cursor(value: Any, media_id: int) -> str
+    Encode the sort value and id of the last item of a page as a cursor.
+is_sort_value(value: Any) -> bool
+    Check if a value decoded from a cursor can be a sort value.
+decode_cursor(cursor: str) -> Tuple[Any, int]
+    Decode a cursor into the sort value and id of the last item of a page.
+get_order_query(sort: Optional[Tuple[str, bool]]) -> str
+    Get the ORDER BY clause for the order of the pages.
+get_cursor_query(cursor: str, sort: Optional[Tuple[str, bool]]) -> Query
+    Get the condition that selects the items after a cursor.
+"""
+
+import base64
+import binascii
+import datetime
+import json
+import math
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import pandas as pd
+
+from clusterfun.models.media_indices import MediaIndices
+from clusterfun.storage.local.ingest import quote_identifier
+from clusterfun.storage.local.query import Query
+
+# per type of sort value that is not a JSON type, the function to parse its ISO string
+CURSOR_TYPES: Dict[str, Callable[[str], Any]] = {
+    # pandas keeps the nanoseconds of Arrow timestamps
+    "datetime": pd.Timestamp,
+    "date": datetime.date.fromisoformat,
+    "time": datetime.time.fromisoformat,
+}
+
+
+class InvalidCursorError(ValueError):
+    """Raised for a cursor that is not a cursor returned with a page, e.g. one that was changed by the client."""
+
+
+def get_sort(media_indices: MediaIndices) -> Optional[Tuple[str, bool]]:
+    """Get the sort column and whether to sort ascending, or None if the media indices are not sorted."""
+    if media_indices.sort_column is None or media_indices.sort_column == "" or media_indices.ascending is None:
+        return None
+    return media_indices.sort_column, media_indices.ascending
+
+
+def is_paged(media_indices: MediaIndices) -> bool:
+    """Check if a page of the media is requested: by a cursor or a page number, or implicitly by a selection
+    or by more media than fit on a page. Both storage backends paginate by this rule, so they return the same rows."""
+    return (
+        media_indices.cursor is not None
+        or media_indices.page > 0
+        or media_indices.selection is not None
+        or len(media_indices) > media_indices.page_size
+    )
+
+
+def get_cursor_type(value: Any) -> Optional[str]:
+    """Get the type of a sort value that is not a JSON type, see `CURSOR_TYPES`, or None for JSON types."""
+    # a datetime is also a date
+    for name, value_type in [("datetime", datetime.datetime), ("date", datetime.date), ("time", datetime.time)]:
+        if isinstance(value, value_type):
+            return name
+    return None
+
+
+def encode_cursor(value: Any, media_id: int) -> str:
+    """Encode the sort value and id of the last item of a page as a URL-safe cursor.
+    Timestamps, dates and times are encoded as ISO strings with their type."""
+    value_type = get_cursor_type(value)
+    item = [value, media_id] if value_type is None else [value.isoformat(), media_id, value_type]
+    return base64.urlsafe_b64encode(json.dumps(item).encode()).decode()
+
+
+def is_sort_value(value: Any) -> bool:
+    """Check if a value decoded from a cursor can be a sort value: a number other than NaN, a string or None."""
+    if isinstance(value, float):
+        return not math.isnan(value)
+    return value is None or isinstance(value, str) or (isinstance(value, int) and not isinstance(value, bool))
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, int]:
+    """Decode a cursor into the sort value and id of the last item of a page.
+
+    Raises
+    ------
+    InvalidCursorError
+        If the cursor is not a valid cursor
+    """
+    try:
+        value, media_id, *value_type = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError) as e:
+        raise InvalidCursorError(f"Invalid cursor {cursor}") from e
+    if not isinstance(media_id, int) or isinstance(media_id, bool) or not is_sort_value(value) or len(value_type) > 1:
+        raise InvalidCursorError(f"Invalid cursor {cursor}")
+    if len(value_type) == 1:
+        if not isinstance(value, str) or value_type[0] not in CURSOR_TYPES:
+            raise InvalidCursorError(f"Invalid cursor {cursor}")
+        try:
+            value = CURSOR_TYPES[value_type[0]](value)
+        except ValueError as e:
+            raise InvalidCursorError(f"Invalid cursor {cursor}") from e
+        if value is pd.NaT:
+            raise InvalidCursorError(f"Invalid cursor {cursor}")
+    return value, media_id
+
+
+def get_order_query(sort: Optional[Tuple[str, bool]]) -> str:
+    """Get the ORDER BY clause for the order of the pages: by the sort column and id, or by id if not sorted."""
+    if sort is None:
+        return " ORDER BY id"
+    direction = "ASC" if sort[1] else "DESC"
+    return f" ORDER BY {quote_identifier(sort[0])} {direction}, id {direction}"
+
+
+def get_cursor_query(cursor: str, sort: Optional[Tuple[str, bool]]) -> Query:
+    """
+    Get the condition that selects the items after a cursor, in the order of `get_order_query`.
+
+    Parameters
+    ----------
+    cursor : str
+        The cursor of the last item of the previous page
+    sort : Optional[Tuple[str, bool]]
+        The sort column and whether to sort ascending, as returned by `get_sort`
+
+    Returns
+    -------
+    Query
+        The condition, to add to the WHERE clause of the query
+    """
+    value, media_id = decode_cursor(cursor)
+    if sort is None:
+        return Query("id > ?", (media_id,))
+    column, ascending = quote_identifier(sort[0]), sort[1]
+    if ascending:
+        # NULL values come first
+        if value is None:
+            return Query(f"(({column} IS NULL AND id > ?) OR {column} IS NOT NULL)", (media_id,))
+        return Query(f"({column} > ? OR ({column} = ? AND id > ?))", (value, value, media_id))
+    # NULL values come last
+    if value is None:
+        return Query(f"({column} IS NULL AND id < ?)", (media_id,))
+    return Query(f"({column} < ? OR ({column} = ? AND id < ?) OR {column} IS NULL)", (value, value, media_id))
@@ -0,0 +1,98 @@
+"""
+query.py
+========
+
+This module provides a small builder for parameterized SQLite queries. Values are never inlined in the SQL text
+but bound as parameters, so values with quotes cannot break (or inject into) a query, and the SQL text of a query
+only depends on its shape. Lists of values, e.g. the values of an IN filter or a list of media ids, are bound as a
+single JSON array that is expanded with `json_each`, so the SQL text does not depend on the number of values either.
+
+Every connection keeps a cache of prepared statements keyed by the SQL text (see `cached_statements` in
+clusterfun/storage/local/connections.py), so repeated requests with the same shape reuse the prepared statement
+instead of parsing and planning the query again.
+
+Classes
+-------
+Query
+    A SQL statement or condition with its parameters.
+
+Functions
+---------
+filter_to_query(filter_item: Filter) -> Query
+    Get the condition of a filter.
+in_values(column: str, values: Sequence[Any]) -> Query
+    Get the condition that a column has one of the values.
+join_conditions(conditions: Iterable[Query]) -> Query
+    Combine conditions with AND.
+"""
+
+import dataclasses
+import json
+import math
+from typing import Any, Iterable, Sequence, Tuple, Union
+
+from clusterfun.models.filter import Filter, is_float
+from clusterfun.storage.local.ingest import quote_identifier
+
+COMPARISONS = {">", "<", ">=", "<=", "=", "!="}
+
+
+@dataclasses.dataclass(frozen=True)
+class Query:
+    """A SQL statement or condition with its parameters, in the order of the `?` placeholders."""
+
+    sql: str = ""
+    params: Tuple[Any, ...] = ()
+
+    def __add__(self, other: Union["Query", str]) -> "Query":
+        if isinstance(other, str):
+            return Query(self.sql + other, self.params)
+        return Query(self.sql + other.sql, self.params + other.params)
+
+    def __bool__(self) -> bool:
+        return self.sql != ""
+
+
+def filter_to_query(filter_item: Filter) -> Query:
+    """
+    Get the condition of a filter. The filter should be validated with `Filter.is_valid` first.
+
+    Parameters
+    ----------
+    filter_item : Filter
+        A valid filter
+
+    Returns
+    -------
+    Query
+        The condition of the filter, with the filter values as parameters
+    """
+    column = quote_identifier(filter_item.column)
+    values = [to_sql_value(value) for value in filter_item.values]
+    if filter_item.comparison == "IN":
+        return in_values(filter_item.column, values)
+    if filter_item.comparison == "NOT IN":
+        return Query(f"{column} NOT IN (SELECT value FROM json_each(?))", (json.dumps(values),))
+    if filter_item.comparison not in COMPARISONS:
+        raise ValueError(f"Unknown comparison {filter_item.comparison}")
+    return Query(f"{column} {filter_item.comparison} ?", (values[0],))
+
+
+def in_values(column: str, values: Sequence[Any]) -> Query:
+    """Get the condition that a column has one of the values, with the values bound as a single JSON array."""
+    if len(values) == 1:
+        return Query(f"{quote_identifier(column)} = ?", (values[0],))
+    return Query(f"{quote_identifier(column)} IN (SELECT value FROM json_each(?))", (json.dumps(list(values)),))
+
+
+def join_conditions(conditions: Iterable[Query]) -> Query:
+    """Combine conditions with AND, skipping empty conditions."""
+    conditions = [condition for condition in conditions if condition]
+    return Query(" AND ".join(condition.sql for condition in conditions), sum((c.params for c in conditions), ()))
+
+
+def to_sql_value(value: Union[str, float, int]) -> Union[str, float, int]:
+    """Convert a filter value to the value to bind: numbers (also as strings) as numbers, other values as strings."""
+    if isinstance(value, str) and is_float(value) and math.isfinite(float(value)):
+        return int(value) if value.strip().lstrip("+-").isdigit() else float(value)
+    return value
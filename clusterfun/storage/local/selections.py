@@ -0,0 +1,162 @@
+"""
+selections.py
+=============
+
+This module provides the registry of selections: sets of media ids of a view that are stored on the server,
+so a client can refer to a (large) selection with a short token instead of sending all its ids with every request.
+
+A selection is registered once, by posting its ids or filters, and is then referred to by its token.
+The token is derived from the ids, so registering the same selection again returns the same token.
+To query the database, the ids of a selection are loaded into a temporary table of the connection,
+which the query joins instead of inlining the ids in the query.
+
+The memory budget of the registry is set with the CLUSTERFUN_SELECTION_CACHE_BYTES environment variable.
+Selections that no longer fit are evicted, after which requests with their token fail with a SelectionNotFoundError
+and the client should register the selection again.
+
+Classes
+-------
+Selection
+    A registered selection of media ids of a view.
+SelectionRegistry
+    A least recently used registry of the selections of the views.
+SelectionNotFoundError
+    Raised for a token of a selection that is not (or no longer) registered.
+"""
+
+import dataclasses
+import hashlib
+import os
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, Hashable, Iterable
+
+import numpy as np
+
+from clusterfun.storage.local.lru import LRUCache
+
+# default memory budget of the registry
+SELECTION_CACHE_BYTES = 64 * 1024 * 1024
+TABLE_PREFIX = "selection_"
+
+
+class SelectionNotFoundError(KeyError):
+    """Raised for a token of a selection that is not (or no longer) registered."""
+
+
+@dataclasses.dataclass
+class Selection:
+    """A registered selection of media ids of a view. The ids are sorted and unique."""
+
+    token: str
+    ids: np.ndarray
+
+    @property
+    def table(self) -> str:
+        """The name of the temporary table with the ids of the selection."""
+        return TABLE_PREFIX + self.token
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+class SelectionRegistry:
+    """A least recently used registry of the selections of the views, keyed by the directory of the view and token."""
+
+    def __init__(self, max_bytes: int):
+        """Initialise the registry.
+
+        Parameters
+        ----------
+        max_bytes : int
+            The maximum memory used by the ids of the registered selections
+        """
+        self.cache: LRUCache[Selection] = LRUCache(max_bytes)
+
+    def register(self, cache_dir: Path, ids: Iterable[int]) -> Selection:
+        """Register a selection of media ids of a view.
+
+        Parameters
+        ----------
+        cache_dir : Path
+            The directory of the view
+        ids : Iterable[int]
+            The media ids of the selection
+
+        Returns
+        -------
+        Selection
+            The selection, with the token to refer to it
+        """
+        ids = np.unique(np.fromiter(ids, dtype=np.int64))
+        selection = Selection(token=get_selection_token(ids), ids=ids)
+        self.cache.put((cache_dir, selection.token), selection, cost=max(ids.nbytes, 1))
+        return selection
+
+    def get(self, cache_dir: Path, token: str) -> Selection:
+        """Get a registered selection of a view.
+
+        Raises
+        ------
+        SelectionNotFoundError
+            If the selection is not registered, or was evicted
+        """
+        selection = self.cache.get((cache_dir, token))
+        if selection is None:
+            raise SelectionNotFoundError(f"Selection {token} of {cache_dir} is not registered")
+        return selection
+
+    def remove(self, cache_dir: Path, token: str) -> bool:
+        """Remove a selection from the registry. Returns whether the selection was registered."""
+        return self.cache.pop((cache_dir, token)) is not None
+
+    def attach(self, con: sqlite3.Connection, cache_dir: Path, token: str) -> str:
+        """
+        Load the ids of a selection into a temporary table of a connection to the database of the view,
+        if the connection does not have it yet. Tables of selections that are no longer registered are dropped.
+
+        Parameters
+        ----------
+        con : sqlite3.Connection
+            A connection to the database of the view
+        cache_dir : Path
+            The directory of the view
+        token : str
+            The token of the selection
+
+        Returns
+        -------
+        str
+            The name of the temporary table, with a single `id` column
+        """
+        selection = self.get(cache_dir, token)
+        tables = [
+            row[0]
+            for row in con.execute(
+                "SELECT name FROM temp.sqlite_master WHERE type = 'table' AND name LIKE ?", (TABLE_PREFIX + "%",)
+            )
+        ]
+        if selection.table in tables:
+            return selection.table
+        for table in tables:
+            if (cache_dir, table[len(TABLE_PREFIX) :]) not in self:
+                con.execute(f"DROP TABLE temp.{table}")
+        con.execute(f"CREATE TEMP TABLE {selection.table} (id INTEGER PRIMARY KEY)")
+        con.executemany(f"INSERT INTO temp.{selection.table} VALUES (?)", ((int(i),) for i in selection.ids))
+        con.commit()
+        return selection.table
+
+    def stats(self) -> Dict[str, Any]:
+        """Get the statistics of the registry."""
+        return self.cache.stats()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.cache
+
+
+def get_selection_token(ids: np.ndarray) -> str:
+    """Get the token of a selection, a hash of its sorted and unique ids."""
+    return hashlib.blake2b(ids.astype("<i8").tobytes(), digest_size=12).hexdigest()
+
+
+SELECTIONS = SelectionRegistry(int(os.environ.get("CLUSTERFUN_SELECTION_CACHE_BYTES", SELECTION_CACHE_BYTES)))
@@ -0,0 +1,230 @@
+"""
+spatial.py
+==========
+
+This module provides the spatial index of a scatter plot and the selection of its points inside a region,
+a box or a lasso polygon drawn on the plot. Instead of resolving the selection in the browser and posting
+all selected ids back, the region is posted and the selection is registered on the server.
+
+The spatial index is a grid: the points of the plot sorted by their bin in the finest level of the density pyramid,
+see clusterfun/storage/local/density.py. The points of a bin are consecutive in the index, and the number of points
+per bin is stored in the pyramid, so the candidates of a region are read with a slice per bin that overlaps its
+bounding box. The index is saved as a NumPy file next to the data and memory-mapped, so only those slices are read.
+The candidates are refined with their exact values: a vectorized bounding box check and, for a lasso,
+a point-in-polygon test.
+
+Views stored before the index existed are queried on the index of the x column instead.
+
+Functions
+---------
+write_spatial_index(save_dir: Path, pyramid: Optional[DensityPyramid], points: Optional[Tuple[np.ndarray, ...]])
+    Write the spatial index of a view.
+read_spatial_index(save_dir: Path) -> Optional[np.ndarray]
+    Read the spatial index of a view, memory-mapped.
+get_grid_candidates(index: np.ndarray, pyramid: DensityPyramid, region: Region) -> np.ndarray
+    Get the points in the bins of the spatial index that overlap a region.
+get_sqlite_candidates(con: sqlite3.Connection, x: str, y: str, region: Region) -> np.ndarray
+    Get the points of the database of a view in the bounding box of a region.
+get_region_bounds(region: Region) -> Tuple[Tuple[float, float], Tuple[float, float]]
+    Get the bounding box of a region.
+select_region(points: np.ndarray, region: Region) -> np.ndarray
+    Get the ids of the points inside a region.
+points_in_polygon(x: np.ndarray, y: np.ndarray, polygon: np.ndarray) -> np.ndarray
+    Check which points are inside a polygon.
+"""
+
+import math
+import sqlite3
+import tempfile
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+
+from clusterfun.models.selection import Region
+from clusterfun.storage.local.density import DensityPyramid
+from clusterfun.storage.local.ingest import quote_identifier
+from clusterfun.storage.local.query import Query
+
+SPATIAL_FILE = "spatial.npy"
+# the points of the index and the candidates of a region
+POINT_DTYPE = np.dtype([("id", "<i8"), ("x", "<f8"), ("y", "<f8")])
+
+
+def write_spatial_index(
+    save_dir: Path, pyramid: Optional[DensityPyramid], points: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]
+):
+    """
+    Write the spatial index of a view, to a new file that replaces the old one.
+    Without a pyramid, e.g. when x or y is not numeric, any old index is removed.
+
+    Parameters
+    ----------
+    save_dir : Path
+        The directory of the view
+    pyramid : Optional[DensityPyramid]
+        The density pyramid of the points
+    points : Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]
+        The ids and x and y values of the points the pyramid is built from, see `get_plot_points`
+    """
+    if pyramid is None or points is None:
+        (save_dir / SPATIAL_FILE).unlink(missing_ok=True)
+        return
+    ids, x, y = points
+    present = ~(np.isnan(x) | np.isnan(y))
+    ids, x, y = ids[present], x[present], y[present]
+    # the same order as the bins of the finest level, see `group_cells`
+    order = np.lexsort((ids, pyramid.get_cells(x, y, pyramid.levels[-1].size)))
+    index = np.empty(len(ids), dtype=POINT_DTYPE)
+    index["id"], index["x"], index["y"] = ids[order], x[order], y[order]
+    # a file object, as np.save adds the .npy suffix to paths
+    with tempfile.NamedTemporaryFile(dir=save_dir, prefix=SPATIAL_FILE, suffix=".tmp", delete=False) as f:
+        tmp_path = Path(f.name)
+        np.save(f, index)
+    try:
+        tmp_path.replace(save_dir / SPATIAL_FILE)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def read_spatial_index(save_dir: Path) -> Optional[np.ndarray]:
+    """Read the spatial index of a view memory-mapped, None if the view was stored without one."""
+    try:
+        return np.load(save_dir / SPATIAL_FILE, mmap_mode="r")
+    except FileNotFoundError:
+        return None
+
+
+def get_grid_candidates(index: np.ndarray, pyramid: DensityPyramid, region: Region) -> np.ndarray:
+    """
+    Get the points in the bins of the spatial index that overlap the bounding box of a region.
+
+    Parameters
+    ----------
+    index : np.ndarray
+        The spatial index, as read by `read_spatial_index`
+    pyramid : DensityPyramid
+        The density pyramid the index was written with
+    region : Region
+        The box and/or polygon to select the points in
+
+    Returns
+    -------
+    np.ndarray
+        The candidate points, with POINT_DTYPE
+    """
+    finest = pyramid.levels[-1]
+    # the points of a bin start after the points of the bins before it
+    starts = np.cumsum(finest.counts) - finest.counts
+    mask = pyramid.get_overlap(finest, *get_region_bounds(region))
+    starts, counts = starts[mask], finest.counts[mask]
+    # the positions of the points of the overlapping bins: the start of their bin plus their offset in it
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return index[np.repeat(starts, counts) + offsets]
+
+
+def get_sqlite_candidates(con: sqlite3.Connection, x: str, y: str, region: Region) -> np.ndarray:
+    """
+    Get the points of the database of a view in the bounding box of a region, with the index of the x column.
+    The rows are read from the cursor straight into the array of points, without a list of all rows in between.
+
+    Parameters
+    ----------
+    con : sqlite3.Connection
+        A connection to the database of the view
+    x : str
+        The x column of the plot
+    y : str
+        The y column of the plot
+    region : Region
+        The box and/or polygon to select the points in
+
+    Returns
+    -------
+    np.ndarray
+        The candidate points, with POINT_DTYPE
+    """
+    (x_min, x_max), (y_min, y_max) = get_region_bounds(region)
+    x_sql, y_sql = quote_identifier(x), quote_identifier(y)
+    query = Query(
+        f"SELECT id, {x_sql}, {y_sql} FROM database WHERE {x_sql} >= ? AND {x_sql} <= ? "
+        f"AND {y_sql} >= ? AND {y_sql} <= ? "
+        f"AND typeof({x_sql}) IN ('integer', 'real') AND typeof({y_sql}) IN ('integer', 'real')",
+        (x_min, x_max, y_min, y_max),
+    )
+    return np.fromiter(con.execute(query.sql, query.params), dtype=POINT_DTYPE)
+
+
+def get_region_bounds(region: Region) -> Tuple[Tuple[float, float], Tuple[float, float]]:
+    """Get the x and y range of the bounding box of a region, infinite for an unbounded axis."""
+    bounds = []
+    for axis, value_range in enumerate([region.x_range, region.y_range]):
+        start, end = sorted(value_range) if value_range is not None else (-math.inf, math.inf)
+        if region.polygon is not None:
+            start = max(start, min(vertex[axis] for vertex in region.polygon))
+            end = min(end, max(vertex[axis] for vertex in region.polygon))
+        bounds.append((start, end))
+    return bounds[0], bounds[1]
+
+
+def select_region(points: np.ndarray, region: Region) -> np.ndarray:
+    """
+    Get the ids of the points inside a region: inside its box and its polygon, if given.
+
+    Parameters
+    ----------
+    points : np.ndarray
+        The candidate points, with POINT_DTYPE
+    region : Region
+        The box and/or polygon to select the points in
+
+    Returns
+    -------
+    np.ndarray
+        The ids of the points inside the region, sorted
+    """
+    (x_min, x_max), (y_min, y_max) = get_region_bounds(region)
+    x, y = points["x"], points["y"]
+    mask = (x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max)
+    if region.polygon is not None:
+        candidates = np.flatnonzero(mask)
+        mask[candidates] = points_in_polygon(x[candidates], y[candidates], np.asarray(region.polygon, dtype=np.float64))
+    return np.sort(points["id"][mask])
+
+
+def points_in_polygon(x: np.ndarray, y: np.ndarray, polygon: np.ndarray) -> np.ndarray:
+    """
+    Check which points are inside a polygon with the even-odd rule: a point is inside if a ray from it
+    crosses the edges of the polygon an odd number of times.
+
+    An edge can only be crossed by the rays of the points with a y between the y of its vertices. With the points
+    sorted by y, those are a slice, so every edge is checked against the points of its slice only.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        The x values of the points
+    y : np.ndarray
+        The y values of the points
+    polygon : np.ndarray
+        The vertices of the polygon as rows of x and y, the last vertex is connected to the first
+
+    Returns
+    -------
+    np.ndarray
+        The mask of the points inside the polygon
+    """
+    order = np.argsort(y, kind="stable")
+    x, y = x[order], y[order]
+    inside = np.zeros(len(x), dtype=bool)
+    for (x1, y1), (x2, y2) in zip(polygon, np.roll(polygon, -1, axis=0)):
+        if y1 == y2:
+            # horizontal edges are never crossed
+            continue
+        # the points with min(y1, y2) <= y < max(y1, y2)
+        start, end = np.searchsorted(y, [min(y1, y2), max(y1, y2)], side="left")
+        crossing_x = x1 + (y[start:end] - y1) * (x2 - x1) / (y2 - y1)
+        inside[start:end] ^= x[start:end] < crossing_x
+    result = np.empty(len(x), dtype=bool)
+    result[order] = inside
+    return result
@@ -1,19 +1,37 @@
 """Storer class for saving the data locally"""
 
 import dataclasses
+import itertools
 import json
-import os
 import sqlite3
+import tempfile
+import time
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterable, List, Optional
 
 import orjson
 import pandas as pd
 
 from clusterfun.config import Config
-from clusterfun.storage.local.data import get_data_dict
-from clusterfun.storage.local.helpers import format_df_for_db
+from clusterfun.storage.local.binary import BINARY_FILE, BinaryDataWriter
+from clusterfun.storage.local.cache_manager import CacheManager
+from clusterfun.storage.local.catalog import Catalog, get_view_info
+from clusterfun.storage.local.column_stats import get_sqlite_column_stats, write_column_stats
+from clusterfun.storage.local.compression import save_compressed_data
+from clusterfun.storage.local.data import build_data_dict, get_data_dict, merge_data_dicts
+from clusterfun.storage.local.density import build_pyramid, get_plot_points, write_pyramid
+from clusterfun.storage.local.dictionaries import get_sqlite_dictionaries, write_dictionaries
+from clusterfun.storage.local.helpers import ChunkFormatter, format_df_for_db, get_cache_dir
+from clusterfun.storage.local.ingest import (
+    get_index_columns,
+    ingest_chunks,
+    ingest_dataframe,
+    insert_rows,
+    quote_identifier,
+)
+from clusterfun.storage.local.spatial import write_spatial_index
 from clusterfun.storage.storer import Storer
+from clusterfun.validation import ColumnNotFoundException, EmptyDataFrameException
 
 
 class LocalStorer(Storer):
@@ -27,7 +45,7 @@ class LocalStorer(Storer):
     ):
         """Initializes the storer, sets the cache_dir"""
         if cache_dir is None:
-            cache_dir = Path(os.environ.get("CLUSTERFUN_CACHE_DIR", os.path.expanduser("~/.cache/clusterfun")))
+            cache_dir = get_cache_dir()
         self.cache_dir = cache_dir
         self.uuid: Optional[str] = None
 
@@ -46,35 +64,199 @@ class LocalStorer(Storer):
         cfg.colors = colors
         self.save_config(cfg)
         self.save_data(data_dict)
+        self.save_dictionaries(cfg)
+        self.save_column_stats()
+        self.save_density(cfg, data_dict)
+        self.update_catalog()
+
+    def save_chunks(self, uuid: str, chunks: Iterable[pd.DataFrame], cfg: Config):
+        """Saves the data to the local directory chunk by chunk"""
+        self.uuid = uuid
+        self.save_dir.mkdir(parents=True, exist_ok=True)
+        con = self.save_db_chunks(cfg, chunks)
+
+        data_dict, colors = get_data_dict(con, cfg)
+        cfg.colors = colors
+        self.save_config(cfg)
+        self.save_data(data_dict)
+        self.save_dictionaries(cfg)
+        self.save_column_stats()
+        self.save_density(cfg, data_dict)
+        self.update_catalog()
+
+    def save_db_chunks(self, cfg: Config, chunks: Iterable[pd.DataFrame]) -> sqlite3.Connection:
+        """Saves the chunks to a sqlite database.
+        Local media paths are replaced with /media after all chunks are stored,
+        as the common media path is only known then."""
+        con = sqlite3.connect(self.save_dir / "database.db")
+        formatter = ChunkFormatter(cfg)
+        formatted_chunks = formatter(chunks)
+        first_chunk = next(formatted_chunks, None)
+        if first_chunk is None:
+            raise EmptyDataFrameException("DataFrame is empty")
+        ingest_chunks(
+            con,
+            itertools.chain([first_chunk], formatted_chunks),
+            primary_key="id",
+            indexes=get_index_columns(cfg, first_chunk),
+        )
+        if formatter.media_directory is not None:
+            cfg.common_media_path = formatter.media_directory
+            media = quote_identifier(cfg.media)
+            con.execute(f"UPDATE database SET {media} = replace({media}, ?, '/media')", (cfg.common_media_path,))
+            con.commit()
+        return con
 
     def save_db(self, cfg: Config, df: pd.DataFrame):
         """Saves the dataframe to a sqlite database"""
         con = sqlite3.connect(self.save_dir / "database.db")
         df = format_df_for_db(cfg, df)
-        try:
-            df.reset_index(drop=False).rename(columns={"index": "id"})[cfg.columns].to_sql(
-                name="database", con=con, index=False
-            )
-        except sqlite3.InterfaceError as exc:
-            raise sqlite3.InterfaceError(
-                "This dataframe could not be saved to the database. "
-                "Check if you have any columns with uncommon value types."
-            ) from exc
+        df = df.reset_index(drop=False).rename(columns={"index": "id"})[cfg.columns]
+        ingest_dataframe(con, df, primary_key="id", indexes=get_index_columns(cfg, df))
         return con
 
+    def append(self, uuid: str, df: pd.DataFrame):
+        """Appends rows to a stored plot, without rewriting the existing rows.
+        The new rows get ids after the existing ids, so stored labels stay valid."""
+        self.uuid = uuid
+        cfg = self.read_config()
+        con = sqlite3.connect(self.save_dir / "database.db")
+        start_id = con.execute("SELECT COALESCE(MAX(id) + 1, 0) FROM database").fetchone()[0]
+        df = format_rows_for_append(cfg, df, start_id)
+        # no ingest pragmas here: the existing rows should survive if appending fails
+        con.execute("BEGIN")
+        try:
+            insert_rows(con, df)
+        except Exception:
+            con.rollback()
+            raise
+        con.commit()
+        con.close()
+        self.append_data(cfg, df)
+        self.save_dictionaries(cfg)
+        self.save_column_stats()
+        self.update_catalog()
+
+    def append_data(self, cfg: Config, df: pd.DataFrame):
+        """Adds the plotly data of the appended rows to the stored data, and saves the config with any new colors"""
+        color_values = None
+        if cfg.color is not None and cfg.color_is_categorical:
+            existing_colors = list(cfg.colors or [])
+            new_colors = [value for value in pd.unique(df[cfg.color]).tolist() if value not in existing_colors]
+            color_values = existing_colors + new_colors
+        columns = {
+            key: df[column].to_numpy() if column is not None else None
+            for key, column in [("x", cfg.x), ("y", cfg.y), ("color", cfg.color)]
+        }
+        new_data, colors = build_data_dict(cfg, df["id"].to_numpy(), **columns, color_values=color_values)
+        with open(self.save_dir / "data.json", "rb") as f:
+            data = orjson.loads(f.read())  # pylint: disable=no-member
+        cfg.colors = colors
+        self.save_config(cfg)
+        data = merge_data_dicts(data, new_data)
+        self.save_data(data)
+        self.save_density(cfg, data)
+
+    def save_dictionaries(self, cfg: Config):
+        """Saves the distinct values of the categorical columns, used to validate filters without querying the data"""
+        con = sqlite3.connect(self.save_dir / "database.db")
+        try:
+            write_dictionaries(self.save_dir, get_sqlite_dictionaries(con, exclude=["id", cfg.media]))
+        finally:
+            con.close()
+
+    def save_column_stats(self):
+        """Saves the statistics of the columns, to list the columns and count their values without querying the data"""
+        con = sqlite3.connect(self.save_dir / "database.db")
+        try:
+            write_column_stats(self.save_dir, get_sqlite_column_stats(con))
+        finally:
+            con.close()
+
+    def save_density(self, cfg: Config, data: List[Dict[str, Any]]):
+        """Saves the density pyramid and spatial index of scatter plots, to send the points of large plots
+        per viewport and to select the points in a region. Both are built from the plot data being saved,
+        so the data is not read again."""
+        points = get_plot_points(cfg, data)
+        pyramid = None if points is None else build_pyramid(*points)
+        write_pyramid(self.save_dir, pyramid)
+        write_spatial_index(self.save_dir, pyramid, points)
+
+    def update_catalog(self):
+        """Adds the stored view to the catalog of the cache directory, or updates its size if it was already in it.
+        Then removes views from the cache directory if it exceeds the configured byte budget or maximum age."""
+        Catalog(self.cache_dir).add(get_view_info(self.save_dir, created=time.time()))
+        CacheManager.from_env(self.cache_dir).collect(keep=self.uuid)
+
+    def read_config(self) -> Config:
+        """Reads the stored config"""
+        with open(self.save_dir / "config.json", encoding="utf-8") as f:
+            return Config(**json.load(f))
+
     def save_config(self, cfg: Config):
         """Saves the config to a json file"""
         if cfg.display is not None and isinstance(cfg.display, str):
             cfg.display = [cfg.display]
-        with open(str(self.save_dir / "config.json"), "w", encoding="utf-8") as f:
+        # written to a new file of its own that replaces the old one, so loaders never see a partial file
+        with tempfile.NamedTemporaryFile(
+            "w", dir=self.save_dir, prefix="config.json", suffix=".tmp", delete=False, encoding="utf-8"
+        ) as f:
+            tmp_path = Path(f.name)
             json.dump(dataclasses.asdict(cfg), f, indent=2)
+        try:
+            tmp_path.replace(self.save_dir / "config.json")
+        finally:
+            tmp_path.unlink(missing_ok=True)
 
-    def save_data(self, data: List[Dict[str, Any]]):
-        """Saves the data for plotly to a json file"""
-        with open(self.save_dir / "data.json", "wb") as f:
-            f.write(
-                orjson.dumps(  # pylint: disable=no-member
-                    data,
-                    option=orjson.OPT_NAIVE_UTC | orjson.OPT_SERIALIZE_NUMPY,  # pylint: disable=no-member
+    def save_data(self, data: Iterable[Dict[str, Any]]):
+        """Saves the data for plotly to a json file, and to a binary file with the trace arrays as typed arrays.
+        The traces are written as they come, so they can be passed as an iterator.
+        Compressed versions of the json file are saved too, to send the view compressed."""
+        with open(self.save_dir / "data.json", "wb") as f, BinaryDataWriter(self.save_dir / BINARY_FILE) as binary:
+            f.write(b"[")
+            for idx, trace in enumerate(data):
+                if idx > 0:
+                    f.write(b",")
+                f.write(
+                    orjson.dumps(  # pylint: disable=no-member
+                        trace,
+                        option=orjson.OPT_NAIVE_UTC | orjson.OPT_SERIALIZE_NUMPY,  # pylint: disable=no-member
+                    )
                 )
-            )
+                binary.write(trace)
+            f.write(b"]")
+        save_compressed_data(self.save_dir)
+
+
+def format_rows_for_append(cfg: Config, df: pd.DataFrame, start_id: int) -> pd.DataFrame:
+    """Formats rows to append to a stored plot, giving them ids starting at `start_id`.
+
+    Parameters
+    ----------
+    cfg : Config
+        The config of the stored plot
+    df : pd.DataFrame
+        The rows to append. Local media paths should already be relative to /media.
+    start_id : int
+        The id of the first new row
+
+    Returns
+    -------
+    pd.DataFrame
+        A formatted copy of the rows, with just the columns in `cfg.columns`
+
+    Raises
+    ------
+    ValueError
+        If the plot type does not support appending
+    ColumnNotFoundException
+        If a column of the stored plot is missing
+    """
+    if cfg.type not in ["scatter", "grid"]:
+        raise ValueError(f"Appending rows is only supported for scatter and grid plots, not for {cfg.type}")
+    for column in cfg.columns:
+        if column != "id" and column not in df.columns:
+            raise ColumnNotFoundException(f"{column} not in columns of dataframe")
+    df = format_df_for_db(cfg, df.copy())
+    df.index = pd.RangeIndex(start_id, start_id + len(df))
+    return df.reset_index(drop=False).rename(columns={"index": "id"})[cfg.columns]
@@ -0,0 +1,130 @@
+"""
+view_state.py
+=============
+
+This module provides the process-wide cache of the state of the views: the parsed config, the labels,
+the column dictionaries and statistics, the density pyramid, the schema of the stored data and the pool of read-only
+connections to it. Every request creates a new loader, so without this cache every request would read and parse
+the files of the view again.
+
+The state of a view is validated against the modification time, size and inode of its config, labels, column
+metadata, density pyramid and data files on every use, so changes by another process (e.g. appending rows or saving
+labels) are picked up.
+The config and labels are written to a temporary file that replaces the original, so every write changes the inode.
+
+The memory budget of the cache is set with the CLUSTERFUN_VIEW_CACHE_BYTES environment variable.
+
+Classes
+-------
+ViewState
+    The cached state of a view.
+ViewStateCache
+    A least recently used cache of the state of the views.
+"""
+
+import dataclasses
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, FrozenSet, Hashable, List, Optional, Tuple
+
+from clusterfun.config import Config
+from clusterfun.storage.local.column_stats import ColumnStats
+from clusterfun.storage.local.connections import ConnectionPool
+from clusterfun.storage.local.density import DensityPyramid
+from clusterfun.storage.local.lru import LRUCache
+
+if TYPE_CHECKING:  # pragma: no cover
+    from clusterfun.storage.local.loader import LocalLoader
+
+# default memory budget of the cache
+VIEW_CACHE_BYTES = 64 * 1024 * 1024
+# parsed JSON takes up more memory than the file it is parsed from
+JSON_MEMORY_FACTOR = 8
+
+FileVersion = Optional[Tuple[int, int, int]]
+
+
+@dataclasses.dataclass
+class ViewState:  # pylint: disable=too-many-instance-attributes
+    """The cached state of a view. The state is shared between requests and should not be modified."""
+
+    version: Tuple[FileVersion, ...]
+    config: Config
+    labels: Dict[str, List[str]]
+    label_vocabulary: List[str]
+    schema: Any
+    cost: int
+    connections: Optional[ConnectionPool] = None
+    dictionaries: Dict[str, FrozenSet[Any]] = dataclasses.field(default_factory=dict)
+    column_stats: Dict[str, ColumnStats] = dataclasses.field(default_factory=dict)
+    density: Optional[DensityPyramid] = None
+
+    @property
+    def data_version(self) -> Tuple[FileVersion, ...]:
+        """The versions of all files of the view but the labels, see `LocalLoader.get_version`.
+        Results derived from the data, e.g. filter results, stay valid when the labels change."""
+        return self.version[:1] + self.version[2:]
+
+    def close(self):
+        """Releases the resources of the state when it is evicted from the cache."""
+        if self.connections is not None:
+            self.connections.close()
+
+
+class ViewStateCache:
+    """A least recently used cache of the state of the views, keyed by the directory of the view."""
+
+    def __init__(self, max_bytes: int):
+        """Initialise the cache.
+
+        Parameters
+        ----------
+        max_bytes : int
+            The approximate maximum memory used by the cached states
+        """
+        self.cache: LRUCache[ViewState] = LRUCache(max_bytes, on_evict=lambda _, state: state.close())
+
+    def get(self, loader: "LocalLoader") -> ViewState:
+        """Get the state of the view of a loader, reading it if it is not cached or out of date.
+
+        Parameters
+        ----------
+        loader : LocalLoader
+            The loader of the view
+
+        Returns
+        -------
+        ViewState
+            The state of the view
+        """
+        version = loader.get_version()
+        state = self.cache.get(loader.cache_dir, validate=lambda cached: cached.version == version)
+        if state is None:
+            state = loader.read_state(version)
+            self.cache.put(loader.cache_dir, state, cost=state.cost)
+        return state
+
+    def invalidate(self, cache_dir: Hashable):
+        """Remove the state of a view from the cache, e.g. when the view is removed."""
+        self.cache.invalidate(cache_dir)
+
+    def stats(self) -> Dict[str, Any]:
+        """Get the statistics of the cache."""
+        return self.cache.stats()
+
+
+def get_file_version(path: Path) -> FileVersion:
+    """Get the modification time, size and inode of a file, or None if it does not exist."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+def get_json_cost(versions: List[FileVersion]) -> int:
+    """Estimate the memory used by the parsed contents of JSON files, based on their versions."""
+    return JSON_MEMORY_FACTOR * sum(version[1] for version in versions if version is not None)
+
+
+VIEW_STATES = ViewStateCache(int(os.environ.get("CLUSTERFUN_VIEW_CACHE_BYTES", VIEW_CACHE_BYTES)))
@@ -0,0 +1,341 @@
+"""ParquetLoader class for loading data stored as Parquet from the local filesystem."""
+
+import operator
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from clusterfun.config import Config
+from clusterfun.constants import PARQUET_FILE
+from clusterfun.models.filter import Filter, is_float
+from clusterfun.models.media_indices import MediaIndices
+from clusterfun.models.selection import Region
+from clusterfun.storage.local.column_stats import ColumnStats
+from clusterfun.storage.local.connections import ConnectionPool
+from clusterfun.storage.local.data import build_data_dict
+from clusterfun.storage.local.density import DensityPyramid
+from clusterfun.storage.local.exports import (
+    EXPORT_BATCH_SIZE,
+    ExportFormat,
+    get_csv_schema,
+    get_csv_timestamp_unit,
+    iter_csv_batches,
+)
+from clusterfun.storage.local.loader import LocalLoader, get_column_stats, get_media_ids
+from clusterfun.storage.local.pagination import InvalidCursorError, decode_cursor, get_sort, is_paged
+from clusterfun.storage.local.spatial import POINT_DTYPE, get_region_bounds
+from clusterfun.storage.parquet.storer import (
+    get_arrow_value_counts,
+    get_parquet_column_stats,
+    get_parquet_pyramid,
+    get_plot_columns,
+)
+
+COMPARISONS = {
+    ">": operator.gt,
+    "<": operator.lt,
+    ">=": operator.ge,
+    "<=": operator.le,
+    "=": operator.eq,
+    "!=": operator.ne,
+}
+
+
+class ParquetLoader(LocalLoader):
+    """ParquetLoader class for loading data stored by the ParquetStorer.
+    All reads are memory-mapped and only read the columns that are needed,
+    filters are pushed down to the Parquet reader so row groups that cannot match are skipped."""
+
+    @property
+    def parquet_path(self) -> Path:
+        """Return the path to the Parquet file."""
+        return self.cache_dir / PARQUET_FILE
+
+    @property
+    def _data_path(self) -> Path:
+        """Return the path to the file with the stored data."""
+        return self.parquet_path
+
+    @property
+    def column_names(self) -> List[str]:
+        """Return the names of the columns of the stored data, in the order of the fetched rows."""
+        return self.schema.names
+
+    @property
+    def schema(self) -> pa.Schema:
+        """Return the schema of the Parquet file, as cached in the state of the view."""
+        return self.state.schema
+
+    def _open_connections(self) -> Optional[ConnectionPool]:
+        """Parquet files are read without a database connection."""
+        return None
+
+    def _read_schema(self, connections: Optional[ConnectionPool]) -> pa.Schema:
+        """Read the schema of the Parquet file from the file footer."""
+        return pq.read_schema(self.parquet_path, memory_map=True)
+
+    def read_table(self, columns: Optional[List[str]] = None, expression: Optional[pc.Expression] = None) -> pa.Table:
+        """Read the given columns of the rows matching the expression.
+
+        Parameters
+        ----------
+        columns : Optional[List[str]], optional
+            The columns to read, by default None which reads all columns
+        expression : Optional[pc.Expression], optional
+            The expression rows should match, by default None which reads all rows
+
+        Returns
+        -------
+        pa.Table
+            The matching rows
+        """
+        return pq.read_table(self.parquet_path, columns=columns, filters=expression, memory_map=True)
+
+    def fetch_row(self, media_id: int) -> Tuple[Any, ...]:
+        """Fetch the raw row for a given media id, with the values in the order of `config.columns`."""
+        rows = table_to_rows(self.read_table(expression=pc.field("id") == media_id))
+        if len(rows) == 0:
+            raise ValueError(f"No row found for {media_id=}")
+        return rows[0]
+
+    def fetch_rows(
+        self, media_indices: MediaIndices, paginate: bool = True, lookahead: bool = False
+    ) -> List[Tuple[Any, ...]]:
+        """Fetch the raw rows for the given media indices, with the values in the order of `config.columns`.
+        With `lookahead`, a page includes the first row of the next page, if any."""
+        expression = self.get_media_expression(media_indices)
+        sort = get_sort(media_indices)
+        if sort is not None and sort[0] not in self.schema.names:
+            sort = None
+        if paginate and media_indices.cursor is not None:
+            expression = expression & cursor_to_expression(media_indices.cursor, sort, self.schema)
+        table = self.read_table(expression=expression)
+        if sort is not None:
+            table = sort_table(table, sort)
+        if paginate and is_paged(media_indices):
+            offset = media_indices.page * media_indices.page_size if media_indices.cursor is None else 0
+            table = table.slice(offset, media_indices.page_size + 1 if lookahead else media_indices.page_size)
+        rows = table_to_rows(table)
+        if len(rows) == 0:
+            raise ValueError(f"No rows found for {media_indices=}")
+        return rows
+
+    def get_export_batches(
+        self,
+        media_indices: MediaIndices,
+        batch_size: int = EXPORT_BATCH_SIZE,
+        export_format: Optional[ExportFormat] = None,
+    ) -> Tuple[pa.Schema, Iterator[pa.RecordBatch]]:
+        """Read the rows of the media indices in record batches, to stream them as an export.
+        The row groups are scanned one by one, except to sort the rows, which needs the matching rows in memory.
+        For CSV, the rows are exported like pandas writes them, which depends on all of the values of the timestamp
+        and integer columns, see `iter_csv_batches`, so those columns are scanned first."""
+        expression = self.get_media_expression(media_indices)
+        sort = get_sort(media_indices)
+        timestamps = [
+            field.name for field in self.schema if export_format == "csv" and pa.types.is_timestamp(field.type)
+        ]
+        integers = [field.name for field in self.schema if export_format == "csv" and pa.types.is_integer(field.type)]
+        if sort is not None and sort[0] in self.schema.names:
+            table = sort_table(self.read_table(expression=expression), sort)
+            batches = iter(table.to_batches(max_chunksize=batch_size))
+            chunks = {column: table.column(column).chunks for column in timestamps + integers}
+        else:
+            dataset = ds.dataset(self.parquet_path, format="parquet")
+            batches = iter(dataset.to_batches(filter=expression, batch_size=batch_size))
+            chunks = {
+                column: (batch.column(0) for batch in dataset.to_batches(columns=[column], filter=expression))
+                for column in timestamps + integers
+            }
+        units = {column: get_csv_timestamp_unit(chunks[column]) for column in timestamps}
+        nullable_integers = [column for column in integers if any(chunk.null_count > 0 for chunk in chunks[column])]
+        if len(units) == 0 and len(nullable_integers) == 0:
+            return self.schema, batches
+        schema = get_csv_schema(self.schema, units, nullable_integers)
+        return schema, iter_csv_batches(batches, units, schema)
+
+    def get_media_expression(self, media_indices: MediaIndices) -> pc.Expression:
+        """Get the expression of the rows of the media indices, with their filters if any."""
+        expression = pc.field("id").isin(get_media_ids(self.cache_dir, media_indices))
+        if media_indices.filters:
+            filter_expression = self.get_filter_expression(media_indices.filters, self.state.config)
+            if filter_expression is not None:
+                expression = expression & filter_expression
+        return expression
+
+    def get_filtered_ids(self, filters: List[Filter]) -> np.ndarray:
+        """Get the ids of the rows matching the filters."""
+        expression = self.get_filter_expression(filters, self.state.config)
+        return self.read_table(columns=["id"], expression=expression).column(0).to_numpy().astype(np.int64)
+
+    def get_region_candidates(self, region: Region, x: str, y: str) -> np.ndarray:
+        """Get the points in the bounding box of a region from the stored data, for views without a spatial index.
+        Row groups outside of the bounding box are skipped with their statistics."""
+        if not all(
+            pa.types.is_integer(self.schema.field(column).type) or pa.types.is_floating(self.schema.field(column).type)
+            for column in [x, y]
+        ):
+            return np.empty(0, dtype=POINT_DTYPE)
+        (x_min, x_max), (y_min, y_max) = get_region_bounds(region)
+        x_field, y_field = pc.field(x), pc.field(y)
+        table = self.read_table(
+            columns=list(dict.fromkeys(["id", x, y])),
+            expression=(x_field >= x_min) & (x_field <= x_max) & (y_field >= y_min) & (y_field <= y_max),
+        )
+        points = np.empty(table.num_rows, dtype=POINT_DTYPE)
+        for field, column in [("id", "id"), ("x", x), ("y", y)]:
+            points[field] = table.column(column).to_numpy()
+        return points
+
+    def filter(self, filters: List[Filter]) -> List[Dict[str, Any]]:
+        """Filters the data based on the given filters."""
+        config = self.state.config
+        columns = list(dict.fromkeys(c for c in ["id", config.x, config.y, config.color] if c is not None))
+        table = self.read_table(columns=columns, expression=self.get_filter_expression(filters, config))
+        # the colors are stored in the config on save, so the traces keep their colors when filtering
+        data, _ = build_data_dict(config, **get_plot_columns(config, table), color_values=config.colors)
+        return data
+
+    def _compute_column_stats(self, connections: Optional[ConnectionPool]) -> List[ColumnStats]:
+        """Compute the statistics of the columns from the stored data."""
+        return get_parquet_column_stats(self.parquet_path)
+
+    def _compute_density(self, connections: Optional[ConnectionPool], config: Config) -> Optional[DensityPyramid]:
+        """Compute the density pyramid from the stored data, None if the plot gets no pyramid."""
+        return get_parquet_pyramid(self.parquet_path, config)
+
+    def get_value_counts(self, column: str, media_indices: Optional[MediaIndices] = None) -> List[Tuple[Any, int]]:
+        """Count the values of a column, most common first.
+        The counts of all rows are taken from the column statistics if they are complete."""
+        column_stats = get_column_stats(self.state, column)
+        if media_indices is None and column_stats.is_complete:
+            return column_stats.top_values
+        expression = None if media_indices is None else self.get_media_expression(media_indices)
+        return get_arrow_value_counts(self.read_table(columns=[column], expression=expression).column(0))
+
+    def get_dataframe(self, media_indices: Optional[MediaIndices] = None) -> pd.DataFrame:
+        """Get the data as a pandas dataframe."""
+        if media_indices is None:
+            return self.read_table().to_pandas()
+        return pd.DataFrame(self.fetch_rows(media_indices, paginate=False), columns=self.schema.names)
+
+    def get_filter_expression(self, filters: List[Filter], config: Config) -> Optional[pc.Expression]:
+        """Get the expression to apply the filters, skipping invalid filters.
+
+        Parameters
+        ----------
+        filters : List[Filter]
+            The filters to apply
+        config : Config
+            The config of the plot, used to validate the filter columns
+
+        Returns
+        -------
+        Optional[pc.Expression]
+            The combined expression, or None if there are no valid filters
+        """
+        schema = self.schema
+        expression = None
+        for filter_item in filters:
+            column_values = self.state.dictionaries.get(filter_item.column)
+            if (
+                column_values is None
+                and filter_item.column in schema.names
+                and any(not str(value).isnumeric() and not is_float(value) for value in filter_item.values)
+            ):
+                column_values = frozenset(
+                    pc.unique(self.read_table(columns=[filter_item.column]).column(0)).to_pylist()
+                )
+            if not filter_item.is_valid(config.columns, column_values=column_values):
+                continue
+            filter_expression = filter_to_expression(filter_item, schema.field(filter_item.column).type)
+            expression = filter_expression if expression is None else expression & filter_expression
+        return expression
+
+
+def filter_to_expression(filter_item: Filter, field_type: pa.DataType) -> pc.Expression:
+    """Convert a filter to a pyarrow expression.
+
+    Parameters
+    ----------
+    filter_item : Filter
+        A valid filter
+    field_type : pa.DataType
+        The type of the filter column, used to cast the filter values
+
+    Returns
+    -------
+    pc.Expression
+        The expression for the filter
+    """
+    values: List[Union[float, str]]
+    if pa.types.is_integer(field_type) or pa.types.is_floating(field_type):
+        values = [float(value) for value in filter_item.values]
+    else:
+        values = [str(value) for value in filter_item.values]
+    field = pc.field(filter_item.column)
+    if filter_item.comparison == "IN":
+        return field.isin(values)
+    if filter_item.comparison == "NOT IN":
+        return ~field.isin(values)
+    return COMPARISONS[filter_item.comparison](field, values[0])
+
+
+def cursor_to_expression(cursor: str, sort: Optional[Tuple[str, bool]], schema: pa.Schema) -> pc.Expression:
+    """Get the expression that selects the rows after a cursor, the pyarrow version of `get_cursor_query`.
+
+    Parameters
+    ----------
+    cursor : str
+        The cursor of the last row of the previous page
+    sort : Optional[Tuple[str, bool]]
+        The sort column and whether to sort ascending, as returned by `get_sort`
+    schema : pa.Schema
+        The schema of the Parquet file, the sort value is compared as the type of its column
+
+    Returns
+    -------
+    pc.Expression
+        The expression for the rows after the cursor
+
+    Raises
+    ------
+    InvalidCursorError
+        If the cursor is not valid or its sort value does not fit the sort column
+    """
+    value, media_id = decode_cursor(cursor)
+    if sort is None:
+        return pc.field("id") > media_id
+    if value is not None:
+        # e.g. the nanoseconds of timestamps are lost when pyarrow converts a Python value by itself
+        try:
+            value = pa.scalar(value, type=schema.field(sort[0]).type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError) as e:
+            raise InvalidCursorError(f"Invalid cursor {cursor} for column {sort[0]}") from e
+    field, ascending = pc.field(sort[0]), sort[1]
+    if ascending:
+        # null values come first
+        if value is None:
+            return (field.is_null() & (pc.field("id") > media_id)) | field.is_valid()
+        return (field > value) | ((field == value) & (pc.field("id") > media_id))
+    # null values come last
+    if value is None:
+        return field.is_null() & (pc.field("id") < media_id)
+    return (field < value) | ((field == value) & (pc.field("id") < media_id)) | field.is_null()
+
+
+def sort_table(table: pa.Table, sort: Tuple[str, bool]) -> pa.Table:
+    """Sort a table by a column and the id, in the same order as SQLite, see clusterfun/storage/local/pagination.py."""
+    direction = "ascending" if sort[1] else "descending"
+    return table.sort_by([(sort[0], direction), ("id", direction)], null_placement="at_start" if sort[1] else "at_end")
+
+
+def table_to_rows(table: pa.Table) -> List[Tuple[Any, ...]]:
+    """Convert a table to a list of row tuples."""
+    return list(zip(*[column.to_pylist() for column in table.columns]))
@@ -0,0 +1,303 @@
+"""ParquetStorer class for saving the data locally as Parquet instead of SQLite"""
+
+from pathlib import Path
+from typing import Any, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from clusterfun.config import Config
+from clusterfun.constants import PARQUET_FILE
+from clusterfun.storage.local.column_stats import STATS_TOP_K, ColumnStats, write_column_stats
+from clusterfun.storage.local.data import PlotColumns, build_data_dict
+from clusterfun.storage.local.density import DensityPyramid, build_pyramid, has_pyramid
+from clusterfun.storage.local.dictionaries import DICTIONARY_MAX_CARDINALITY, write_dictionaries
+from clusterfun.storage.local.helpers import ChunkFormatter, format_df_for_db
+from clusterfun.storage.local.storer import LocalStorer, format_rows_for_append
+from clusterfun.validation import EmptyDataFrameException
+
+# number of rows per Parquet row group. Row group statistics are used to skip data when filtering.
+ROW_GROUP_SIZE = 128 * 1024
+
+
+class ParquetStorer(LocalStorer):
+    """
+    Stores the data in a local directory like the LocalStorer, but writes the queryable data as a Parquet file.
+    Because Parquet is a columnar format, reading just the x, y and color columns of a wide dataframe
+    does not require reading the other columns.
+    """
+
+    def save(self, uuid: str, df: pd.DataFrame, cfg: Config):
+        """Saves the data to the local directory"""
+        self.uuid = uuid
+        self.save_dir.mkdir(parents=True, exist_ok=True)
+        table = self.save_table(cfg, df)
+
+        data_dict, colors = build_data_dict(cfg, **get_plot_columns(cfg, table))
+        cfg.colors = colors
+        self.save_config(cfg)
+        self.save_data(data_dict)
+        self.save_dictionaries(cfg)
+        self.save_column_stats()
+        self.save_density(cfg, data_dict)
+        self.update_catalog()
+
+    def save_chunks(self, uuid: str, chunks: Iterable[pd.DataFrame], cfg: Config):
+        """Saves the data to the local directory chunk by chunk"""
+        self.uuid = uuid
+        self.save_dir.mkdir(parents=True, exist_ok=True)
+        formatter = ChunkFormatter(cfg)
+        path = self.save_dir / PARQUET_FILE
+        writer: Optional[pq.ParquetWriter] = None
+        try:
+            for chunk in formatter(chunks):
+                table = to_table(chunk)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema)
+                schema = widen_schema(writer.schema, table.schema)
+                if not schema.equals(writer.schema):
+                    # a column without values in the chunks so far has values now: rewrite them with its type
+                    writer.close()
+                    writer = rewrite_with_schema(path, schema)
+                writer.write_table(cast_table(table, writer.schema), row_group_size=ROW_GROUP_SIZE)
+        finally:
+            if writer is not None:
+                writer.close()
+        if writer is None:
+            raise EmptyDataFrameException("DataFrame is empty")
+        if formatter.media_directory is not None:
+            cfg.common_media_path = formatter.media_directory
+            self.replace_media_prefix(cfg.media, cfg.common_media_path)
+
+        columns = list(dict.fromkeys(c for c in ["id", cfg.x, cfg.y, cfg.color] if c is not None))
+        table = pq.read_table(self.save_dir / PARQUET_FILE, columns=columns, memory_map=True)
+        data_dict, colors = build_data_dict(cfg, **get_plot_columns(cfg, table))
+        cfg.colors = colors
+        self.save_config(cfg)
+        self.save_data(data_dict)
+        self.save_dictionaries(cfg)
+        self.save_column_stats()
+        self.save_density(cfg, data_dict)
+        self.update_catalog()
+
+    def append(self, uuid: str, df: pd.DataFrame):
+        """Appends rows to a stored plot. Parquet files cannot be appended to,
+        so the file is rewritten one row group at a time with the new rows added at the end."""
+        self.uuid = uuid
+        cfg = self.read_config()
+        path = self.save_dir / PARQUET_FILE
+        max_id = pc.max(pq.read_table(path, columns=["id"], memory_map=True).column("id")).as_py()
+        df = format_rows_for_append(cfg, df, 0 if max_id is None else max_id + 1)
+        tmp_path = path.with_suffix(".tmp")
+        table = to_table(df)
+        with pq.ParquetFile(path, memory_map=True) as parquet_file:
+            # columns without values so far get the type of the appended values
+            schema = widen_schema(parquet_file.schema_arrow, table.schema)
+            with pq.ParquetWriter(tmp_path, schema) as writer:
+                for batch in parquet_file.iter_batches(batch_size=ROW_GROUP_SIZE):
+                    writer.write_table(pa.Table.from_batches([batch]).cast(schema), row_group_size=ROW_GROUP_SIZE)
+                writer.write_table(cast_table(table, schema), row_group_size=ROW_GROUP_SIZE)
+        tmp_path.replace(path)
+        self.append_data(cfg, df)
+        self.save_dictionaries(cfg)
+        self.save_column_stats()
+        self.update_catalog()
+
+    def save_table(self, cfg: Config, df: pd.DataFrame) -> pa.Table:
+        """Saves the dataframe to a Parquet file"""
+        df = format_df_for_db(cfg, df)
+        table = to_table(df.reset_index(drop=False).rename(columns={"index": "id"})[cfg.columns])
+        pq.write_table(table, self.save_dir / PARQUET_FILE, row_group_size=ROW_GROUP_SIZE)
+        return table
+
+    def save_dictionaries(self, cfg: Config):
+        """Saves the distinct values of the categorical columns, used to validate filters without reading the data"""
+        path = self.save_dir / PARQUET_FILE
+        columns = [
+            field.name
+            for field in pq.read_schema(path, memory_map=True)
+            if (pa.types.is_string(field.type) or pa.types.is_large_string(field.type))
+            and field.name not in ["id", cfg.media]
+        ]
+        dictionaries = {}
+        for column in columns:
+            values = pc.unique(pq.read_table(path, columns=[column], memory_map=True).column(0)).drop_null()
+            if len(values) <= DICTIONARY_MAX_CARDINALITY:
+                dictionaries[column] = values.to_pylist()
+        write_dictionaries(self.save_dir, dictionaries)
+
+    def save_column_stats(self):
+        """Saves the statistics of the columns, to list the columns and count their values without reading the data"""
+        write_column_stats(self.save_dir, get_parquet_column_stats(self.save_dir / PARQUET_FILE))
+
+    def replace_media_prefix(self, media: str, media_directory: str):
+        """Replaces the local media directory in the media column with /media.
+        Rewrites the Parquet file one row group at a time."""
+        path = self.save_dir / PARQUET_FILE
+        tmp_path = path.with_suffix(".tmp")
+        with pq.ParquetFile(path, memory_map=True) as parquet_file:
+            with pq.ParquetWriter(tmp_path, parquet_file.schema_arrow) as writer:
+                for batch in parquet_file.iter_batches(batch_size=ROW_GROUP_SIZE):
+                    table = pa.Table.from_batches([batch])
+                    idx = table.schema.get_field_index(media)
+                    table = table.set_column(
+                        idx, media, pc.replace_substring(table.column(idx), media_directory, "/media")
+                    )
+                    writer.write_table(table, row_group_size=ROW_GROUP_SIZE)
+        tmp_path.replace(path)
+
+
+def to_table(df: pd.DataFrame) -> pa.Table:
+    """Converts a dataframe to an Arrow table"""
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError) as exc:
+        raise ValueError(
+            "This dataframe could not be saved to Parquet. Check if you have any columns with uncommon value types."
+        ) from exc
+
+
+def widen_schema(schema: pa.Schema, other: pa.Schema) -> pa.Schema:
+    """Get the schema with the fields without values (null typed) replaced by their type in another schema.
+
+    Parameters
+    ----------
+    schema : pa.Schema
+        The schema of the stored rows
+    other : pa.Schema
+        The schema of the rows to add
+
+    Returns
+    -------
+    pa.Schema
+        The schema to store all rows with
+    """
+    fields = []
+    for field in schema:
+        if pa.types.is_null(field.type) and field.name in other.names:
+            field = field.with_type(other.field(field.name).type)
+        fields.append(field)
+    return pa.schema(fields, metadata=schema.metadata)
+
+
+def cast_table(table: pa.Table, schema: pa.Schema) -> pa.Table:
+    """Cast a table to the schema of the stored rows, raising a ValueError if its values do not fit."""
+    try:
+        return table.cast(schema)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError) as exc:
+        raise ValueError(
+            f"These rows could not be saved to Parquet with the column types of the rows before them: {exc}"
+        ) from exc
+
+
+def rewrite_with_schema(path: Path, schema: pa.Schema) -> pq.ParquetWriter:
+    """Rewrite a Parquet file with a wider schema one row group at a time, see `widen_schema`.
+
+    Parameters
+    ----------
+    path : Path
+        The path of the Parquet file
+    schema : pa.Schema
+        The schema to rewrite the file with
+
+    Returns
+    -------
+    pq.ParquetWriter
+        The open writer of the rewritten file, to write more rows with
+    """
+    old_path = path.with_suffix(".old")
+    path.replace(old_path)
+    writer = pq.ParquetWriter(path, schema)
+    with pq.ParquetFile(old_path, memory_map=True) as parquet_file:
+        for batch in parquet_file.iter_batches(batch_size=ROW_GROUP_SIZE):
+            writer.write_table(pa.Table.from_batches([batch]).cast(schema), row_group_size=ROW_GROUP_SIZE)
+    old_path.unlink()
+    return writer
+
+
+def get_plot_columns(cfg: Config, table: pa.Table) -> PlotColumns:
+    """Get the id, x, y and color columns of a table as numpy arrays, as used by `build_data_dict`."""
+    x, y, color = (
+        table.column(column).to_numpy() if column is not None and column in table.column_names else None
+        for column in [cfg.x, cfg.y, cfg.color]
+    )
+    return PlotColumns(ids=table.column("id").to_numpy(), x=x, y=y, color=color)
+
+
+def get_parquet_pyramid(path: Path, cfg: Config) -> Optional[DensityPyramid]:
+    """Build the density pyramid of a Parquet file, None if the plot gets no pyramid or its x or y is not numeric.
+    See clusterfun/storage/local/density.py."""
+    if not has_pyramid(cfg):
+        return None
+    table = pq.read_table(path, columns=list(dict.fromkeys(["id", cfg.x, cfg.y])), memory_map=True)
+    if not all(pa.types.is_integer(field.type) or pa.types.is_floating(field.type) for field in table.schema):
+        return None
+    # missing values become NaN, which are left out of the pyramid
+    x, y = (pc.cast(table.column(column), pa.float64()).to_numpy() for column in [cfg.x, cfg.y])
+    return build_pyramid(table.column("id").to_numpy(), x, y)
+
+
+def get_parquet_column_stats(path: Path) -> List[ColumnStats]:
+    """Compute the statistics of the columns of a Parquet file, reading one column at a time.
+    See clusterfun/storage/local/column_stats.py."""
+    stats = []
+    for field in pq.read_schema(path, memory_map=True):
+        values = pq.read_table(path, columns=[field.name], memory_map=True).column(0)
+        try:
+            minimum, maximum = pc.min_max(values).values()
+            minimum, maximum = minimum.as_py(), maximum.as_py()
+        except pa.ArrowNotImplementedError:
+            minimum = maximum = None
+        stats.append(
+            ColumnStats(
+                name=field.name,
+                dtype=get_arrow_dtype(field.type, values.null_count),
+                count=len(values),
+                null_count=values.null_count,
+                min=minimum,
+                max=maximum,
+                distinct_count=(
+                    0 if pa.types.is_null(field.type) else pc.count_distinct(values, mode="only_valid").as_py()
+                ),
+                top_values=get_arrow_value_counts(values, limit=STATS_TOP_K),
+            )
+        )
+    return stats
+
+
+def get_arrow_dtype(field_type: pa.DataType, null_count: int) -> str:
+    """Get the dtype of a column with the given Arrow type after converting it to pandas."""
+    if null_count > 0 and pa.types.is_integer(field_type):
+        return "float64"
+    if null_count > 0 and pa.types.is_boolean(field_type):
+        return "object"
+    try:
+        dtype = field_type.to_pandas_dtype()
+    except NotImplementedError:
+        return "object"
+    # e.g. timestamps with a time zone, which numpy has no dtype for
+    if isinstance(dtype, pd.api.extensions.ExtensionDtype):
+        return str(dtype)
+    return str(np.dtype(dtype))
+
+
+def get_arrow_value_counts(values: pa.ChunkedArray, limit: Optional[int] = None) -> List[Tuple[Any, int]]:
+    """Count the values of a column, most common first, in the same order as `get_sqlite_value_counts`."""
+    if pa.types.is_null(values.type):
+        # a column without any values, e.g. all missing in the rows saved so far
+        return [(None, len(values))] if len(values) > 0 else []
+    counts = pc.value_counts(values.drop_null()).flatten()
+    table = pa.table({"values": counts[0], "counts": counts[1]})
+    table = table.take(pc.sort_indices(table, sort_keys=[("counts", "descending"), ("values", "ascending")]))
+    if limit is not None:
+        table = table.slice(0, limit)
+    value_counts = []
+    if values.null_count > 0:
+        # missing values come first in ties, as in SQLite
+        value_counts = [(None, values.null_count)]
+    value_counts += list(zip(table.column("values").to_pylist(), table.column("counts").to_pylist()))
+    value_counts.sort(key=lambda item: -item[1])
+    return value_counts if limit is None else value_counts[:limit]
@@ -0,0 +1,109 @@
+"""
+sources.py
+==========
+
+This module turns the different data sources that can be plotted into an iterator of DataFrame chunks,
+so plots can be saved without loading the whole dataset into memory.
+
+Supported sources are:
+- a pandas DataFrame
+- an iterable of pandas DataFrames
+- a path to a Parquet or CSV file
+- a pyarrow Table or RecordBatchReader
+
+Functions
+---------
+iter_chunks(source: DataSource, chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]
+    Iterate over a data source in DataFrame chunks.
+split_source(source: DataSource, chunk_size: int = CHUNK_SIZE) -> Tuple[pd.DataFrame, DataSource]
+    Get a sample of a data source to validate it, together with the source to save.
+"""
+
+import itertools
+from pathlib import Path
+from typing import Iterable, Iterator, Tuple, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from clusterfun.validation import EmptyDataFrameException
+
+DataSource = Union[pd.DataFrame, Iterable[pd.DataFrame], str, Path, pa.Table, pa.RecordBatchReader]
+
+# number of rows read at a time from files and record batch readers
+CHUNK_SIZE = 100_000
+
+
+def iter_chunks(source: DataSource, chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """Iterate over a data source in DataFrame chunks.
+
+    Parameters
+    ----------
+    source : DataSource
+        The data to iterate over
+    chunk_size : int, optional
+        The number of rows per chunk when reading from a file, by default CHUNK_SIZE.
+        Chunks from an iterable of DataFrames or a RecordBatchReader are passed on as they are.
+
+    Returns
+    -------
+    Iterator[pd.DataFrame]
+        The chunks of the data source
+
+    Raises
+    ------
+    ValueError
+        If the source is a file that is not a Parquet or CSV file
+    """
+    if isinstance(source, pd.DataFrame):
+        for start in range(0, len(source), chunk_size):
+            yield source.iloc[start : start + chunk_size]
+    elif isinstance(source, (str, Path)):
+        suffix = Path(source).suffix.lower()
+        if suffix in [".parquet", ".pq"]:
+            for batch in pq.ParquetFile(source).iter_batches(batch_size=chunk_size):
+                yield batch.to_pandas()
+        elif suffix == ".csv":
+            yield from pd.read_csv(source, chunksize=chunk_size)
+        else:
+            raise ValueError(f"Cannot read {source}, only Parquet and CSV files are supported")
+    elif isinstance(source, pa.Table):
+        for batch in source.to_batches(max_chunksize=chunk_size):
+            yield batch.to_pandas()
+    elif isinstance(source, pa.RecordBatchReader):
+        for batch in source:
+            yield batch.to_pandas()
+    else:
+        yield from source
+
+
+def split_source(source: DataSource, chunk_size: int = CHUNK_SIZE) -> Tuple[pd.DataFrame, DataSource]:
+    """Get a sample of a data source to validate it and determine its columns,
+    together with the source to save.
+
+    Parameters
+    ----------
+    source : DataSource
+        The data to plot
+    chunk_size : int, optional
+        The number of rows per chunk when reading from a file, by default CHUNK_SIZE
+
+    Returns
+    -------
+    Tuple[pd.DataFrame, DataSource]
+        The sample and the source. For a DataFrame both are the DataFrame itself,
+        for other sources the sample is the first chunk and the source an iterator over all chunks.
+
+    Raises
+    ------
+    EmptyDataFrameException
+        If the source does not contain any chunks
+    """
+    if isinstance(source, pd.DataFrame):
+        return source, source
+    chunks = iter_chunks(source, chunk_size)
+    sample = next(chunks, None)
+    if sample is None:
+        raise EmptyDataFrameException("DataFrame is empty")
+    return sample, itertools.chain([sample], chunks)
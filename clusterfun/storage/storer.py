@@ -5,7 +5,7 @@ Base class for storing plots.
 import abc
 import base64
 from io import BytesIO
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, Iterable, Optional, Tuple
 
 import pandas as pd
 from PIL import Image
@@ -28,12 +28,22 @@ class Storer(abc.ABC):
             be a database, or a file with the data in it.
         """
 
+    @abc.abstractmethod
+    def save_chunks(self, uuid: str, chunks: Iterable[pd.DataFrame], cfg: Config):
+        """Save a plot from an iterable of DataFrame chunks. Does the same as `save`,
+        but should only keep a single chunk of the data in memory at a time."""
+
+    @abc.abstractmethod
+    def append(self, uuid: str, df: pd.DataFrame):
+        """Append rows to a stored plot. The existing rows should keep their ids,
+        and the data for the plot should be updated with the new rows."""
+
     @abc.abstractmethod
     def save_config(self, cfg: Config):
         """Save the configuration object for a plot."""
 
     @abc.abstractmethod
-    def save_data(self, data: List[Dict[str, Any]]):
+    def save_data(self, data: Iterable[Dict[str, Any]]):
         """Save the data for a plot. This is the minimal data required for the plot."""
 
 
@@ -0,0 +1,100 @@
+"""Benchmark concurrent grid paging: a new SQLite connection per request against the pooled read-only connections.
+
+Usage: python scripts/benchmarks/connections.py --rows 1000000 --requests 2000 --threads 8 --selection-size 5000
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from clusterfun.config import Config
+from clusterfun.models.media_indices import MediaIndices
+from clusterfun.storage.local.helpers import get_media_query
+from clusterfun.storage.local.loader import LocalLoader
+from clusterfun.storage.local.storer import LocalStorer
+
+
+def make_dataframe(rows: int) -> pd.DataFrame:
+    """Create a dataframe that looks like an embedding dump."""
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(
+        {
+            "img_path": [f"s3://bucket/images/{i}.jpg" for i in range(rows)],
+            "x": rng.normal(size=rows),
+            "y": rng.normal(size=rows),
+            "label": rng.choice([f"class_{i}" for i in range(20)], size=rows),
+            "score": rng.random(size=rows),
+        }
+    )
+
+
+def page_with_new_connection(uuid: str, media_indices: MediaIndices):
+    """Fetch a page of the grid the way the loader did before pooling: connect, query and close."""
+    loader = LocalLoader(uuid)
+    con = sqlite3.connect(loader.db_path, check_same_thread=False)
+    query = get_media_query(media_indices, config=loader.state.config, con=con)
+    con.execute(query.sql, query.params).fetchall()
+    con.close()
+
+
+def page_with_pool(uuid: str, media_indices: MediaIndices):
+    """Fetch a page of the grid with the pooled connection of the thread."""
+    LocalLoader(uuid).fetch_rows(media_indices)
+
+
+def run(rows: int, requests: int, threads: int, selection_size: int):
+    cfg = Config(
+        "scatter",
+        media="img_path",
+        columns=["id", "img_path", "x", "y", "label", "score"],
+        x="x",
+        y="y",
+        color="label",
+    )
+    LocalStorer().save("benchmark", make_dataframe(rows), cfg)
+    rng = random.Random(0)
+    # selections of points, sorted by score, paged through 50 at a time
+    selections = [sorted(rng.sample(range(rows), selection_size)) for _ in range(10)]
+    pages = [
+        MediaIndices(
+            media_ids=rng.choice(selections),
+            page=rng.randrange(max(selection_size // 50, 1)),
+            sort_column="score",
+            ascending=True,
+        )
+        for _ in range(requests)
+    ]
+    print(f"rows: {rows:,}, requests: {requests:,}, threads: {threads}, selection size: {selection_size:,}")
+    for name, func in [("new connection", page_with_new_connection), ("pooled", page_with_pool)]:
+        latencies = []
+
+        def timed(media_indices: MediaIndices, func=func, latencies=latencies):
+            start = time.perf_counter()
+            func("benchmark", media_indices)
+            latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(timed, pages))
+        seconds = time.perf_counter() - start
+        p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+        print(f"{name}: {requests / seconds:,.0f} pages/sec, p50 {p50:.2f}ms, p99 {p99:.2f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark pooled SQLite connections for grid paging.")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--selection-size", type=int, default=5000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.environ["CLUSTERFUN_CACHE_DIR"] = tmpdir
+        run(args.rows, args.requests, args.threads, args.selection_size)
@@ -0,0 +1,102 @@
+"""Benchmark filtering with SQLite against the in-memory column engine.
+
+Usage: python scripts/benchmarks/engine.py --rows 1000000 --repeats 10
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from typing import Callable, List
+
+import numpy as np
+import pandas as pd
+
+from clusterfun.config import Config
+from clusterfun.models.filter import Filter
+from clusterfun.models.media_indices import MediaIndices
+from clusterfun.storage.local import loader as loader_module
+from clusterfun.storage.local.column_engine import ColumnEngineCache
+from clusterfun.storage.local.loader import LocalLoader
+from clusterfun.storage.local.storer import LocalStorer
+
+CATEGORIES = [f"class_{i}" for i in range(200)]
+
+
+def make_dataframe(rows: int) -> pd.DataFrame:
+    """Create a dataframe that looks like an embedding dump."""
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(
+        {
+            "img_path": [f"s3://bucket/images/{i}.jpg" for i in range(rows)],
+            "x": rng.normal(size=rows),
+            "y": rng.normal(size=rows),
+            "label": rng.choice(CATEGORIES, size=rows),
+            "score": rng.random(size=rows),
+        }
+    )
+
+
+def time_calls(call: Callable[[List[Filter]], object], filter_sets: List[List[Filter]]) -> float:
+    """Call with every set of filters and return the mean seconds per call."""
+    start = time.perf_counter()
+    for filters in filter_sets:
+        call(filters)
+    return (time.perf_counter() - start) / len(filter_sets)
+
+
+def run(rows: int, repeats: int):
+    cfg = Config(
+        "scatter",
+        media="img_path",
+        columns=["id", "img_path", "x", "y", "label", "score"],
+        x="x",
+        y="y",
+        color="label",
+    )
+    LocalStorer().save("benchmark", make_dataframe(rows), cfg)
+    rng = random.Random(0)
+    filter_sets = [
+        [
+            Filter(column="label", comparison="IN", values=rng.sample(CATEGORIES, 20)),
+            Filter(column="score", comparison=">", values=[round(rng.random(), 3)]),
+        ]
+        for _ in range(repeats)
+    ]
+    selection = list(range(0, rows, 10))
+    print(f"rows: {rows:,}, repeats: {repeats}")
+    # load the columns when requested, the server loads them in the background
+    engines = ColumnEngineCache(loader_module.ENGINES.cache.max_cost)
+    start = time.perf_counter()
+    loader = LocalLoader("benchmark")
+    engines.load(loader, loader.state)
+    print(f"loading the columns: {(time.perf_counter() - start) * 1000:.0f}ms")
+    results = {}
+    for name, cache in [("sqlite", ColumnEngineCache(0)), ("in memory", engines)]:
+        loader_module.ENGINES = cache
+        loader = LocalLoader("benchmark")
+        results[name] = [
+            time_calls(loader.filter, filter_sets),
+            time_calls(loader.get_filtered_ids, filter_sets),
+            time_calls(
+                lambda filters, loader=loader: loader.get_value_counts(
+                    "label", MediaIndices(media_ids=selection, filters=filters)
+                ),
+                filter_sets,
+            ),
+        ]
+    for idx, name in enumerate(["filter traces", "filtered ids", "value counts in a selection"]):
+        print(
+            f"{name}: sqlite {results['sqlite'][idx] * 1000:.0f}ms, in memory {results['in memory'][idx] * 1000:.0f}ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark filtering with SQLite and in memory.")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeats", type=int, default=10)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.environ["CLUSTERFUN_CACHE_DIR"] = tmpdir
+        run(args.rows, args.repeats)
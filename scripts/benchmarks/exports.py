@@ -0,0 +1,78 @@
+"""Benchmark exporting the rows of a selection, rendered as one CSV string with pandas against streamed in batches.
+Peak memory is the peak of the Python and NumPy allocations plus the peak of the Arrow memory pool.
+
+Usage: python scripts/benchmarks/exports.py --rows 1000000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from clusterfun.config import Config
+from clusterfun.models.media_indices import MediaIndices
+from clusterfun.storage.local.exports import stream_export
+from clusterfun.storage.local.loader import LocalLoader
+from clusterfun.storage.local.storer import LocalStorer
+
+
+def make_dataframe(rows: int) -> pd.DataFrame:
+    """Create a dataframe that looks like an embedding dump."""
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(
+        {
+            "img_path": [f"s3://bucket/images/{i}.jpg" for i in range(rows)],
+            "x": rng.normal(size=rows),
+            "y": rng.normal(size=rows),
+            "label": rng.choice(["cat", "dog", "bird"], size=rows),
+            "score": rng.uniform(size=rows),
+        }
+    )
+
+
+def measure(export) -> tuple:
+    """Run an export and return the number of bytes, the seconds it took and the peak memory in MB."""
+    pool = pa.default_memory_pool()
+    arrow_start = pool.bytes_allocated()
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = sum(len(chunk) for chunk in export())
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, seconds, (peak + pool.max_memory() - arrow_start) / 1e6
+
+
+def run(rows: int):
+    df = make_dataframe(rows)
+    LocalStorer().save("benchmark", df, Config("grid", media="img_path", columns=["id", *df.columns]))
+    loader = LocalLoader("benchmark")
+    media_indices = MediaIndices(media_ids=list(range(rows)))
+    print(f"rows: {rows:,}")
+
+    def pandas_csv():
+        yield loader.get_dataframe(media_indices=media_indices).to_csv(index=False).encode("utf-8")
+
+    def streamed(export_format):
+        schema, batches = loader.get_export_batches(media_indices)
+        return stream_export(schema, batches, export_format)
+
+    exports = {"pandas csv": pandas_csv}
+    exports.update({f"streamed {f}": lambda f=f: streamed(f) for f in ["csv", "parquet", "arrow"]})
+    for name, export in exports.items():
+        size, seconds, peak = measure(export)
+        print(f"{name}: {size / 1e6:.1f}MB in {seconds * 1000:.0f}ms, peak memory {peak:.1f}MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark exporting the rows of a selection.")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.environ["CLUSTERFUN_CACHE_DIR"] = tmpdir
+        run(args.rows)
@@ -0,0 +1,111 @@
+"""Benchmark repeated filter application: SQL with inlined values against parameterized, prepared statements.
+
+Usage: python scripts/benchmarks/filters.py --rows 1000000 --repeats 50
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from typing import Callable, List
+
+import numpy as np
+import pandas as pd
+
+from clusterfun.config import Config
+from clusterfun.models.filter import Filter
+from clusterfun.storage.local.data import get_data_dict
+from clusterfun.storage.local.loader import LocalLoader
+from clusterfun.storage.local.query import Query, filter_to_query, join_conditions
+from clusterfun.storage.local.storer import LocalStorer
+
+CATEGORIES = [f"class_{i}" for i in range(200)]
+
+
+def make_dataframe(rows: int) -> pd.DataFrame:
+    """Create a dataframe that looks like an embedding dump."""
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(
+        {
+            "img_path": [f"s3://bucket/images/{i}.jpg" for i in range(rows)],
+            "x": rng.normal(size=rows),
+            "y": rng.normal(size=rows),
+            "label": rng.choice(CATEGORIES, size=rows),
+            "score": rng.random(size=rows),
+        }
+    )
+
+
+def inline_filter_query(filters: List[Filter]) -> Query:
+    """Build the filter condition with the values inlined in the SQL text, as before the query builder."""
+    conditions = []
+    for filter_item in filters:
+        values = ",".join(
+            str(value) if isinstance(value, (int, float)) else f"'{value}'" for value in filter_item.values
+        )
+        if filter_item.comparison in ["IN", "NOT IN"]:
+            conditions.append(f"{filter_item.column} {filter_item.comparison} ({values})")
+        else:
+            conditions.append(f"{filter_item.column} {filter_item.comparison} {values}")
+    return Query(" AND ".join(conditions))
+
+
+def parameterized_filter_query(filters: List[Filter]) -> Query:
+    """Build the filter condition with the query builder, the same as `get_filter_query` without validation."""
+    return join_conditions(filter_to_query(filter_item) for filter_item in filters)
+
+
+def time_filters(con: sqlite3.Connection, cfg: Config, filter_sets: List[List[Filter]], build: Callable) -> float:
+    """Apply every set of filters and return the mean seconds per application."""
+    start = time.perf_counter()
+    for filters in filter_sets:
+        get_data_dict(con, cfg, query_addition=build(filters))
+    return (time.perf_counter() - start) / len(filter_sets)
+
+
+def run(rows: int, repeats: int):
+    cfg = Config("scatter", media="img_path", columns=["id", "img_path", "x", "y", "label", "score"], x="x", y="y")
+    LocalStorer().save("benchmark", make_dataframe(rows), cfg)
+    loader = LocalLoader("benchmark")
+    con, config = loader.connection, loader.state.config
+    rng = random.Random(0)
+    # the same filter shape with different values, as when moving a slider or picking categories in the UI
+    filter_sets = [
+        [
+            Filter(column="label", comparison="IN", values=rng.sample(CATEGORIES, 20)),
+            Filter(column="score", comparison=">", values=[round(rng.random(), 3)]),
+        ]
+        for _ in range(repeats)
+    ]
+    print(f"rows: {rows:,}, repeats: {repeats}")
+    # validation is the same for both, so it is left out of the comparison
+    for filters in filter_sets:
+        assert all(filter_item.is_valid(config.columns, con) for filter_item in filters)
+    inline = time_filters(con, config, filter_sets, inline_filter_query)
+    parameterized = time_filters(con, config, filter_sets, parameterized_filter_query)
+    print(f"inlined values: {inline * 1000:.1f}ms/filter, parameterized: {parameterized * 1000:.1f}ms/filter")
+
+    # the cost of parsing and planning on its own, with a query that returns a single row
+    start = time.perf_counter()
+    for filters in filter_sets:
+        query = inline_filter_query(filters)
+        con.execute(f"SELECT id FROM database WHERE {query.sql} LIMIT 1").fetchall()
+    inline = (time.perf_counter() - start) / repeats
+    start = time.perf_counter()
+    for filters in filter_sets:
+        query = Query("SELECT id FROM database WHERE ") + parameterized_filter_query(filters) + " LIMIT 1"
+        con.execute(query.sql, query.params).fetchall()
+    parameterized = (time.perf_counter() - start) / repeats
+    print(f"prepare + first row: inlined {inline * 1e6:.0f}us, parameterized {parameterized * 1e6:.0f}us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark inlined and parameterized filter queries.")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeats", type=int, default=50)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.environ["CLUSTERFUN_CACHE_DIR"] = tmpdir
+        run(args.rows, args.repeats)
@@ -0,0 +1,56 @@
+"""Benchmark the bulk ingest path against `DataFrame.to_sql`.
+
+Usage: python scripts/benchmarks/ingest.py --rows 2000000
+"""
+
+import argparse
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from clusterfun.storage.local.ingest import ingest_dataframe
+
+
+def make_dataframe(rows: int) -> pd.DataFrame:
+    """Create a dataframe that looks like an embedding dump."""
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(
+        {
+            "id": np.arange(rows),
+            "img_path": [f"s3://bucket/images/{i}.jpg" for i in range(rows)],
+            "x": rng.normal(size=rows),
+            "y": rng.normal(size=rows),
+            "label": rng.choice([f"class_{i}" for i in range(300)], size=rows),
+            "score": rng.random(size=rows),
+        }
+    )
+
+
+def run(rows: int):
+    df = make_dataframe(rows)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        con = sqlite3.connect(Path(tmpdir) / "to_sql.db")
+        start = time.perf_counter()
+        df.to_sql(name="database", con=con, index=False)
+        to_sql_seconds = time.perf_counter() - start
+        con.close()
+
+        con = sqlite3.connect(Path(tmpdir) / "ingest.db")
+        start = time.perf_counter()
+        ingest_dataframe(con, df)
+        ingest_seconds = time.perf_counter() - start
+        con.close()
+
+    print(f"rows: {rows:,}")
+    print(f"to_sql: {to_sql_seconds:.2f}s ({rows / to_sql_seconds:,.0f} rows/sec)")
+    print(f"ingest: {ingest_seconds:.2f}s ({rows / ingest_seconds:,.0f} rows/sec)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the SQLite bulk ingest path.")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    run(parser.parse_args().rows)
@@ -0,0 +1,67 @@
+"""Benchmark paging through a sorted selection: offset pagination against keyset (cursor) pagination.
+
+Usage: python scripts/benchmarks/pagination.py --rows 1000000 --selection-size 200000 --pages 200
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from clusterfun.config import Config
+from clusterfun.models.media_indices import MediaIndices
+from clusterfun.models.selection import SelectionRequest
+from clusterfun.storage.local.loader import LocalLoader, fetch_page, select
+from clusterfun.storage.local.storer import LocalStorer
+
+
+def make_dataframe(rows: int) -> pd.DataFrame:
+    """Create a dataframe that looks like an embedding dump."""
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(
+        {
+            "img_path": [f"s3://bucket/images/{i}.jpg" for i in range(rows)],
+            "x": rng.normal(size=rows),
+            "y": rng.normal(size=rows),
+            "score": rng.random(size=rows),
+        }
+    )
+
+
+def run(rows: int, selection_size: int, pages: int):
+    cfg = Config("scatter", media="img_path", columns=["id", "img_path", "x", "y", "score"], x="x", y="y")
+    LocalStorer().save("benchmark", make_dataframe(rows), cfg)
+    loader = LocalLoader("benchmark")
+    ids = np.random.default_rng(0).choice(rows, size=selection_size, replace=False).tolist()
+    selection = select(loader, SelectionRequest(media_ids=ids))
+    media_indices = MediaIndices(selection=selection.token, sort_column="score", ascending=True)
+    # the deepest pages are the slowest with offset pagination
+    first_page = selection_size // media_indices.page_size - pages
+    print(f"rows: {rows:,}, selection size: {selection_size:,}, pages {first_page:,} to {first_page + pages:,}")
+
+    start = time.perf_counter()
+    for page in range(first_page, first_page + pages):
+        fetch_page(loader, media_indices.model_copy(update={"page": page}))
+    offset_seconds = time.perf_counter() - start
+
+    # the cursor of the first page is taken from the last offset page before it, as a client would have
+    _, cursor = fetch_page(loader, media_indices.model_copy(update={"page": first_page - 1}))
+    start = time.perf_counter()
+    for _ in range(pages):
+        _, cursor = fetch_page(loader, media_indices.model_copy(update={"cursor": cursor}))
+    keyset_seconds = time.perf_counter() - start
+    print(f"offset: {offset_seconds / pages * 1000:.2f}ms/page, keyset: {keyset_seconds / pages * 1000:.2f}ms/page")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark offset and keyset pagination of the grid.")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--selection-size", type=int, default=200_000)
+    parser.add_argument("--pages", type=int, default=200)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.environ["CLUSTERFUN_CACHE_DIR"] = tmpdir
+        run(args.rows, args.selection_size, args.pages)
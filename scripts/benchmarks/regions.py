@@ -0,0 +1,78 @@
+"""Benchmark selecting the points of a scatter plot in a box or lasso, with a query on the index of the x column
+against the spatial index.
+
+Usage: python scripts/benchmarks/regions.py --rows 1000000 --repeats 5
+"""
+
+import argparse
+import math
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from clusterfun.config import Config
+from clusterfun.models.selection import Region
+from clusterfun.storage.local.density import get_plot_points
+from clusterfun.storage.local.loader import LocalLoader, get_region_ids
+from clusterfun.storage.local.spatial import SPATIAL_FILE, write_spatial_index
+from clusterfun.storage.local.storer import LocalStorer
+
+
+def make_dataframe(rows: int) -> pd.DataFrame:
+    """Create a dataframe that looks like an embedding dump."""
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(
+        {
+            "img_path": [f"s3://bucket/images/{i}.jpg" for i in range(rows)],
+            "x": rng.normal(size=rows),
+            "y": rng.normal(size=rows),
+        }
+    )
+
+
+def make_lasso(vertices: int) -> Region:
+    """A star shaped lasso around the origin, with a radius of about one standard deviation."""
+    angles = np.linspace(0, 2 * math.pi, vertices, endpoint=False)
+    radius = 1 + 0.3 * np.sin(5 * angles)
+    return Region(polygon=list(zip(radius * np.cos(angles), radius * np.sin(angles))))
+
+
+def time_calls(call, repeats: int) -> float:
+    """Call `repeats` times and return the mean milliseconds per call."""
+    start = time.perf_counter()
+    for _ in range(repeats):
+        call()
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def run(rows: int, repeats: int):
+    cfg = Config("scatter", media="img_path", columns=["id", "img_path", "x", "y"], x="x", y="y")
+    LocalStorer().save("benchmark", make_dataframe(rows), cfg)
+    loader = LocalLoader("benchmark")
+    points = get_plot_points(cfg, loader.load_data())
+    print(f"rows: {rows:,}, repeats: {repeats}")
+    start = time.perf_counter()
+    write_spatial_index(loader.cache_dir, loader.state.density, points)
+    print(f"building the spatial index: {(time.perf_counter() - start) * 1000:.0f}ms")
+    index_path = loader.cache_dir / SPATIAL_FILE
+    regions = {"box": Region(x_range=(0.5, 0.7), y_range=(-0.1, 0.1)), "lasso (200 vertices)": make_lasso(200)}
+    for name, region in regions.items():
+        size = len(get_region_ids(loader, region))
+        with_index = time_calls(lambda region=region: get_region_ids(loader, region), repeats)
+        index_path.rename(index_path.with_suffix(".bak"))
+        without_index = time_calls(lambda region=region: get_region_ids(loader, region), repeats)
+        index_path.with_suffix(".bak").rename(index_path)
+        print(f"{name}, {size:,} points: SQLite {without_index:.0f}ms, spatial index {with_index:.0f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark selecting the points of a scatter plot in a region.")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.environ["CLUSTERFUN_CACHE_DIR"] = tmpdir
+        run(args.rows, args.repeats)
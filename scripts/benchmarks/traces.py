@@ -0,0 +1,99 @@
+"""Benchmark building the plotly traces of a categorical scatter plot: a query per color against a single query.
+
+Usage: python scripts/benchmarks/traces.py --rows 1000000 --classes 300 --repeats 3
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from clusterfun.config import Config
+from clusterfun.constants import COLORS
+from clusterfun.models.filter import Filter
+from clusterfun.storage.local.data import get_data_dict
+from clusterfun.storage.local.helpers import get_filter_query
+from clusterfun.storage.local.loader import LocalLoader
+from clusterfun.storage.local.query import Query
+from clusterfun.storage.local.storer import LocalStorer
+
+
+def make_dataframe(rows: int, classes: int) -> pd.DataFrame:
+    """Create a dataframe that looks like an embedding dump."""
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(
+        {
+            "img_path": [f"s3://bucket/images/{i}.jpg" for i in range(rows)],
+            "x": rng.normal(size=rows),
+            "y": rng.normal(size=rows),
+            "label": rng.choice([f"class_{i}" for i in range(classes)], size=rows),
+            "score": rng.random(size=rows),
+        }
+    )
+
+
+def get_data_per_color(cfg: Config, con: sqlite3.Connection, query_addition: Optional[Query] = None) -> List[Dict]:
+    """Build the traces with a query per color, as before the single-pass trace builder."""
+    data: List[Dict[str, Any]] = []
+    colors = [row[0] for row in con.execute(f"SELECT DISTINCT {cfg.color} FROM database NOT INDEXED")]
+    for idx, color in enumerate(colors):
+        query = Query(f"SELECT id,{cfg.x},{cfg.y},{cfg.color} FROM database WHERE {cfg.color} = ?", (color,))
+        if query_addition:
+            query += Query(" AND ") + query_addition
+        res = con.execute(query.sql, query.params).fetchall()
+        data.append(
+            {
+                "id": [x[0] for x in res],
+                "x": [x[1] for x in res],
+                "y": [x[2] for x in res],
+                "mode": "markers",
+                "type": "scattergl",
+                "name": color,
+                "marker": {"color": COLORS[idx % len(COLORS)], "opacity": 1.0},
+            }
+        )
+    return data
+
+
+def time_build(build: Callable[[], List[Dict]], repeats: int) -> float:
+    """Build the traces `repeats` times and return the mean seconds per build."""
+    start = time.perf_counter()
+    for _ in range(repeats):
+        build()
+    return (time.perf_counter() - start) / repeats
+
+
+def run(rows: int, classes: int, repeats: int):
+    cfg = Config(
+        "scatter",
+        media="img_path",
+        columns=["id", "img_path", "x", "y", "label", "score"],
+        x="x",
+        y="y",
+        color="label",
+    )
+    LocalStorer().save("benchmark", make_dataframe(rows, classes), cfg)
+    loader = LocalLoader("benchmark")
+    con, config = loader.connection, loader.state.config
+    condition = get_filter_query(con, config, [Filter(column="score", comparison=">", values=[0.5])])
+    print(f"rows: {rows:,}, classes: {classes}, repeats: {repeats}")
+    for name, query_addition in [("save (all rows)", None), ("filter (half of the rows)", condition)]:
+        per_color = time_build(lambda addition=query_addition: get_data_per_color(config, con, addition), repeats)
+        single_pass = time_build(lambda addition=query_addition: get_data_dict(con, config, addition)[0], repeats)
+        print(f"{name}: query per color {per_color * 1000:.0f}ms, single pass {single_pass * 1000:.0f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark building the traces of a categorical scatter plot.")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--classes", type=int, default=300)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.environ["CLUSTERFUN_CACHE_DIR"] = tmpdir
+        run(args.rows, args.classes, args.repeats)
@@ -0,0 +1,67 @@
+"""Benchmark serving a view payload: parsing and serializing data.json against streaming its raw bytes.
+
+Usage: python scripts/benchmarks/view.py --points 100000 1000000 5000000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from clusterfun.config import Config
+from clusterfun.plot import Plot
+from clusterfun.storage.local.loader import LocalLoader, stream_view
+from clusterfun.storage.local.storer import LocalStorer
+
+
+def make_dataframe(points: int) -> pd.DataFrame:
+    """Create a dataframe that looks like an embedding dump."""
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(
+        {
+            "img_path": [f"s3://bucket/images/{i}.jpg" for i in range(points)],
+            "x": rng.normal(size=points),
+            "y": rng.normal(size=points),
+            "label": rng.choice([f"class_{i}" for i in range(20)], size=points),
+        }
+    )
+
+
+def serialize(uuid: str) -> int:
+    """Build the response body the way read_view did before streaming."""
+    body = JSONResponse(jsonable_encoder(Plot.load(uuid).as_json())).body
+    return len(body)
+
+
+def stream(uuid: str) -> int:
+    """Build the response body from the raw bytes of data.json."""
+    return sum(len(chunk) for chunk in stream_view(LocalLoader(uuid)))
+
+
+def run(points: int):
+    df = make_dataframe(points)
+    cfg = Config(
+        "scatter", media="img_path", columns=["id", "img_path", "x", "y", "label"], x="x", y="y", color="label"
+    )
+    uuid = f"benchmark-{points}"
+    LocalStorer().save(uuid, df, cfg)
+    print(f"points: {points:,} (data.json: {os.path.getsize(LocalLoader(uuid).cache_dir / 'data.json'):,} bytes)")
+    for name, func in [("parse + serialize", serialize), ("stream raw bytes", stream)]:
+        start = time.perf_counter()
+        size = func(uuid)
+        print(f"{name}: {time.perf_counter() - start:.3f}s ({size:,} bytes)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark serving view payloads.")
+    parser.add_argument("--points", type=int, nargs="+", default=[100_000, 1_000_000, 5_000_000])
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.environ["CLUSTERFUN_CACHE_DIR"] = tmpdir
+        for n_points in args.points:
+            run(n_points)
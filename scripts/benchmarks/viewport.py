@@ -0,0 +1,74 @@
+"""Benchmark requesting a large scatter plot per viewport against sending all of its points.
+
+Usage: python scripts/benchmarks/viewport.py --rows 2000000 --repeats 5
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import orjson
+import pandas as pd
+
+from clusterfun.config import Config
+from clusterfun.models.viewport import Viewport
+from clusterfun.storage.local import loader as loader_module
+from clusterfun.storage.local.column_engine import ColumnEngineCache
+from clusterfun.storage.local.density import build_pyramid, get_plot_points
+from clusterfun.storage.local.loader import LocalLoader, get_viewport
+from clusterfun.storage.local.storer import LocalStorer
+
+
+def make_dataframe(rows: int) -> pd.DataFrame:
+    """Create a dataframe that looks like an embedding dump, with a few dense clusters."""
+    rng = np.random.default_rng(0)
+    centers = rng.uniform(-10, 10, size=(20, 2))
+    cluster = rng.integers(0, len(centers), size=rows)
+    return pd.DataFrame(
+        {
+            "img_path": [f"s3://bucket/images/{i}.jpg" for i in range(rows)],
+            "x": centers[cluster, 0] + rng.normal(size=rows),
+            "y": centers[cluster, 1] + rng.normal(size=rows),
+            "label": [f"class_{i}" for i in cluster],
+        }
+    )
+
+
+def run(rows: int, repeats: int):
+    cfg = Config(
+        "scatter", media="img_path", columns=["id", "img_path", "x", "y", "label"], x="x", y="y", color="label"
+    )
+    LocalStorer().save("benchmark", make_dataframe(rows), cfg)
+    # the points are queried from SQLite, without loading the columns into memory in the background
+    loader_module.ENGINES = ColumnEngineCache(0)
+    loader = LocalLoader("benchmark")
+    state = loader.state
+    print(f"rows: {rows:,}, repeats: {repeats}")
+    data = loader.load_data()
+    start = time.perf_counter()
+    build_pyramid(*get_plot_points(state.config, data))
+    print(f"building the pyramid: {(time.perf_counter() - start) * 1000:.0f}ms, {state.density.nbytes / 1e6:.1f}MB")
+    print(f"all points: {(loader.cache_dir / 'data.json').stat().st_size / 1e6:.1f}MB")
+    density = state.density
+    x_span, y_span = density.x_max - density.x_min, density.y_max - density.y_min
+    for zoom in [1, 8, 64, 512]:
+        x0, y0 = density.x_min + x_span * 0.4, density.y_min + y_span * 0.4
+        viewport = Viewport(x_range=(x0, x0 + x_span / zoom), y_range=(y0, y0 + y_span / zoom), width=1200, height=800)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            content = orjson.dumps(get_viewport(loader, viewport))  # pylint: disable=no-member
+        elapsed = (time.perf_counter() - start) / repeats
+        mode = orjson.loads(content)["mode"]  # pylint: disable=no-member
+        print(f"zoom {zoom}x: {mode}, {elapsed * 1000:.0f}ms, {len(content) / 1e6:.2f}MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark requesting a large scatter plot per viewport.")
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.environ["CLUSTERFUN_CACHE_DIR"] = tmpdir
+        run(args.rows, args.repeats)
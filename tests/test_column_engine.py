@@ -0,0 +1,117 @@
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+from clusterfun.config import Config
+from clusterfun.models.filter import Filter
+from clusterfun.models.media_indices import MediaIndices
+from clusterfun.storage.local import loader as loader_module
+from clusterfun.storage.local.column_engine import (
+    ENGINE_CACHE_BYTES,
+    ColumnEngine,
+    ColumnEngineCache,
+    estimate_nbytes,
+)
+from clusterfun.storage.local.loader import LocalLoader
+from clusterfun.storage.local.storer import LocalStorer
+
+FILTERS = [
+    [Filter(column="label", comparison="IN", values=["cat", "dog"])],
+    [Filter(column="label", comparison="NOT IN", values=["cat"]), Filter(column="score", comparison="!=", values=[3])],
+    [Filter(column="label", comparison=">", values=["cat"]), Filter(column="x", comparison="<=", values=["50"])],
+    [Filter(column="count", comparison="IN", values=[1, "2"]), Filter(column="score", comparison=">=", values=[2.5])],
+    [Filter(column="code", comparison="=", values=[7]), Filter(column="code", comparison="NOT IN", values=[1, 2])],
+    # invalid filters are skipped: unknown values and columns, and text compared to numbers
+    [Filter(column="label", comparison="=", values=["fish"]), Filter(column="missing", comparison="=", values=[1])],
+    [Filter(column="score", comparison="=", values=["cat"]), Filter(column="count", comparison="<", values=[2])],
+    # numbers that are not finite are bound as text, like other text compared to numbers
+    [Filter(column="score", comparison="<", values=["nan"]), Filter(column="count", comparison="!=", values=["inf"])],
+    [Filter(column="x", comparison=">=", values=["-inf"]), Filter(column="count", comparison="=", values=["nan"])],
+    [Filter(column="score", comparison="IN", values=["inf", 2])],
+    [],
+]
+
+
+@pytest.fixture()
+def loader(tmp_path, monkeypatch):
+    # load the columns when requested instead of in the background
+    monkeypatch.setattr(loader_module, "ENGINES", ColumnEngineCache(ENGINE_CACHE_BYTES))
+    df = pd.DataFrame()
+    df["img_path"] = [f"{i}.jpg" for i in range(200)]
+    df["x"] = [float(i) for i in range(200)]
+    df["y"] = [float(i % 10) for i in range(200)]
+    df["label"] = [None if i % 11 == 0 else ["cat", "dog", "bird"][i % 3] for i in range(200)]
+    df["score"] = [None if i % 10 == 0 else float(i % 7) for i in range(200)]
+    df["count"] = [i % 4 for i in range(200)]
+    # numbers stored as text
+    df["code"] = [str(i % 9) for i in range(200)]
+    cfg = Config(
+        "scatter",
+        media="img_path",
+        columns=["id", "img_path", "x", "y", "label", "score", "count", "code"],
+        x="x",
+        y="y",
+        color="label",
+    )
+    LocalStorer(tmp_path).save("test", df, cfg)
+    return LocalLoader("test", tmp_path)
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_engine_matches_sqlite(loader, monkeypatch, filters):
+    engine = loader_module.ENGINES.get(loader)
+    assert engine is not None and set(engine.columns) == {"x", "y", "label", "score", "count", "code"}
+    media_indices = MediaIndices(media_ids=list(range(0, 200, 2)), filters=filters)
+    in_memory = loader.filter(filters), loader.get_filtered_ids(filters).tolist()
+    counts = {column: loader.get_value_counts(column, media_indices) for column in ["label", "score", "count"]}
+
+    # no columns fit in the budget, so requests are answered by SQLite
+    monkeypatch.setattr(loader_module, "ENGINES", ColumnEngineCache(0))
+    assert (loader.filter(filters), sorted(loader.get_filtered_ids(filters).tolist())) == in_memory
+    assert {column: loader.get_value_counts(column, media_indices) for column in counts} == counts
+
+
+def test_engine_is_loaded_within_the_memory_budget(loader, monkeypatch):
+    state = loader.state
+    nbytes = estimate_nbytes(list(state.column_stats.values()), exclude=[state.config.media])
+    assert nbytes < ENGINE_CACHE_BYTES
+    assert loader_module.ENGINES.get(loader) is loader_module.ENGINES.get(loader)
+    # too large for the budget, so requests are answered by SQLite
+    monkeypatch.setattr(loader_module, "ENGINES", ColumnEngineCache(nbytes - 1))
+    assert loader_module.ENGINES.get(loader) is None
+    assert len(loader.get_filtered_ids([Filter(column="label", comparison="=", values=["cat"])])) == 60
+
+
+def test_engine_is_loaded_in_the_background(loader, monkeypatch):
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        monkeypatch.setattr(loader_module, "ENGINES", ColumnEngineCache(ENGINE_CACHE_BYTES, executor=executor))
+        # the first request is answered by SQLite while the columns are loaded
+        assert loader_module.ENGINES.get(loader) is None
+        assert len(loader.get_filtered_ids([Filter(column="label", comparison="=", values=["cat"])])) == 60
+    assert loader_module.ENGINES.get(loader) is not None
+
+
+def test_failed_loads_are_not_retried_until_the_data_changes(loader, monkeypatch):
+    calls = []
+
+    def fail(*args, **kwargs):
+        calls.append(args)
+        raise sqlite3.OperationalError("disk I/O error")
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        monkeypatch.setattr(loader_module, "ENGINES", ColumnEngineCache(ENGINE_CACHE_BYTES, executor=executor))
+        with monkeypatch.context() as patch:
+            patch.setattr(ColumnEngine, "from_sqlite", fail)
+            assert loader_module.ENGINES.get(loader) is None
+            executor.submit(lambda: None).result()
+            # the failure is remembered, so the columns are not loaded again
+            assert loader_module.ENGINES.get(loader) is None
+            executor.submit(lambda: None).result()
+            assert len(calls) == 1
+        # appending rows changes the data, which is loaded again
+        row = {"img_path": "new.jpg", "x": 1.0, "y": 1.0, "label": "cat", "score": 1.0, "count": 1, "code": "1"}
+        LocalStorer(loader.cache_dir.parent).append(loader.uuid, pd.DataFrame([row]))
+        assert loader_module.ENGINES.get(loader) is None
+    assert loader_module.ENGINES.get(loader) is not None and len(loader_module.ENGINES.get(loader).ids) == 201
@@ -0,0 +1,438 @@
+import asyncio
+import gzip
+import io
+import json
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from fastapi.testclient import TestClient
+
+from clusterfun.config import Config
+from clusterfun.executors import DB_EXECUTOR, MEDIA_EXECUTOR, iterate_in, run_in
+from clusterfun.main import APP
+from clusterfun.models.media_indices import MediaIndices
+from clusterfun.plot import Plot
+from clusterfun.plot_types.scatter import scatter
+from clusterfun.storage import get_loader, get_storer
+from clusterfun.storage.local import column_stats, masks, spatial
+from clusterfun.storage.local.column_engine import ENGINE_CACHE_BYTES, ColumnEngineCache
+from clusterfun.storage.local.compression import GZIP_FILE, get_encoding
+from clusterfun.storage.local.exports import stream_export
+from clusterfun.storage.local.helpers import get_media_query
+from clusterfun.storage.local.loader import LocalLoader, get_column_stats, stream_view
+from clusterfun.storage.local.selections import SELECTIONS
+from clusterfun.storage.parquet import storer as parquet_storer
+
+
+def test_it_sends_the_view_precompressed(cache_dir):
+    df = pd.read_csv(Path(__file__).parent / "samples" / "wiki-art.csv")
+    view_dir = scatter(df, x="x", y="y", media="img_path", color="style", show=False)
+    assert (view_dir / GZIP_FILE).exists()
+    loader = LocalLoader(view_dir.name)
+    assert get_encoding("gzip;q=0, identity", loader.cache_dir) is None
+    assert get_encoding("gzip, deflate, br", loader.cache_dir) == "gzip"
+    payload = b"".join(stream_view(loader, chunk_size=1000))
+    assert gzip.decompress(b"".join(stream_view(loader, encoding="gzip", chunk_size=1000))) == payload
+
+    client = TestClient(APP)
+    response = client.get(f"/api/views/{view_dir.name}", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.json() == json.loads(json.dumps(Plot.load(view_dir.name).as_json()))
+    response = client.get(f"/api/views/{view_dir.name}", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+    assert response.content == payload
+
+    response = client.post(f"/api/views/{view_dir.name}/filter", json=[], headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.json() == Plot.load(view_dir.name).data
+
+
+def test_it_lists_the_views(cache_dir):
+    df = pd.read_csv(Path(__file__).parent / "samples" / "wiki-art.csv")
+    first = scatter(df, x="x", y="y", media="img_path", show=False)
+    second = scatter(df.iloc[:10], x="x", y="y", media="img_path", show=False)
+    client = TestClient(APP)
+    views = client.get("/api/views").json()
+    assert [(view["uuid"], view["rows"]) for view in views] == [(second.name, 10), (first.name, len(df))]
+    assert client.get("/api/uuid").json() == second.name
+
+
+def test_it_runs_blocking_work_in_the_executors(cache_dir, monkeypatch):
+    assert asyncio.run(run_in(DB_EXECUTOR, lambda: threading.current_thread().name)).startswith("clusterfun-db")
+
+    async def collect():
+        return [chunk async for chunk in iterate_in(MEDIA_EXECUTOR, iter([b"a", b"b"]))]
+
+    assert asyncio.run(collect()) == [b"a", b"b"]
+
+    # an export stopped early, e.g. when the client disconnects, closes its batches
+    closed = []
+
+    def batches():
+        try:
+            yield from pa.table({"a": range(20)}).to_batches(max_chunksize=5)
+        finally:
+            closed.append(True)
+
+    async def take_first():
+        chunks = iterate_in(DB_EXECUTOR, stream_export(pa.schema([("a", pa.int64())]), batches(), "csv"))
+        first = await chunks.__anext__()
+        await chunks.aclose()
+        return first
+
+    assert asyncio.run(take_first()) == b"a\n0\n1\n2\n3\n4\n"
+    assert closed == [True]
+
+    df = pd.DataFrame({"img_path": [f"https://example.com/{i}.jpg" for i in range(10)], "x": range(10), "y": range(10)})
+    view_dir = scatter(df, x="x", y="y", media="img_path", show=False)
+    client = TestClient(APP)
+    assert (
+        client.post(
+            f"/api/views/{view_dir.name}/label", json={"label": {"title": "good"}, "media_indices": {"media_ids": [3]}}
+        ).json()
+        == "OK"
+    )
+    # the state of the view is read in the database executor, the media executor only loads the media
+    state_threads = []
+    state = LocalLoader.state
+
+    def record_state_thread(loader):
+        state_threads.append(threading.current_thread().name)
+        return state.fget(loader)
+
+    monkeypatch.setattr(LocalLoader, "state", property(record_state_thread))
+    items = client.post(f"/api/views/{view_dir.name}/media", json={"media_ids": [1, 2, 3]}).json()
+    assert [item["index"] for item in items] == [1, 2, 3]
+    assert [item["labels"] for item in items] == [None, None, ["good"]]
+    assert client.get(f"/api/views/{view_dir.name}/media/3").json()["src"] == items[2]["src"]
+    assert len(state_threads) > 0 and all(name.startswith("clusterfun-db") for name in state_threads)
+
+
+def test_it_pages_a_registered_selection(cache_dir):
+    df = pd.DataFrame(
+        {"img_path": [f"https://example.com/{i}.jpg" for i in range(200)], "x": range(200), "y": range(200)}
+    )
+    view_dir = scatter(df, x="x", y="y", media="img_path", show=False)
+    client = TestClient(APP)
+    selection = client.post(f"/api/views/{view_dir.name}/selections", json={"media_ids": list(range(120, -1, -1))})
+    assert selection.json()["size"] == 121
+    token = selection.json()["selection"]
+    filtered = client.post(
+        f"/api/views/{view_dir.name}/selections",
+        json={"filters": [{"column": "x", "comparison": "<=", "values": [120]}]},
+    ).json()
+    assert filtered == {"selection": token, "size": 121}
+
+    page = {"selection": token, "page": 2, "sort_column": "x", "ascending": False}
+    items = client.post(f"/api/views/{view_dir.name}/media", json=page).json()
+    assert [item["index"] for item in items] == list(range(20, -1, -1))
+    assert len(client.post(f"/api/views/{view_dir.name}/media-metadata", json={"selection": token}).json()) == 121
+
+    label = {"label": {"title": "low"}, "media_indices": {"selection": token}}
+    client.post(f"/api/views/{view_dir.name}/label", json=label)
+    counts = client.post(f"/api/views/{view_dir.name}/labels-count", json={"selection": token}).json()
+    assert counts[0]["label"] == "low" and counts[0]["inCurrentSelection"] == 121
+
+    assert client.delete(f"/api/views/{view_dir.name}/selections/{token}").json()
+    assert client.post(f"/api/views/{view_dir.name}/media", json=page).status_code == 404
+
+
+def test_it_pages_with_a_cursor(cache_dir):
+    df = pd.DataFrame(
+        {
+            "img_path": [f"https://example.com/{i}.jpg" for i in range(100)],
+            "x": range(100),
+            "y": range(100),
+            "score": [None if i % 10 == 0 else float(i % 7) for i in range(100)],
+        }
+    )
+    view_dir = scatter(df, x="x", y="y", media="img_path", show=False)
+    client = TestClient(APP)
+    for ascending in [True, False]:
+        media_indices = {"media_ids": list(range(100)), "sort_column": "score", "ascending": ascending, "page_size": 30}
+        offset_pages = [
+            client.post(f"/api/views/{view_dir.name}/media", json={**media_indices, "page": page}).json()
+            for page in range(4)
+        ]
+        cursor_pages, cursor = [], None
+        while True:
+            response = client.post(f"/api/views/{view_dir.name}/media", json={**media_indices, "cursor": cursor})
+            cursor_pages.append(response.json())
+            cursor = response.headers.get("x-next-cursor")
+            if cursor is None:
+                break
+        assert [len(page) for page in cursor_pages] == [30, 30, 30, 10]
+        assert cursor_pages == offset_pages
+        indices = [item["index"] for page in cursor_pages for item in page]
+        expected = df.sort_values(["score"], ascending=ascending, na_position="first" if ascending else "last")
+        assert sorted(indices) == list(range(100))
+        assert [df["score"].fillna(-1)[i] for i in indices] == expected["score"].fillna(-1).tolist()
+
+    response = client.post(f"/api/views/{view_dir.name}/media", json={"media_ids": [1, 2], "cursor": "not a cursor"})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("save_method", ["local", "parquet"])
+def test_it_answers_column_requests_from_the_column_stats(cache_dir, monkeypatch, save_method):
+    # fewer than the number of media, so the media counts are incomplete
+    monkeypatch.setattr(column_stats, "STATS_TOP_K", 50)
+    monkeypatch.setattr(parquet_storer, "STATS_TOP_K", 50)
+    df = pd.DataFrame(
+        {
+            "img_path": [f"https://example.com/{i}.jpg" for i in range(100)],
+            "x": [float(i) for i in range(100)],
+            "y": [float(i % 10) for i in range(100)],
+            "label": [None if i % 9 == 0 else ["cat", "dog", "bird"][i % 3] for i in range(100)],
+            "score": [None if i % 10 == 0 else float(i % 7) for i in range(100)],
+        }
+    )
+    cfg = Config("scatter", media="img_path", columns=["id", *df.columns], x="x", y="y", save_method=save_method)
+    get_storer(save_method).save("view", df, cfg)
+    loader = get_loader("view")
+    stats = get_column_stats(loader.state, "label")
+    assert (stats.count, stats.null_count, stats.distinct_count) == (100, 12, 3)
+    assert (stats.min, stats.max) == ("bird", "dog")
+    assert stats.is_complete and not get_column_stats(loader.state, "img_path").is_complete
+
+    client = TestClient(APP)
+    columns = client.get("/api/views/view/columns").json()
+    full_df = loader.get_dataframe()
+    assert columns == [{"name": column, "dtype": str(dtype)} for column, dtype in full_df.dtypes.items()]
+
+    def count_values(values: pd.Series):
+        value_counts = values.value_counts(dropna=False)
+        counts = sorted(value_counts.items(), key=lambda item: (-item[1], not pd.isna(item[0]), item[0]))
+        return [{"label": str(value), "count": count} for value, count in counts]
+
+    response = client.post("/api/views/view/columns/label/values", json={})
+    assert response.json() == count_values(full_df["label"])
+    selection = {"media_ids": list(range(50)), "filters": [{"column": "x", "comparison": ">", "values": [20]}]}
+    response = client.post("/api/views/view/columns/score/values", json=selection)
+    assert response.json() == count_values(full_df["score"].iloc[21:50])
+    response = client.post("/api/views/view/columns/img_path/values", json={})
+    assert len(response.json()) == 100
+    assert client.post("/api/views/view/columns/missing/values", json={}).status_code == 404
+
+
+def test_it_caches_filter_results(cache_dir):
+    df = pd.DataFrame(
+        {
+            "img_path": [f"https://example.com/{i}.jpg" for i in range(100)],
+            "x": [float(i) for i in range(100)],
+            "y": [float(i % 10) for i in range(100)],
+            "label": [["cat", "dog", "bird"][i % 3] for i in range(100)],
+        }
+    )
+    view_dir = scatter(df, x="x", y="y", media="img_path", color="label", show=False)
+    client = TestClient(APP)
+    url = f"/api/views/{view_dir.name}/filter"
+    filters = [
+        {"column": "label", "comparison": "IN", "values": ["cat", "dog"]},
+        {"column": "x", "comparison": "<", "values": [50]},
+    ]
+    before = client.get("/api/cache-stats").json()["filters"]
+    response = client.post(url, json=filters)
+    assert sum(len(trace["id"]) for trace in response.json()) == 34
+    # the same filters in a different order and with the values as strings
+    reordered = [{"column": "x", "comparison": "<", "values": ["50"]}, {**filters[0], "values": ["dog", "cat"]}]
+    assert client.post(url, json=reordered).content == response.content
+    client.post(
+        f"/api/views/{view_dir.name}/label",
+        json={"label": {"title": "checked"}, "media_indices": {"media_ids": [1, 2]}},
+    )
+    assert client.post(url, json=filters).content == response.content
+    stats = client.get("/api/cache-stats").json()["filters"]
+    assert (stats["hits"] - before["hits"], stats["misses"] - before["misses"]) == (2, 1)
+
+    get_storer("local").append(view_dir.name, df.iloc[:10].assign(x=0.0))
+    assert sum(len(trace["id"]) for trace in client.post(url, json=filters).json()) == 41
+
+
+def test_it_sends_filter_results_as_id_masks(cache_dir):
+    df = pd.DataFrame(
+        {
+            "img_path": [f"https://example.com/{i}.jpg" for i in range(1000)],
+            "x": [float(i) for i in range(1000)],
+            "y": [float(i % 10) for i in range(1000)],
+            "label": [["cat", "dog", "bird"][i % 3] for i in range(1000)],
+        }
+    )
+    view_dir = scatter(df, x="x", y="y", media="img_path", color="label", show=False)
+    client = TestClient(APP)
+    url = f"/api/views/{view_dir.name}/filter"
+    for filters, encoding in [
+        # scattered ids are sent as a bitset, consecutive ids as ranges
+        ([{"column": "label", "comparison": "IN", "values": ["cat", "dog"]}], masks.BITSET),
+        (
+            [{"column": "x", "comparison": ">=", "values": [100]}, {"column": "x", "comparison": "<", "values": [300]}],
+            masks.RANGES,
+        ),
+        ([{"column": "x", "comparison": "<", "values": [0]}], masks.RANGES),
+    ]:
+        response = client.post(f"{url}/mask", json=filters)
+        assert response.headers["content-type"] == "application/octet-stream"
+        assert masks.HEADER.unpack_from(response.content, 4)[1:3] == (encoding, 1000)
+        expected = sorted(i for trace in client.post(url, json=filters).json() for i in trace["id"])
+        assert masks.decode_mask(response.content).tolist() == expected
+        assert len(response.content) <= 4 + masks.HEADER.size + 125
+
+
+@pytest.mark.parametrize("save_method", ["local", "parquet"])
+def test_it_sends_points_or_density_bins_per_viewport(cache_dir, save_method):
+    df = pd.DataFrame(
+        {
+            "img_path": [f"https://example.com/{i}.jpg" for i in range(10_000)],
+            "x": [float(i % 100) for i in range(10_000)],
+            "y": [float(i // 100) for i in range(10_000)],
+            "label": [["cat", "dog", "bird"][i % 3] for i in range(10_000)],
+        }
+    )
+    cfg = Config(
+        "scatter", media="img_path", columns=["id", *df.columns], x="x", y="y", color="label", save_method=save_method
+    )
+    get_storer(save_method).save("view", df, cfg)
+    density = get_loader("view").state.density
+    assert [level.size for level in density.levels] == [2**level for level in range(11)]
+    assert all(level.counts.sum() == 10_000 for level in density.levels)
+
+    client = TestClient(APP)
+    viewport = {"x_range": [0, 99], "y_range": [0, 99], "width": 400, "height": 200, "max_points": 500}
+    bins = client.post("/api/views/view/viewport", json=viewport).json()
+    assert bins["mode"] == "bins" and sum(bins["count"]) == 10_000
+    # bins of at least 4 by 4 pixels: 32 bins of 200 / 32 pixels high, as 64 bins would be less than 4 pixels high
+    assert bins["level"] == 5
+    for x, y, media_id in zip(bins["x"], bins["y"], bins["id"]):
+        assert abs(df["x"][media_id] - x) <= bins["bin_width"] / 2
+        assert abs(df["y"][media_id] - y) <= bins["bin_height"] / 2
+
+    zoomed = client.post("/api/views/view/viewport", json={**viewport, "x_range": [19.5, 10], "y_range": [10, 14.5]})
+    points = zoomed.json()
+    assert points["mode"] == "points" and [trace["name"] for trace in points["data"]] == ["cat", "dog", "bird"]
+    ids = sorted(media_id for trace in points["data"] for media_id in trace["id"])
+    assert ids == [y * 100 + x for y in range(10, 15) for x in range(10, 20)]
+    for x_range in [[0, "NaN"], [0, "inf"]]:
+        assert client.post("/api/views/view/viewport", json={**viewport, "x_range": x_range}).status_code == 422
+
+    get_storer(save_method).save("grid", df, Config("grid", media="img_path", columns=["id", *df.columns]))
+    assert client.post("/api/views/grid/viewport", json=viewport).status_code == 404
+
+
+@pytest.mark.parametrize("save_method", ["local", "memory", "parquet"])
+def test_it_selects_the_points_in_a_box_or_lasso(cache_dir, monkeypatch, save_method):
+    if save_method == "memory":
+        # load the columns when requested instead of in the background
+        monkeypatch.setattr("clusterfun.storage.local.loader.ENGINES", ColumnEngineCache(ENGINE_CACHE_BYTES))
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {
+            "img_path": [f"https://example.com/{i}.jpg" for i in range(2000)],
+            "x": rng.uniform(-1, 1, size=2000),
+            "y": rng.uniform(-1, 1, size=2000),
+            "label": [["cat", "dog"][i % 2] for i in range(2000)],
+        }
+    )
+    df.loc[::50, "y"] = None
+    cfg = Config(
+        "scatter",
+        media="img_path",
+        columns=["id", *df.columns],
+        x="x",
+        y="y",
+        save_method="local" if save_method == "memory" else save_method,
+    )
+    get_storer(cfg.save_method).save("view", df, cfg)
+    client = TestClient(APP)
+    triangle = [[-0.5, -0.5], [0.5, -0.5], [0, 0.5]]
+    in_triangle = (df["y"] >= -0.5) & (df["y"] <= 0.5 - 2 * df["x"]) & (df["y"] <= 0.5 + 2 * df["x"])
+    in_box = df["x"].between(0, 0.5) & df["y"].between(-0.25, 0.25)
+    for request, expected in [
+        ({"region": {"x_range": [0.5, 0], "y_range": [-0.25, 0.25]}}, in_box),
+        ({"region": {"polygon": triangle}}, in_triangle),
+        ({"region": {"polygon": triangle, "x_range": [0, 1]}}, in_triangle & (df["x"] >= 0)),
+        (
+            {"region": {"polygon": triangle}, "filters": [{"column": "label", "comparison": "=", "values": ["cat"]}]},
+            in_triangle & (df["label"] == "cat"),
+        ),
+        ({"region": {"y_range": [0.9, 1]}, "media_ids": list(range(100))}, df["y"].between(0.9, 1) & (df.index < 100)),
+    ]:
+        response = client.post("/api/views/view/selections", json=request).json()
+        assert response["size"] == expected.sum()
+        ids = SELECTIONS.get(get_loader("view").cache_dir, response["selection"]).ids
+        assert ids.tolist() == np.flatnonzero(expected).tolist()
+    assert client.post("/api/views/view/selections", json={"region": {"polygon": triangle[:2]}}).status_code == 422
+    for region in [
+        {"x_range": ["nan", 5.0]},
+        {"y_range": [0, "inf"]},
+        {"polygon": [*triangle[:2], ["nan", 0]]},
+    ]:
+        assert client.post("/api/views/view/selections", json={"region": region}).status_code == 422
+    if save_method != "memory":
+        box = {"region": {"x_range": [0, 0.5], "y_range": [-0.25, 0.25]}}
+        get_storer(save_method).append("view", df.iloc[:1].assign(x=0.25, y=0.0))
+        assert client.post("/api/views/view/selections", json=box).json()["size"] == in_box.sum() + 1
+        # views stored before the spatial index are queried without it
+        (get_loader("view").cache_dir / spatial.SPATIAL_FILE).unlink()
+        assert client.post("/api/views/view/selections", json=box).json()["size"] == in_box.sum() + 1
+
+
+@pytest.mark.parametrize("save_method", ["local", "parquet"])
+def test_it_streams_the_exports(cache_dir, save_method):
+    df = pd.read_csv(Path(__file__).parent / "samples" / "wiki-art.csv")
+    df.loc[::3, "style"] = None
+    # pandas reads integers with missing values as floats, which the CSV export writes like pandas does
+    df["rank"] = pd.array([None if i % 7 == 0 else i for i in range(len(df))], dtype="Int64")
+    cfg = Config("grid", media="img_path", columns=["id", *df.columns], save_method=save_method)
+    get_storer(save_method).save("view", df, cfg)
+    client = TestClient(APP)
+    media_ids = list(range(0, 200, 2))
+    expected = get_loader("view").get_dataframe(MediaIndices(media_ids=media_ids))
+
+    response = client.post("/api/views/view/download-grid", json={"media_ids": media_ids})
+    assert response.headers["content-disposition"] == "attachment; filename=data.csv"
+    assert response.text == expected.to_csv(index=False)
+    for export_format, read in [
+        ("parquet", lambda content: pq.read_table(pa.BufferReader(content))),
+        ("arrow", lambda content: pa.ipc.open_stream(content).read_all()),
+    ]:
+        response = client.post(f"/api/views/view/download-grid?format={export_format}", json={"media_ids": media_ids})
+        assert response.headers["content-disposition"] == f"attachment; filename=data.{export_format}"
+        pd.testing.assert_frame_equal(read(response.content).to_pandas(), expected, check_dtype=False)
+    assert client.post("/api/views/view/download-grid?format=xlsx", json={"media_ids": media_ids}).status_code == 422
+
+    # every batch is written before the next one is read
+    sort = {"media_ids": media_ids, "sort_column": "style", "ascending": False}
+    schema, batches = get_loader("view").get_export_batches(MediaIndices(**sort), batch_size=7)
+    chunks = list(stream_export(schema, batches, "arrow"))
+    assert len(chunks) == 1 + len(media_ids) // 7 + 1
+    table = pa.ipc.open_stream(b"".join(chunks)).read_all()
+    assert table.column("id").to_pylist() == get_loader("view").get_dataframe(MediaIndices(**sort))["id"].tolist()
+
+    client.post("/api/views/view/label", json={"media_indices": {"media_ids": [2, 4, 6]}, "label": {"title": "cat"}})
+    client.post("/api/views/view/label", json={"media_indices": {"media_ids": [4, 7]}, "label": {"title": "dog"}})
+    response = client.post(
+        "/api/views/view/label-download", json={"media_indices": {"media_ids": [2, 4, 7]}, "label": {"title": "cat"}}
+    )
+    assert response.headers["content-disposition"] == "attachment; filename=view_labels.csv"
+    labeled = pd.read_csv(io.StringIO(response.text))
+    assert labeled.columns.tolist()[:4] == ["media_id", "cat", "dog", "id"]
+    assert labeled[["media_id", "cat", "dog"]].values.tolist() == [[2, 1, 0], [4, 1, 1]]
+    response = client.post(
+        "/api/views/view/label-download?format=parquet",
+        json={"media_indices": {"media_ids": []}, "label": {"title": ""}},
+    )
+    labeled = pq.read_table(pa.BufferReader(response.content)).to_pandas()
+    assert labeled[["media_id", "cat", "dog"]].values.tolist() == [[2, 1, 0], [4, 1, 1], [6, 1, 0], [7, 0, 1]]
+    assert labeled["img_path"].tolist() == df["img_path"].iloc[[2, 4, 6, 7]].tolist()
+
+    # the labeled media are exported by id, not in the order they were labeled
+    assert get_media_query(MediaIndices(media_ids=[7, 1]), paginate=False).sql.endswith(" ORDER BY id")
+    client.post("/api/views/view/label", json={"media_indices": {"media_ids": [1]}, "label": {"title": "cat"}})
+    response = client.post(
+        "/api/views/view/label-download", json={"media_indices": {"media_ids": []}, "label": {"title": ""}}
+    )
+    assert pd.read_csv(io.StringIO(response.text))["media_id"].tolist() == [1, 2, 4, 6, 7]
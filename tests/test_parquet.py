@@ -0,0 +1,175 @@
+import itertools
+
+import pandas as pd
+import pytest
+
+from clusterfun.config import Config
+from clusterfun.models.filter import Filter
+from clusterfun.models.media_indices import MediaIndices
+from clusterfun.models.selection import SelectionRequest
+from clusterfun.storage import get_loader, get_storer
+from clusterfun.storage.local.exports import stream_export
+from clusterfun.storage.local.helpers import get_filter_query
+from clusterfun.storage.local.loader import LocalLoader, fetch_page, select
+from clusterfun.storage.parquet.loader import ParquetLoader
+from clusterfun.validation import ColumnNotFoundException
+
+
+def get_df() -> pd.DataFrame:
+    df = pd.DataFrame()
+    df["img_path"] = [f"https://picsum.photos/{i}" for i in range(100)]
+    df["x"] = [float(i) for i in range(100)]
+    df["y"] = [float(i % 10) for i in range(100)]
+    df["color"] = [["cat", "dog", "bird"][i % 3] for i in range(100)]
+    return df
+
+
+def get_cfg(save_method: str) -> Config:
+    return Config(
+        type="scatter",
+        media="img_path",
+        columns=["id", "img_path", "x", "y", "color"],
+        x="x",
+        y="y",
+        color="color",
+        save_method=save_method,
+    )
+
+
+def test_parquet_loader_matches_local_loader(cache_dir):
+    get_storer("local").save("local", get_df(), get_cfg("local"))
+    get_storer("parquet").save("parquet", get_df(), get_cfg("parquet"))
+    local_loader = get_loader("local")
+    parquet_loader = get_loader("parquet")
+    assert type(local_loader) is LocalLoader
+    assert isinstance(parquet_loader, ParquetLoader)
+
+    assert local_loader.load_data() == parquet_loader.load_data()
+
+    filters = [
+        Filter(column="color", comparison="IN", values=["cat", "dog"]),
+        Filter(column="x", comparison=">", values=[50]),
+    ]
+    assert local_loader.filter(filters) == parquet_loader.filter(filters)
+
+    media_indices = MediaIndices(media_ids=list(range(80)), page=1, sort_column="y", ascending=False)
+    assert [item.index for item in local_loader.get_rows(media_indices)] == [
+        item.index for item in parquet_loader.get_rows(media_indices)
+    ]
+    assert local_loader.get_row(3) == parquet_loader.get_row(3)
+
+    selection = select(local_loader, SelectionRequest(media_ids=list(range(80)), filters=filters[:1]))
+    assert (
+        select(parquet_loader, SelectionRequest(media_ids=list(range(80)), filters=filters[:1])).token
+        == selection.token
+    )
+    assert len(selection) == 54
+    media_indices = MediaIndices(selection=selection.token, page=1, sort_column="x", ascending=False)
+    assert [row[0] for row in local_loader.fetch_rows(media_indices)] == [
+        row[0] for row in parquet_loader.fetch_rows(media_indices)
+    ]
+    pd.testing.assert_frame_equal(local_loader.get_dataframe(), parquet_loader.get_dataframe())
+
+    # a selection that fits on one page has no rows past its first page
+    small_selection = select(local_loader, SelectionRequest(media_ids=list(range(5))))
+    select(parquet_loader, SelectionRequest(media_ids=list(range(5))))
+    for loader in [local_loader, parquet_loader]:
+        assert [row[0] for row in loader.fetch_rows(MediaIndices(selection=small_selection.token))] == list(range(5))
+        with pytest.raises(ValueError):
+            loader.fetch_rows(MediaIndices(selection=small_selection.token, page=1))
+
+    pages = {}
+    for loader in [local_loader, parquet_loader]:
+        media_indices = MediaIndices(media_ids=list(range(80)), sort_column="y", ascending=False, page_size=7)
+        pages[loader.uuid] = []
+        while True:
+            rows, cursor = fetch_page(loader, media_indices)
+            pages[loader.uuid].append([row[0] for row in rows])
+            if cursor is None:
+                break
+            media_indices = media_indices.model_copy(update={"cursor": cursor})
+    assert pages["local"] == pages["parquet"]
+    assert sorted(itertools.chain.from_iterable(pages["local"])) == list(range(80))
+
+
+def test_parquet_loader_pages_by_timestamps(cache_dir):
+    df = get_df()
+    df["time"] = pd.Timestamp("2020-01-02") + pd.to_timedelta([i % 7 for i in range(100)], unit="ns")
+    cfg = get_cfg("parquet")
+    cfg.columns.append("time")
+    get_storer("parquet").save("parquet", df, cfg)
+    loader = get_loader("parquet")
+    media_indices = MediaIndices(media_ids=list(range(100)), sort_column="time", ascending=True, page_size=30)
+    pages = []
+    while True:
+        rows, cursor = fetch_page(loader, media_indices)
+        pages.append([row[0] for row in rows])
+        if cursor is None:
+            break
+        media_indices = media_indices.model_copy(update={"cursor": cursor})
+    assert [len(page) for page in pages] == [30, 30, 30, 10]
+    assert list(itertools.chain.from_iterable(pages)) == df.sort_values(["time"], kind="stable").index.tolist()
+
+
+def test_parquet_loader_exports_timestamps_like_pandas(cache_dir):
+    df = get_df()
+    df["date"] = pd.Timestamp("2020-01-02") + pd.to_timedelta(range(100), unit="D")
+    df["time"] = df["date"] + pd.to_timedelta(range(100), unit="ms")
+    df["zoned"] = df["date"].dt.tz_localize("Europe/Amsterdam")
+    df.loc[::4, ["date", "time", "zoned"]] = pd.NaT
+    cfg = get_cfg("parquet")
+    cfg.columns.extend(["date", "time", "zoned"])
+    get_storer("parquet").save("parquet", df, cfg)
+    loader = get_loader("parquet")
+    for media_indices in [
+        MediaIndices(media_ids=list(range(0, 100, 3))),
+        MediaIndices(media_ids=list(range(0, 100, 3)), sort_column="time", ascending=False),
+    ]:
+        schema, batches = loader.get_export_batches(media_indices, batch_size=7, export_format="csv")
+        csv = b"".join(stream_export(schema, batches, "csv")).decode("utf-8")
+        assert csv == loader.get_dataframe(media_indices).to_csv(index=False)
+        assert "2020-01-05,2020-01-05 00:00:00.003,2020-01-05 00:00:00+01:00" in csv
+
+
+def test_parquet_storer_appends_rows(cache_dir):
+    df = get_df()
+    get_storer("parquet").save("full", df, get_cfg("parquet"))
+    get_storer("parquet").save("appended", df.iloc[:40], get_cfg("parquet"))
+    get_storer("parquet").append("appended", df.iloc[40:])
+    assert get_loader("appended").load_data() == get_loader("full").load_data()
+    pd.testing.assert_frame_equal(get_loader("appended").get_dataframe(), get_loader("full").get_dataframe())
+
+
+def test_filters_bind_their_values(cache_dir):
+    df = get_df()
+    df["color"] = [["cat's", "dog", 'the "bird"'][i % 3] for i in range(100)]
+    get_storer("local").save("local", df, get_cfg("local"))
+    get_storer("parquet").save("parquet", df, get_cfg("parquet"))
+    filters = [
+        Filter(column="missing", comparison="=", values=[1]),
+        Filter(column="color", comparison="IN", values=["cat's", 'the "bird"']),
+        Filter(column="x", comparison="<", values=["50"]),
+    ]
+    query = get_filter_query(LocalLoader("local").connection, get_cfg("local"), filters)
+    assert query.sql == '"color" IN (SELECT value FROM json_each(?)) AND "x" < ?'
+    assert query.params == ('["cat\'s", "the \\"bird\\""]', 50)
+    data = get_loader("local").filter(filters)
+    assert data == get_loader("parquet").filter(filters)
+    assert sum(len(trace["id"]) for trace in data) == 33
+
+
+def test_parquet_storer_widens_columns_without_values(cache_dir):
+    df = get_df()
+    df["note"] = [None] * 50 + [f"note {i}" for i in range(50)]
+    cfg = Config("scatter", media="img_path", columns=["id", *df.columns], x="x", y="y", save_method="parquet")
+    get_storer("parquet").save_chunks("chunks", (df.iloc[i : i + 20] for i in range(0, 100, 20)), cfg)
+    assert get_loader("chunks").get_dataframe()["note"].tolist() == df["note"].tolist()
+
+    appended = df.iloc[:10].assign(extra=None)
+    cfg = Config("scatter", media="img_path", columns=["id", *appended.columns], x="x", y="y", save_method="parquet")
+    get_storer("parquet").save("appended", appended, cfg)
+    get_storer("parquet").append("appended", df.iloc[10:20].assign(extra="value"))
+    assert get_loader("appended").get_dataframe()["extra"].tolist() == [None] * 10 + ["value"] * 10
+
+    with pytest.raises(ColumnNotFoundException):
+        get_storer("parquet").save_chunks("missing", [df.iloc[:50], df.iloc[50:].drop(columns=["note"])], cfg)
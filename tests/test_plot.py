@@ -8,9 +8,12 @@ import pytest
 
 from clusterfun import violin
 from clusterfun.constants import COLORS
+from clusterfun.plot import Plot
 from clusterfun.plot_types.grid import grid
 from clusterfun.plot_types.histogram import histogram
 from clusterfun.plot_types.scatter import scatter
+from clusterfun.storage.local.label_manager import LabelManager
+from clusterfun.storage.local.loader import LocalLoader, stream_view
 from clusterfun.validation import ColumnNotFoundException, EmptyDataFrameException
 
 
@@ -133,3 +136,34 @@ def test_it_cannot_plot_an_empty_dataframe(cache_dir):
     df["media"] = []
     with pytest.raises(EmptyDataFrameException):
         scatter(df, x="x", y="y", media="media", show=False)
+
+
+def test_it_creates_a_scatter_from_chunks(cache_dir):
+    path = Path(__file__).parent / "samples" / "wiki-art.csv"
+    expected_dir = scatter(pd.read_csv(path), x="x", y="y", media="img_path", color="style", show=False)
+    cache_dir = scatter(pd.read_csv(path, chunksize=100), x="x", y="y", media="img_path", color="style", show=False)
+    with open(cache_dir / "data.json") as f, open(expected_dir / "data.json") as f_expected:
+        assert json.load(f) == json.load(f_expected)
+    cache_dir = grid(str(path), media="img_path", show=False)
+    assert (cache_dir / "database.db").exists()
+
+
+def test_it_appends_rows_to_a_scatter(cache_dir):
+    df = pd.read_csv(Path(__file__).parent / "samples" / "wiki-art.csv")
+    expected_dir = scatter(df, x="x", y="y", media="img_path", color="style", show=False)
+    cache_dir = scatter(df.iloc[:1000], x="x", y="y", media="img_path", color="style", show=False)
+    LabelManager(cache_dir).save_label("first", [0])
+    plot = Plot.append(cache_dir.name, df.iloc[1000:])
+    with open(cache_dir / "data.json") as f, open(expected_dir / "data.json") as f_expected:
+        assert json.load(f) == json.load(f_expected)
+    assert plot.cfg.labels == ["first"]
+    row = LocalLoader(cache_dir.name).fetch_row(len(df) - 1)
+    assert list(row[2:]) == df.iloc[-1][["x", "y", "painting", "style", "brightness"]].tolist()
+
+
+def test_it_streams_the_view_payload(cache_dir):
+    df = pd.read_csv(Path(__file__).parent / "samples" / "wiki-art.csv")
+    cache_dir = scatter(df, x="x", y="y", media="img_path", color="style", show=False)
+    LabelManager(cache_dir).save_label("first", [0])
+    payload = b"".join(stream_view(LocalLoader(cache_dir.name), chunk_size=1000))
+    assert json.loads(payload) == json.loads(json.dumps(Plot.load(cache_dir.name).as_json()))
@@ -1,10 +1,30 @@
+import json
+import shutil
+import struct
 import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import pandas as pd
+import pytest
 
 from clusterfun.config import Config
+from clusterfun.models.filter import Filter
+from clusterfun.storage import get_loader
+from clusterfun.storage.local import loader as loader_module
+from clusterfun.storage.local.binary import BINARY_FILE, PREFIX, decode_data
+from clusterfun.storage.local.cache_manager import CacheManager, parse_bytes
+from clusterfun.storage.local.catalog import CATALOG_FILE, Catalog, get_directory_size, get_view_info
+from clusterfun.storage.local.data import get_data_dict
+from clusterfun.storage.local.dictionaries import read_dictionaries
+from clusterfun.storage.local.helpers import get_recent_dir
+from clusterfun.storage.local.ingest import get_pragmas
+from clusterfun.storage.local.label_manager import LabelManager
+from clusterfun.storage.local.loader import get_binary_data_path, record_access
+from clusterfun.storage.local.query import Query
 from clusterfun.storage.local.storer import LocalStorer
+from clusterfun.storage.parquet.storer import ParquetStorer
 
 
 def test_save():
@@ -18,3 +38,235 @@ def test_save():
         assert (tmpdir / "test" / "database.db").exists()
         assert (tmpdir / "test" / "config.json").exists()
         assert (tmpdir / "test" / "data.json").exists()
+
+
+def test_save_db_column_types(tmp_path):
+    storer = LocalStorer(tmp_path)
+    storer.uuid = "test"
+    storer.save_dir.mkdir()
+    df = pd.DataFrame()
+    df["img_path"] = ["a", "b", None]
+    df["a"] = [1, 2, 3]
+    df["b"] = [0.5, float("nan"), 1.5]
+    df["c"] = [True, False, True]
+    con = storer.save_db(Config("grid", media="img_path", columns=["id", "img_path", "a", "b", "c"]), df)
+    types = {row[1]: row[2] for row in con.execute("PRAGMA table_info(database)")}
+    assert types == {"id": "INTEGER", "img_path": "TEXT", "a": "INTEGER", "b": "REAL", "c": "INTEGER"}
+    assert con.execute("SELECT * FROM database").fetchall() == [
+        (0, "a", 1, 0.5, 1),
+        (1, "b", 2, None, 0),
+        (2, None, 3, 1.5, 1),
+    ]
+    # the connection is journaled again after the bulk insert
+    assert get_pragmas(con, ["journal_mode", "synchronous"]) == {"journal_mode": "delete", "synchronous": 2}
+
+
+def test_save_db_primary_key_and_indexes(tmp_path):
+    storer = LocalStorer(tmp_path)
+    storer.uuid = "test"
+    storer.save_dir.mkdir()
+    df = pd.DataFrame()
+    df["img_path"] = [f"{i}.png" for i in range(2000)]
+    df["x"] = [float(i) for i in range(2000)]
+    df["y"] = [float(i) for i in range(2000)]
+    df["color"] = [str(i % 3) for i in range(2000)]
+    df["unique"] = [str(i) for i in range(2000)]
+    df["extra"] = [str(i) for i in range(2000)]
+    cfg = Config(
+        "scatter",
+        media="img_path",
+        columns=["id", "img_path", "x", "y", "color", "unique", "extra"],
+        x="x",
+        y="y",
+        color="color",
+        indexed_columns=["extra"],
+    )
+    con = storer.save_db(cfg, df)
+    table_info = {row[1]: row for row in con.execute("PRAGMA table_info(database)")}
+    assert table_info["id"][5] == 1  # primary key
+    indexes = {row[1] for row in con.execute("PRAGMA index_list(database)")}
+    assert indexes == {"idx_database_x", "idx_database_y", "idx_database_color", "idx_database_extra"}
+
+
+@pytest.mark.parametrize("storer_cls", [LocalStorer, ParquetStorer])
+def test_save_chunks_with_local_media(tmp_path, storer_cls):
+    df = pd.read_csv(Path(__file__).parent / "samples" / "cifar10_embedding.csv")
+    cfg = Config("scatter", media="img_path", columns=["id", "img_path", "x", "y", "label"], x="x", y="y")
+    storer_cls(tmp_path).save_chunks("test", (df.iloc[i : i + 1000] for i in range(0, len(df), 1000)), cfg)
+    assert cfg.common_media_path == "/data/cifar10/test"
+    loader = get_loader("test", tmp_path)
+    result = loader.get_dataframe()
+    assert result["id"].tolist() == list(range(len(df)))
+    assert result["img_path"].iloc[0] == "/media/3/0.png"
+
+
+@pytest.mark.parametrize("plot_type", ["scatter", "bar"])
+def test_save_binary_data(tmp_path, plot_type):
+    df = pd.DataFrame()
+    df["img_path"] = [f"https://picsum.photos/{i}" for i in range(100)]
+    df["x"] = [i / 4 for i in range(100)] if plot_type == "scatter" else [["a", "b", None][i % 3] for i in range(100)]
+    df["y"] = [float(i % 7) for i in range(100)]
+    df["color"] = [["cat", "dog"][i % 2] for i in range(100)]
+    cfg = Config(
+        plot_type, media="img_path", columns=["id", "img_path", "x", "y", "color"], x="x", y="y", color="color"
+    )
+    LocalStorer(tmp_path).save("test", df, cfg)
+    loader = get_loader("test", cache_dir=tmp_path)
+    path = get_binary_data_path(loader)
+    assert path == tmp_path / "test" / BINARY_FILE
+    content = path.read_bytes()
+    assert decode_data(content) == loader.load_data()
+    # every buffer starts at a multiple of 8 bytes from the start of the file
+    _, _, header_length, _ = PREFIX.unpack_from(content)
+    header = json.loads(content[PREFIX.size : PREFIX.size + header_length])
+    offsets = [buffer["offset"] for trace in header["traces"] for buffer in trace["buffers"].values()]
+    assert len(offsets) > 0 and all((PREFIX.size + header_length + offset) % 8 == 0 for offset in offsets)
+
+    # the binary data is written on request for plots stored without it or with an older version of the format
+    path.unlink()
+    assert decode_data(get_binary_data_path(loader).read_bytes()) == loader.load_data()
+    path.write_bytes(b"CFUN" + struct.pack("<II", 1, 0))
+    assert decode_data(get_binary_data_path(loader).read_bytes()) == loader.load_data()
+
+
+def test_catalog(tmp_path):
+    df = pd.DataFrame()
+    df["img_path"] = ["a", "b", "c"]
+    df["x"] = [1.0, 2.0, 3.0]
+    for uuid in ["first", "second"]:
+        cfg = Config("scatter", media="img_path", columns=["id", "img_path", "x"], x="x", y="x", title=uuid)
+        LocalStorer(tmp_path).save(uuid, df, cfg)
+    LocalStorer(tmp_path).append("first", df)
+
+    views = Catalog(tmp_path).get_views()
+    assert [(view.uuid, view.rows, view.plot_type, view.title) for view in views] == [
+        ("second", 3, "scatter", "second"),
+        ("first", 6, "scatter", "first"),
+    ]
+    assert views[1].bytes == get_directory_size(tmp_path / "first")
+    assert get_recent_dir(tmp_path) == tmp_path / "second"
+
+    # views removed from the cache directory are removed from the catalog
+    shutil.rmtree(tmp_path / "second")
+    assert get_recent_dir(tmp_path) == tmp_path / "first"
+    assert [view.uuid for view in Catalog(tmp_path).get_views()] == ["first"]
+
+    # views stored without updating the catalog, e.g. by an older version, are found as the most recent view
+    shutil.copytree(tmp_path / "first", tmp_path / "copied")
+    assert get_recent_dir(tmp_path) == tmp_path / "copied"
+    assert [(view.uuid, view.rows) for view in Catalog(tmp_path).get_views()] == [("copied", 6), ("first", 6)]
+    shutil.rmtree(tmp_path / "copied")
+    assert get_recent_dir(tmp_path) == tmp_path / "first"
+
+    # the catalog is rebuilt from the cache directory if it does not exist
+    (tmp_path / CATALOG_FILE).unlink()
+    assert [(view.uuid, view.rows) for view in Catalog(tmp_path).get_views()] == [("first", 6)]
+
+    # concurrent rebuilds each write their own temporary file
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda _: Catalog(tmp_path).rebuild(), range(32)))
+    assert [view.uuid for view in Catalog(tmp_path).get_views()] == ["first"]
+    assert list(tmp_path.glob("*.tmp")) == []
+
+
+def test_cache_manager(tmp_path, monkeypatch):
+    df = pd.DataFrame()
+    df["img_path"] = ["a", "b", "c"]
+    df["x"] = [1.0, 2.0, 3.0]
+    cfg = Config("scatter", media="img_path", columns=["id", "img_path", "x"], x="x", y="x")
+    catalog = Catalog(tmp_path)
+    for idx, uuid in enumerate(["old", "labeled", "pinned", "used", "new"]):
+        LocalStorer(tmp_path).save(uuid, df, cfg)
+        catalog.record_access(uuid, idx)
+    LabelManager(tmp_path / "labeled").save_label("keep", [0])
+    catalog.set_pinned("pinned", True)
+    catalog.record_access("used", time.time())
+    view_bytes = get_directory_size(tmp_path / "new")
+
+    # the least recently used views are removed until the views fit in the budget,
+    # which the labeled and pinned views do not count toward
+    cache_manager = CacheManager(tmp_path, max_bytes=2 * view_bytes)
+    assert [view.uuid for view in cache_manager.collect(dry_run=True)] == ["old"]
+    assert (tmp_path / "old").exists()
+    assert [view.uuid for view in cache_manager.collect()] == ["old"]
+    assert not (tmp_path / "old").exists()
+    # nor does the view to keep, so a large view that was just saved does not push out the others
+    assert CacheManager(tmp_path, max_bytes=view_bytes + view_bytes // 2).collect(keep="new") == []
+
+    # views not opened for longer than the max age are removed after saving a plot
+    monkeypatch.setenv("CLUSTERFUN_CACHE_MAX_AGE_DAYS", "1")
+    LocalStorer(tmp_path).save("newest", df, cfg)
+    assert [view.uuid for view in catalog.get_views()] == ["newest", "used", "pinned", "labeled"]
+
+    # labeled and pinned views are never removed
+    assert [view.uuid for view in CacheManager(tmp_path, max_bytes=0).collect(keep="newest")] == ["used"]
+
+    # directories without a config are not views, so they are not registered or removed
+    (tmp_path / "notes").mkdir()
+    (tmp_path / "notes" / "todo.txt").write_text("keep me")
+    (tmp_path / CATALOG_FILE).unlink()
+    assert sorted(view.uuid for view in catalog.get_views()) == ["labeled", "newest", "pinned"]
+    catalog.set_pinned("pinned", True)
+    catalog.add(get_view_info(tmp_path / "notes", created=0))
+    assert [view.uuid for view in CacheManager(tmp_path, max_bytes=0).collect(keep="newest")] == []
+    assert (tmp_path / "notes" / "todo.txt").exists()
+    assert sorted(view.uuid for view in catalog.get_views()) == ["labeled", "newest", "pinned"]
+    assert parse_bytes("10G") == 10 * 1024**3
+
+
+@pytest.mark.parametrize("storer_cls", [LocalStorer, ParquetStorer])
+def test_save_dictionaries(tmp_path, storer_cls):
+    df = pd.DataFrame()
+    df["img_path"] = [f"{i}.jpg" for i in range(6)]
+    df["x"] = [float(i) for i in range(6)]
+    df["y"] = [float(i) for i in range(6)]
+    df["label"] = ["cat", "dog", None, "cat", "dog", "cat"]
+    cfg = Config("scatter", media="img_path", columns=["id", "img_path", "x", "y", "label"], x="x", y="y")
+    storer_cls(tmp_path).save("test", df, cfg)
+    assert read_dictionaries(tmp_path / "test") == {"label": frozenset({"cat", "dog"})}
+    storer_cls(tmp_path).append("test", df.assign(label="bird"))
+    loader = get_loader("test", tmp_path)
+    assert loader.state.dictionaries == {"label": frozenset({"cat", "dog", "bird"})}
+    # a value that is not in the dictionary makes the filter invalid, so it is skipped
+    data = loader.filter([Filter(column="label", comparison="IN", values=["bird", "fish"])])
+    assert sum(len(trace["id"]) for trace in data) == 12
+    data = loader.filter([Filter(column="label", comparison="IN", values=["bird", "dog"])])
+    assert sum(len(trace["id"]) for trace in data) == 8
+
+
+def test_get_data_dict_builds_the_traces_in_a_single_pass(tmp_path):
+    df = pd.DataFrame()
+    df["img_path"] = [f"{i}.jpg" for i in range(200)]
+    df["x"] = [float(i) for i in range(200)]
+    df["y"] = [float(i % 7) for i in range(200)]
+    df["label"] = [None if i % 50 == 0 else f"class_{(i * 7) % 30}" for i in range(200)]
+    cfg = Config(
+        "scatter", media="img_path", columns=["id", "img_path", "x", "y", "label"], x="x", y="y", color="label"
+    )
+    storer = LocalStorer(tmp_path)
+    storer.uuid = "test"
+    storer.save_dir.mkdir()
+    con = storer.save_db(cfg, df)
+    data, colors = get_data_dict(con, cfg)
+    assert colors == pd.unique(df["label"]).tolist()
+    for trace, color in zip(data, colors):
+        expected = df[df["label"].isna()] if color is None else df[df["label"] == color]
+        assert trace["name"] == color
+        assert trace["id"] == expected.index.tolist()
+        assert trace["x"] == expected["x"].tolist() and trace["y"] == expected["y"].tolist()
+
+    cfg.colors = colors
+    filtered, filtered_colors = get_data_dict(con, cfg, query_addition=Query("x >= ?", (100,)))
+    assert filtered_colors == colors
+    assert [trace["marker"]["color"] for trace in filtered] == [trace["marker"]["color"] for trace in data]
+    assert [trace["id"] for trace in filtered] == [[i for i in trace["id"] if i >= 100] for trace in data]
+
+
+def test_recorded_accesses_are_capped(tmp_path, monkeypatch):
+    monkeypatch.setattr(loader_module, "MAX_RECORDED_ACCESSES", 4)
+    monkeypatch.setattr(loader_module, "_RECORDED_ACCESSES", {})
+    for idx in range(10):
+        record_access(tmp_path / f"view-{idx}")
+        assert len(loader_module._RECORDED_ACCESSES) <= 4
+    # recent accesses are remembered, so they are not recorded again
+    assert tmp_path / "view-9" in loader_module._RECORDED_ACCESSES
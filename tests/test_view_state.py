@@ -0,0 +1,148 @@
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+from clusterfun.config import Config
+from clusterfun.storage.local.column_stats import STATS_FILE
+from clusterfun.storage.local.density import DENSITY_FILE
+from clusterfun.storage.local.loader import LocalLoader
+from clusterfun.storage.local.lru import LRUCache
+from clusterfun.storage.local.storer import LocalStorer
+from clusterfun.storage.local.view_state import VIEW_STATES
+
+
+def test_lru_cache():
+    evicted = []
+    cache = LRUCache(max_cost=3, on_evict=lambda key, value: evicted.append(key))
+    cache.put("a", 1)
+    cache.put("b", 2, cost=2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    # b was used least recently
+    assert evicted == ["b"]
+    assert cache.get("b") is None
+    assert cache.get("c", validate=lambda value: value != 3) is None
+    assert evicted == ["b", "c"]
+    cache.put("d", 4, cost=4)
+    assert cache.get("d") is None
+    assert cache.stats() == {
+        "entries": 1,
+        "cost": 1,
+        "max_cost": 3,
+        "hits": 1,
+        "misses": 3,
+        "evictions": 1,
+        "hit_rate": 0.25,
+    }
+
+
+def test_view_state_is_cached_until_files_change(tmp_path):
+    df = pd.DataFrame()
+    df["img_path"] = ["a", "b", "c"]
+    df["x"] = [1.0, 2.0, 3.0]
+    cfg = Config("scatter", media="img_path", columns=["id", "img_path", "x"], x="x", y="x", title="first")
+    LocalStorer(tmp_path).save("test", df, cfg)
+
+    state = LocalLoader("test", tmp_path).state
+    assert state.schema == {"id": "INTEGER", "img_path": "TEXT", "x": "REAL"}
+    hits = VIEW_STATES.stats()["hits"]
+    assert LocalLoader("test", tmp_path).state is state
+    assert VIEW_STATES.stats()["hits"] == hits + 1
+
+    # the returned config is a copy, so changing it does not change the cached state
+    config = LocalLoader("test", tmp_path).load_config()
+    config.columns.append("changed")
+    assert state.config.columns == ["id", "img_path", "x"]
+
+    loader = LocalLoader("test", tmp_path)
+    loader.label_manager.save_label("label", [1])
+    assert loader.load_config().labels == ["label"]
+    assert loader.state.labels == {"1": ["label"]}
+
+    cfg.title = "second"
+    storer = LocalStorer(tmp_path)
+    storer.uuid = "test"
+    storer.save_config(cfg)
+    assert loader.load_config().title == "second"
+
+    # labels saved at once by separate loaders are all kept, and no temporary files are left behind
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(lambda i: LocalLoader("test", tmp_path).label_manager.save_label(f"l{i}", [i]), range(32)))
+    labels = loader.label_manager.read_labels()
+    assert all(f"l{i}" in labels[str(i)] for i in range(32))
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(lambda i: storer.save_config(cfg), range(16)))
+    assert list(tmp_path.glob("test/*.tmp")) == []
+
+
+def test_connections_are_reused_and_read_only(tmp_path):
+    df = pd.DataFrame()
+    df["img_path"] = ["a", "b", "c"]
+    df["x"] = [1.0, 2.0, 3.0]
+    cfg = Config("scatter", media="img_path", columns=["id", "img_path", "x"], x="x", y="x")
+    LocalStorer(tmp_path).save("test", df, cfg)
+
+    con = LocalLoader("test", tmp_path).connection
+    assert LocalLoader("test", tmp_path).connection is con
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        assert executor.submit(lambda: LocalLoader("test", tmp_path).connection).result() is not con
+    with pytest.raises(sqlite3.OperationalError):
+        con.execute("DELETE FROM database")
+
+    # appending rows changes the database, so a new pool is opened and the old one is retired
+    pool = LocalLoader("test", tmp_path).state.connections
+    LocalStorer(tmp_path).append("test", df)
+    assert LocalLoader("test", tmp_path).fetch_row(5)[1] == "c"
+    assert pool.closed and len(pool) == 0
+    # the connections the retired pool handed out keep working for the threads still using them
+    assert con.execute("SELECT COUNT(*) FROM database").fetchone() == (6,)
+    with pytest.raises(sqlite3.ProgrammingError):
+        pool.get()
+
+
+def test_column_stats_of_legacy_views_are_saved(tmp_path):
+    df = pd.DataFrame()
+    df["img_path"] = ["a", "b", "c"]
+    df["x"] = [1.0, 2.0, None]
+    cfg = Config("grid", media="img_path", columns=["id", "img_path", "x"])
+    LocalStorer(tmp_path).save("test", df, cfg)
+    loader = LocalLoader("test", tmp_path)
+    stats = loader.state.column_stats
+    # views stored before the statistics were saved with them
+    (loader.cache_dir / STATS_FILE).unlink()
+    state = loader.state
+    assert state.column_stats == stats
+    assert (loader.cache_dir / STATS_FILE).exists()
+    # saving the statistics does not make the state out of date
+    assert loader.state is state
+
+
+def test_density_of_legacy_views_is_saved(tmp_path, monkeypatch):
+    df = pd.DataFrame()
+    df["img_path"] = ["a", "b", "c"]
+    df["x"] = [1.0, 2.0, 3.0]
+    df["label"] = ["cat", "dog", "cat"]
+    builds = []
+    compute_density = LocalLoader._compute_density
+
+    def count_builds(self, *args):
+        builds.append(self.uuid)
+        return compute_density(self, *args)
+
+    monkeypatch.setattr(LocalLoader, "_compute_density", count_builds)
+    for y in ["x", "label"]:
+        cfg = Config("scatter", media="img_path", columns=["id", "img_path", "x", "label"], x="x", y=y)
+        LocalStorer(tmp_path).save(y, df, cfg)
+        loader = LocalLoader(y, tmp_path)
+        density = loader.state.density
+        # views stored before the density pyramid was saved with them
+        (loader.cache_dir / DENSITY_FILE).unlink()
+        state = loader.state
+        assert (state.density is None) == (density is None) == (y == "label")
+        # the pyramid, or that the plot gets none, is saved, so it is not built again
+        assert loader.state is state
+        VIEW_STATES.invalidate(loader.cache_dir)
+        assert (loader.state.density is None) == (y == "label")
+    assert builds == ["x", "label"]